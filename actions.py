@@ -1,11 +1,188 @@
-import shutil
+import json
+from functools import lru_cache
 from pathlib import Path
+from typing import NamedTuple
 
-from utils.ar_utils import generate_mind_file, _create_img_light_version_if_needed
-from utils.shortid import build_safe_name
-from utils.utils import prompt, validate_file_exists, ensure_unique_filename, get_local_ip, _get_position_from_input
+from utils.asset_catalog import SIDECAR_SUFFIXES
+from utils.ar_utils import generate_mind_file, generate_mind_batch, build_ar_album_html, _create_img_light_version_if_needed
+from utils.shortid import build_safe_name, random_code
+from utils.job_runner import NO_LIMITS, StageGraph, StageLimits
+from utils.utils import prompt, ensure_unique_filename, validate_file_exists, _get_position_from_input, SAVED_DIR
 from utils.image_utils import add_qr_watermark
-from local_server import MEDIA_SUBDIR, get_port
+from utils.encoders import DEFAULT_ENCODE, EncodeOptions, output_suffix
+from utils.qr_utils import qr_version
+from local_server import (
+    MEDIA_SUBDIR, get_asset_catalog, get_media_store, get_short_links, local_base_url, publish_asset,
+    short_url
+)
+
+# TODO: Replace with your own ngrok URL (HTTPS is required).
+AR_PUBLIC_BASE_URL = "https://867bcdf3a993.ngrok-free.app"
+
+VIDEO_EXTENSIONS = {".mp4", ".webm", ".mov", ".m4v"}
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+
+AR_TEMPLATE = "template_ar.html"
+AR_ALBUM_TEMPLATE = "template_ar_album.html"
+
+# --- Setup shared by every action (and every job of a manifest run) ---
+
+@lru_cache(maxsize=None)
+def read_template(name: str) -> str:
+    template_path = Path(name)
+    if not template_path.exists():
+        raise FileNotFoundError(f"The template file '{template_path}' was not found!")
+    return template_path.read_text(encoding='utf-8')
+
+@lru_cache(maxsize=1)
+def media_dir() -> Path:
+    MEDIA_SUBDIR.mkdir(parents=True, exist_ok=True)
+    return MEDIA_SUBDIR
+
+def _watermarked_path(image_path: Path, encode: EncodeOptions = DEFAULT_ENCODE) -> Path:
+    suffix = output_suffix(encode, image_path)
+    return ensure_unique_filename(SAVED_DIR / f"{image_path.stem}_watermarked{suffix}", "image")
+
+# --- Non-interactive actions (used by the menu and by cli.py) ---
+
+def watermark_image(
+        image_path: Path,
+        content: str,
+        corner: str = "bottom-right",
+        output_path: Path | None = None,
+        stages: StageLimits = NO_LIMITS,
+        encode: EncodeOptions = DEFAULT_ENCODE
+) -> Path:
+    with stages.stage("cpu"):
+        return add_qr_watermark(image_path, content, corner=corner,
+                                output_path=output_path or _watermarked_path(image_path, encode), encode=encode)
+
+def create_memory_qr(
+        image_path: Path,
+        media_path: Path,
+        corner: str = "bottom-right",
+        output_path: Path | None = None,
+        stages: StageLimits = NO_LIMITS,
+        encode: EncodeOptions = DEFAULT_ENCODE
+) -> tuple[Path, str]:
+    """
+    Stores 'media_path' in public/media and watermarks the image with a short
+    local URL redirecting to it (returned with the image path).
+    """
+    with stages.stage("io"):
+        # Same content => same file and URL; known files are not copied (or even read) again
+        dest_path = get_media_store().store(media_path)
+
+    url = short_url(local_base_url(), dest_path)
+    return watermark_image(image_path, url, corner, output_path, stages, encode), url
+
+class LivePhotoResult(NamedTuple):
+    image_path: Path
+    page_url: str
+    # Short URL redirecting to page_url: what the QR code holds
+    qr_url: str
+    # Seconds spent in each stage of the workflow
+    timings: dict[str, float]
+
+def _discard(path: Path):
+    """Removes a file written by a stage, its precompressed sidecars and its catalog entry."""
+    for victim in (path, *(path.with_name(path.name + ext) for ext in SIDECAR_SUFFIXES)):
+        victim.unlink(missing_ok=True)
+    get_asset_catalog().forget(path)
+
+def create_ar_live_photo(
+        image_path: Path,
+        video_path: Path,
+        corner: str = "bottom-right",
+        output_path: Path | None = None,
+        public_base_url: str = AR_PUBLIC_BASE_URL,
+        stages: StageLimits = NO_LIMITS,
+        encode: EncodeOptions = DEFAULT_ENCODE
+) -> LivePhotoResult:
+    """
+    Creates a 'Live Photo' with AR (image tracking) using a .mind file:
+
+        downscale -> mind ----\
+        video ----------------+-> page
+        watermark
+
+    - downscale: shrinks the base image for the compiler (temporary file)
+    - mind: compiles it into /public/media/<name>.mind
+    - video: stores the video in /public/media
+    - watermark: applies the QR code (the page name is chosen up front)
+    - page: renders template_ar.html into /public/<page>.html
+
+    Independent stages run at the same time. If one fails, the files written by
+    the others are removed and the error is raised (RuntimeError when the .mind
+    file could not be generated); the temporary image is always removed.
+    """
+    template = read_template(AR_TEMPLATE)
+
+    final_html_name = f"{build_safe_name(image_path.stem, code_len=6)}.html"
+    ar_page_url = f"{public_base_url}/{final_html_name}"
+    # The shorter the URL, the lower the QR version: the code holds a redirect to the page
+    qr_url = short_url(public_base_url, f"/{final_html_name}")
+    output_path = output_path or _watermarked_path(image_path, encode)
+
+    def compile_mind(results: dict) -> Path:
+        resized_image_path = results["downscale"]
+        mind_dest_path = ensure_unique_filename(media_dir() / resized_image_path.with_suffix(".mind").name, "mind")
+        try:
+            mind_file = generate_mind_file(resized_image_path, mind_dest_path, preprocessed=True)
+        except BaseException:
+            _discard(mind_dest_path)
+            raise
+        if not mind_file:
+            _discard(mind_dest_path)
+            raise RuntimeError("failed to generate the .mind file.")
+        get_asset_catalog().record(mind_dest_path, "mind")
+        return mind_dest_path
+
+    def write_page(results: dict) -> Path:
+        video_url = f"{MEDIA_SUBDIR.name}/{results['video'].name}"
+        mind_url = f"{MEDIA_SUBDIR.name}/{results['mind'].name}"
+        html_content = template.replace("__VIDEO_URL__", video_url).replace("__MIND_FILE_URL__", mind_url)
+
+        final_html_path = MEDIA_SUBDIR.parent / final_html_name
+        try:
+            final_html_path.write_text(html_content, encoding='utf-8')
+            publish_asset(final_html_path)
+            publish_asset(results["mind"])
+            # The page keeps its .mind and video alive for as long as its QR code is
+            get_asset_catalog().record(final_html_path, "page", refs=[results["mind"], results["video"]])
+        except BaseException:
+            # Not undone by the graph: only finished stages are
+            _discard(final_html_path)
+            raise
+        return final_html_path
+
+    graph = StageGraph(stages)
+    graph.add("downscale", lambda r: _create_img_light_version_if_needed(image_path), kind="cpu")
+    graph.add("mind", compile_mind, deps=["downscale"], kind="node", undo=_discard)
+    # Stored media is content-addressed and may be shared with other pages: never undone
+    graph.add("video", lambda r: get_media_store().store(video_path), kind="io")
+    graph.add("watermark", lambda r: add_qr_watermark(image_path, qr_url, corner=corner,
+                                                      output_path=output_path, encode=encode),
+              kind="cpu", undo=_discard)
+    graph.add("page", write_page, deps=["mind", "video"], kind="io", undo=_discard)
+
+    try:
+        results = graph.run()
+    except BaseException:
+        get_short_links().remove_target(f"/{final_html_name}")
+        raise
+    finally:
+        resized_image_path = graph.results.get("downscale")
+        if resized_image_path and resized_image_path != image_path:
+            try:
+                resized_image_path.unlink()
+                print(f"Temporary file {resized_image_path} deleted.")
+            except OSError as e:
+                print(f"Error deleting temporary file {resized_image_path}: {e}")
+
+    return LivePhotoResult(results["watermark"], ar_page_url, qr_url, dict(graph.timings))
+
+# --- Interactive menu actions ---
 
 def action_add_watermark_qr():
     try:
@@ -22,8 +199,8 @@ def action_add_watermark_qr():
 
     try:
         print("\nApplying QR Code...")
-        out_path = add_qr_watermark(base_path, content, corner=position)
-        print(f"QR Code applied. Image saved to: {out_path}")
+        out_path = watermark_image(base_path, content, corner=position)
+        print(f"QR Code applied (version {qr_version(content)}). Image saved to: {out_path}")
     except Exception as e:
         print(f"Failed to apply QR Code: {e}")
 
@@ -41,101 +218,125 @@ def action_add_memory_qr():
         return
 
     try:
-        MEDIA_SUBDIR.mkdir(parents=True, exist_ok=True)
-        safe_name = build_safe_name(local_path, code_len=9, mode="hash+rand", include_slug=False)
-        dest_path = ensure_unique_filename(MEDIA_SUBDIR / safe_name)
-        shutil.copy2(str(local_path), str(dest_path))
-
-        port = get_port()
-        ip = get_local_ip()
-        url = f"http://{ip}:{port}/{dest_path.relative_to(MEDIA_SUBDIR.parent).as_posix()}"
-
         pos_input = prompt("Position (1: top-left, 2: top-right, 3: bottom-left, 4: bottom-right) [4]: ").strip() or "4"
         position = _get_position_from_input(pos_input)
 
         print("\nApplying QR Code watermark...")
-        add_qr_watermark(base_path, url, corner=position)
+        out_path, url = create_memory_qr(base_path, local_path, corner=position)
 
-        print(f"\nSuccess!")
-        print(f"Scan the QR on the image to access the media file at http://{ip}:{port}/")
+        print(f"\nSuccess! Image saved to: {out_path}")
+        print(f"Scan the QR on the image to access the media file at {url} (QR version {qr_version(url)})")
 
     except Exception as e:
         print(f"An error occurred during the process: {e}")
 
 def action_create_ar_live_photo():
-    """
-    Creates a 'Live Photo' with AR (image tracking) using a .mind file.
-    1) Generates .mind from the base image directly into /public/media
-    2) Copies the video to /public/media
-    3) Generates an HTML page from (template_ar.html) and copies to /public
-    4) Applies a QR code to the base image with a link to template_ar created
-    """
-    resized_image_path = None
+    """Interactive version of create_ar_live_photo()."""
     try:
         print("\n--- Creating a 'Live Photo' Experience with AR ---")
 
         base_image_path = Path(validate_file_exists(prompt("Full path to the base image: ").strip()))
         video_path = Path(validate_file_exists(prompt("Path to the video to be linked: ").strip()))
 
-        resized_image_path = _create_img_light_version_if_needed(base_image_path)
+        pos_input = prompt("\nQR Code Position (1: top-left, 2: top-right, 3: bottom-left, 4: bottom-right) [4]: ").strip() or "4"
+        position = _get_position_from_input(pos_input)
 
-        MEDIA_SUBDIR.mkdir(parents=True, exist_ok=True)
-        mind_filename = resized_image_path.with_suffix(".mind").name
-        mind_dest_path = ensure_unique_filename(MEDIA_SUBDIR / mind_filename)
+        print("\nCreating the AR experience...")
+        result = create_ar_live_photo(base_image_path, video_path, corner=position)
 
-        mind_file = generate_mind_file(resized_image_path, mind_dest_path)
+        print("\n✅ Success! AR experience created.")
+        print(f"Image with QR Code saved to: {result.image_path}")
+        print(f"Experience URL: {result.page_url}")
+        print(f"QR code URL: {result.qr_url} (version {qr_version(result.qr_url)})")
+        print("Stage timings: " + ", ".join(f"{name} {t:.2f}s" for name, t in result.timings.items()))
+        print("\n=== INSTRUCTIONS ===")
+        print("  1) Open the link on your phone and allow CAMERA access.")
+        print("  2) Point it at the base image to see the video overlay.")
 
-        if not mind_file:
-            print("Creation canceled: failed to generate the .mind file.")
-            return
+    except FileNotFoundError as e:
+        print(f"File error: {e}")
+    except RuntimeError as e:
+        print(f"Creation canceled: {e}")
+    except Exception as e:
+        print(f"An unexpected error occurred during the process: {e}")
+
+def _find_image_video_pairs(folder: Path) -> list[tuple[Path, Path]]:
+    # An image and a video with the same name (e.g. beach.jpg + beach.mp4) form one target
+    videos = {p.stem: p for p in folder.iterdir() if p.suffix.lower() in VIDEO_EXTENSIONS}
+    images = sorted(p for p in folder.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+    return [(img, videos[img.stem]) for img in images if img.stem in videos]
 
-        video_dest_path = ensure_unique_filename(MEDIA_SUBDIR / video_path.name)
-        shutil.copy2(str(video_path), str(video_dest_path))
+def action_create_ar_album():
+    """
+    Creates a multi-target AR album from a folder of image/video pairs.
+    1) Compiles all images into one .mind file (or shards of N images)
+    2) Stores the videos in /public/media
+    3) Generates one HTML page per .mind file, handling all of its targets
+    4) Applies a QR code to each image with a link to its page
+    """
+    print("\n--- Creating an AR Album ---")
 
-        ip = get_local_ip()
-        port = get_port()
+    folder = Path(prompt("Folder with the images and videos (same file names): ").strip()).expanduser().resolve()
+    if not folder.is_dir():
+        print(f"Error: Folder not found: {folder}")
+        return
 
-        video_url = f"{MEDIA_SUBDIR.name}/{video_dest_path.name}"
-        mind_url = f"{MEDIA_SUBDIR.name}/{mind_dest_path.name}"
+    pairs = _find_image_video_pairs(folder)
+    if not pairs:
+        print("No image/video pairs found (e.g. photo1.jpg + photo1.mp4).")
+        return
+    print(f"Found {len(pairs)} image/video pair(s).")
 
-        template_path = Path("template_ar.html")
-        if not template_path.exists():
-            print(f"ERROR: The template file '{template_path}' was not found!")
-            return
+    shard_input = prompt("Targets per .mind file (empty: all in one file): ").strip()
+    shard_size = int(shard_input) if shard_input.isdigit() and int(shard_input) > 0 else None
 
-        html_content = template_path.read_text(encoding='utf-8')
-        html_content = html_content.replace("__VIDEO_URL__", video_url)
-        html_content = html_content.replace("__MIND_FILE_URL__", mind_url)
+    pos_input = prompt("QR Code Position (1: top-left, 2: top-right, 3: bottom-left, 4: bottom-right) [4]: ").strip() or "4"
+    position = _get_position_from_input(pos_input)
 
-        final_html_name = f"{build_safe_name(base_image_path.stem, code_len=6)}.html"
-        final_html_path = MEDIA_SUBDIR.parent / final_html_name
-        final_html_path.write_text(html_content, encoding='utf-8')
+    try:
+        template = read_template(AR_ALBUM_TEMPLATE)
+    except FileNotFoundError as e:
+        print(f"ERROR: {e}")
+        return
 
-        # TODO: Replace with your own ngrok URL (HTTPS is required).
-        # For future implementation: The shorter the generated URL, the better for QR codes.
-        ar_page_url = f"https://867bcdf3a993.ngrok-free.app/{final_html_name}"
+    try:
+        album_name = f"album-{random_code(6)}"
+        videos = dict(pairs)
 
-        pos_input = prompt("\nQR Code Position (1: top-left, 2: top-right, 3: bottom-left, 4: bottom-right) [4]: ").strip() or "4"
-        position = _get_position_from_input(pos_input)
+        shards = generate_mind_batch([img for img, _ in pairs], media_dir(), name=album_name, shard_size=shard_size)
+        if not shards:
+            print("Creation canceled: failed to generate the .mind file(s).")
+            return
 
-        print("\nApplying QR Code that links to the AR experience...")
-        out_path = add_qr_watermark(base_image_path, ar_page_url, corner=position)
+        for shard in shards:
+            stored_videos = [get_media_store().store(videos[img]) for img in shard.images]
+            video_urls = [f"{MEDIA_SUBDIR.name}/{video.name}" for video in stored_videos]
+            mind_url = f"{MEDIA_SUBDIR.name}/{shard.mind_path.name}"
 
-        print("\n✅ Success! AR experience created.")
-        print(f"Image with QR Code saved to: {out_path}")
-        print(f"Experience URL: {ar_page_url}")
-        print("\n=== INSTRUCTIONS ===")
-        print("  1) Open the link on your phone and allow CAMERA access.")
-        print("  2) Point it at the base image to see the video overlay.")
+            page_name = f"{shard.mind_path.stem}.html"
+            page_path = MEDIA_SUBDIR.parent / page_name
+            page_path.write_text(build_ar_album_html(template, mind_url, video_urls), encoding='utf-8')
+            publish_asset(page_path)
+            publish_asset(shard.mind_path)
+            # Which target index is which image, for reference
+            targets_path = shard.mind_path.with_suffix(".targets.json")
+            targets_path.write_text(json.dumps([
+                {"index": i, "image": img.name, "video": url}
+                for i, (img, url) in enumerate(zip(shard.images, video_urls))
+            ], indent=2), encoding='utf-8')
+            catalog = get_asset_catalog()
+            catalog.record(shard.mind_path, "mind")
+            catalog.record(targets_path, "mind")
+            catalog.record(page_path, "page", refs=[shard.mind_path, targets_path, *stored_videos])
+
+            page_url = f"{AR_PUBLIC_BASE_URL}/{page_name}"
+            qr_url = short_url(AR_PUBLIC_BASE_URL, page_path)
+            print(f"\nPage {page_url} ({len(shard.images)} target(s)), QR {qr_url} (version {qr_version(qr_url)})")
+            for img in shard.images:
+                out_path = watermark_image(img, qr_url, corner=position)
+                print(f"  {img.name} -> {out_path}")
+
+        print("\n✅ Success! AR album created.")
 
-    except FileNotFoundError as e:
-        print(f"File error: {e}")
     except Exception as e:
         print(f"An unexpected error occurred during the process: {e}")
-    finally:
-        if resized_image_path and resized_image_path != base_image_path:
-            try:
-                resized_image_path.unlink()
-                print(f"Temporary file {resized_image_path} deleted.")
-            except OSError as e:
-                print(f"Error deleting temporary file {resized_image_path}: {e}")
\ No newline at end of file
@@ -0,0 +1,486 @@
+import asyncio
+import html
+import mimetypes
+import os
+import posixpath
+import sys
+import threading
+import time
+import urllib.parse
+from contextvars import ContextVar
+from email.utils import formatdate
+from http import HTTPStatus
+from pathlib import Path
+
+from utils import metrics
+from utils.asset_cache import (
+    HotAssetCache, accepted_encodings, is_compressible, open_precompressed, variant_etag
+)
+from utils.http_utils import (
+    IMMUTABLE_CACHE_CONTROL, cache_control_for, content_range, if_range_allows, is_not_modified,
+    make_etag, multipart_layout, new_boundary, parse_range
+)
+from utils.asset_catalog import AssetCatalog
+from utils.media_store import MediaStore
+from utils.short_links import ShortLinkTable, short_code_from_path
+from utils.watermark_variants import RENDER_PREFIX, WatermarkVariants, parse_render_path
+
+SERVER_NAME = "SmartQR-async"
+MAX_HEADER_LINES = 100
+MAX_LINE_BYTES = 8192
+# Request bodies up to this size are read and dropped to keep the connection; larger ones close it
+MAX_DISCARDED_BODY = 1024 * 1024
+
+
+class _Exchange:
+    """Status and body bytes of the response being sent, for utils.metrics."""
+    __slots__ = ("status", "body_bytes")
+
+    def __init__(self):
+        self.status = None
+        self.body_bytes = 0
+
+
+# Each connection is its own task (and context), and serves its requests in order
+_exchange: ContextVar[_Exchange | None] = ContextVar("_exchange", default=None)
+
+
+def _sent(n: int):
+    exchange = _exchange.get()
+    if exchange is not None:
+        exchange.body_bytes += n
+
+
+class _Headers(dict):
+    """Request headers with case-insensitive get(), as http_utils expects."""
+
+    def get(self, name, default=None):
+        return super().get(name.lower(), default)
+
+    def __contains__(self, name):
+        return super().__contains__(name.lower())
+
+
+class AsyncHTTPServer:
+    """
+    Static file server on a single asyncio event loop (in a background thread):
+    one coroutine per connection instead of one OS thread, HTTP/1.1 keep-alive,
+    and a cap on simultaneous connections (extra ones get a 503).
+
+    Serves the same responses as QuietHTTPRequestHandler for files: byte ranges,
+    ETags, conditional requests and cache headers, with bodies sent by
+    loop.sendfile() (os.sendfile when the platform allows), and the same
+    hot-asset cache and precompressed variants when 'asset_cache' is given, and
+    the same short-link redirects when 'short_links' is, the same index pages
+    and directory listings, and marks files sent as accessed in 'catalog'. Only objects of 'media_store' get long-lived caching.
+    Watermarked variants ('variants') are rendered on the
+    default executor, off the event loop; memory hits are answered inline.
+    """
+
+    def __init__(
+            self,
+            directory: Path,
+            host: str = "0.0.0.0",
+            port: int = 8000,
+            max_connections: int = 2048,
+            keepalive_timeout: float = 15.0,
+            asset_cache: HotAssetCache | None = None,
+            short_links: ShortLinkTable | None = None,
+            catalog: AssetCatalog | None = None,
+            variants: WatermarkVariants | None = None,
+            media_store: MediaStore | None = None
+    ):
+        self.directory = Path(directory).resolve()
+        self.host = host
+        self.max_connections = max_connections
+        self.keepalive_timeout = keepalive_timeout
+        self.asset_cache = asset_cache
+        self.short_links = short_links
+        self.catalog = catalog
+        self.variants = variants
+        self.media_store = media_store
+        self.active_connections = 0
+        self._loop = asyncio.new_event_loop()
+        self._server: asyncio.AbstractServer | None = None
+        self._stopped = threading.Event()
+
+        # Bind now, so a busy port raises OSError here like socketserver does
+        try:
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle_connection, host, port, backlog=1024, limit=MAX_LINE_BYTES * 2)
+            )
+        except:
+            self._loop.close()
+            raise
+        self.server_port = self._server.sockets[0].getsockname()[1]
+
+    # --- Lifecycle (same names as socketserver, so local_server can treat both alike) ---
+
+    def serve_forever(self):
+        asyncio.set_event_loop(self._loop)
+        self._stopped.clear()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._stopped.set()
+
+    def shutdown(self):
+        """Stops serve_forever() and waits for it to return."""
+        if self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._stopped.wait()
+
+    def server_close(self):
+        if self._loop.is_closed():
+            return
+        self._server.close()
+        self._loop.run_until_complete(self._cancel_connections())
+        self._loop.close()
+
+    async def _cancel_connections(self):
+        tasks = asyncio.all_tasks() - {asyncio.current_task()}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # --- Connection handling ---
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        if self.active_connections >= self.max_connections:
+            writer.write(self._head(HTTPStatus.SERVICE_UNAVAILABLE, {
+                "Retry-After": "1", "Content-Length": "0", "Connection": "close"
+            }))
+            await self._close(writer)
+            return
+
+        self.active_connections += 1
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), self.keepalive_timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+                    break
+                if request is None:
+                    break
+                exchange = _Exchange()
+                _exchange.set(exchange)
+                start = time.perf_counter()
+                try:
+                    keep_alive = await self._respond(writer, *request)
+                finally:
+                    if exchange.status is not None:
+                        metrics.record_request(request[0], exchange.status, time.perf_counter() - start,
+                                               exchange.body_bytes)
+        except (ConnectionError, OSError):
+            pass
+        except asyncio.CancelledError:
+            # Server shutdown: end quietly instead of leaving a cancelled task to the stream callback
+            pass
+        finally:
+            self.active_connections -= 1
+            await self._close(writer)
+
+    async def _close(self, writer: asyncio.StreamWriter):
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        line = await reader.readline()
+        if not line:
+            return None
+        parts = line.decode("latin-1").split()
+        if len(parts) != 3:
+            raise ValueError("Malformed request line")
+        method, target, version = parts
+
+        headers = _Headers()
+        for _ in range(MAX_HEADER_LINES):
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        else:
+            raise ValueError("Too many headers")
+        return method, target, version, headers, await self._discard_body(reader, headers)
+
+    async def _discard_body(self, reader: asyncio.StreamReader, headers: _Headers) -> bool:
+        """
+        Reads and drops the request body, so its bytes are not taken for the next
+        request; False if the connection must be closed instead (chunked, too large).
+        """
+        if "Transfer-Encoding" in headers:
+            return False
+        try:
+            length = int(headers.get("Content-Length") or 0)
+        except ValueError:
+            return False
+        if length < 0 or length > MAX_DISCARDED_BODY:
+            return False
+        if length:
+            await reader.readexactly(length)
+        return True
+
+    def _wants_keep_alive(self, version: str, headers: _Headers) -> bool:
+        connection = (headers.get("Connection") or "").lower()
+        if version == "HTTP/1.1":
+            return "close" not in connection
+        return "keep-alive" in connection
+
+    def _head(self, status: HTTPStatus, headers: dict) -> bytes:
+        exchange = _exchange.get()
+        if exchange is not None:
+            exchange.status = status.value
+        lines = [f"HTTP/1.1 {status.value} {status.phrase}", f"Server: {SERVER_NAME}",
+                 f"Date: {formatdate(usegmt=True)}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    async def _send_simple(self, writer, status: HTTPStatus, keep_alive: bool, extra: dict | None = None) -> bool:
+        body = b"" if status in (HTTPStatus.NOT_MODIFIED,) else f"{status.value} {status.phrase}\n".encode()
+        headers = {"Content-Type": "text/plain; charset=utf-8", "Content-Length": str(len(body))}
+        headers.update(extra or {})
+        headers["Connection"] = "keep-alive" if keep_alive else "close"
+        writer.write(self._head(status, headers) + body)
+        _sent(len(body))
+        await writer.drain()
+        return keep_alive
+
+    def _translate_path(self, url_path: str) -> Path | None:
+        # Same rules as SimpleHTTPRequestHandler.translate_path: no escaping the directory
+        path = posixpath.normpath(urllib.parse.unquote(url_path))
+        words = [w for w in path.split("/") if w and w not in (os.curdir, os.pardir)]
+        if any(os.sep in w or (os.altsep and os.altsep in w) for w in words):
+            return None
+        return self.directory.joinpath(*words)
+
+    def _validators(self, mtime: float, etag: str, url_path: str, path: Path) -> dict:
+        store = self.media_store
+        validators = {
+            "Accept-Ranges": "bytes",
+            "ETag": etag,
+            "Last-Modified": formatdate(mtime, usegmt=True),
+            "Cache-Control": cache_control_for(url_path, store.is_object if store else None),
+        }
+        if is_compressible(path):
+            validators["Vary"] = "Accept-Encoding"
+        return validators
+
+    async def _send_cached(self, writer, method: str, headers: _Headers, asset, path: Path, url_path: str,
+                           ctype: str, encodings: list[str], keep_alive: bool) -> bool:
+        encoding = asset.pick(encodings)
+        etag = variant_etag(asset.etag, encoding)
+        validators = self._validators(asset.mtime, etag, url_path, path)
+        if is_not_modified(headers, etag, asset.mtime):
+            return await self._send_simple(writer, HTTPStatus.NOT_MODIFIED, keep_alive, validators)
+
+        body = asset.bodies[encoding]
+        out_headers = {"Content-Type": ctype, "Content-Length": str(len(body))}
+        if encoding:
+            out_headers["Content-Encoding"] = encoding
+        out_headers.update(validators)
+        out_headers["Connection"] = "keep-alive" if keep_alive else "close"
+        writer.write(self._head(HTTPStatus.OK, out_headers))
+        if self.catalog is not None:
+            self.catalog.touch(path)
+        if method != "HEAD":
+            writer.write(body)
+            _sent(len(body))
+        await writer.drain()
+        return keep_alive
+
+    async def _send_variant(self, writer, method: str, headers: _Headers, url_path: str, keep_alive: bool) -> bool:
+        request = parse_render_path(url_path)
+        if request is None:
+            return await self._send_simple(writer, HTTPStatus.NOT_FOUND, keep_alive)
+        variant = self.variants.peek(request)
+        if variant is None:
+            try:
+                variant = await asyncio.get_running_loop().run_in_executor(
+                    None, self.variants.get, request
+                )
+            except Exception:
+                return await self._send_simple(writer, HTTPStatus.INTERNAL_SERVER_ERROR, keep_alive)
+            if variant is None:
+                return await self._send_simple(writer, HTTPStatus.NOT_FOUND, keep_alive)
+
+        validators = {"ETag": variant.etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+        if is_not_modified(headers, variant.etag, time.time()):
+            return await self._send_simple(writer, HTTPStatus.NOT_MODIFIED, keep_alive, validators)
+        writer.write(self._head(HTTPStatus.OK, {
+            "Content-Type": variant.content_type, "Content-Length": str(len(variant.body)), **validators,
+            "Connection": "keep-alive" if keep_alive else "close",
+        }))
+        if method != "HEAD":
+            writer.write(variant.body)
+            _sent(len(variant.body))
+        await writer.drain()
+        return keep_alive
+
+    async def _send_metrics(self, writer, method: str, keep_alive: bool) -> bool:
+        body = metrics.render_prometheus().encode("utf-8")
+        writer.write(self._head(HTTPStatus.OK, {
+            "Content-Type": metrics.PROMETHEUS_CONTENT_TYPE, "Content-Length": str(len(body)),
+            "Cache-Control": "no-store", "Connection": "keep-alive" if keep_alive else "close",
+        }))
+        if method != "HEAD":
+            writer.write(body)
+            _sent(len(body))
+        await writer.drain()
+        return keep_alive
+
+    async def _send_listing(self, writer, method: str, path: Path, url_path: str, keep_alive: bool) -> bool:
+        # Same page as SimpleHTTPRequestHandler.list_directory
+        try:
+            names = sorted(os.listdir(path), key=str.lower)
+        except OSError:
+            return await self._send_simple(writer, HTTPStatus.NOT_FOUND, keep_alive)
+        enc = sys.getfilesystemencoding()
+        title = f"Directory listing for {html.escape(urllib.parse.unquote(url_path), quote=False)}"
+        lines = ["<!DOCTYPE HTML>", '<html lang="en">', "<head>", f'<meta charset="{enc}">',
+                 f"<title>{title}</title>\n</head>", f"<body>\n<h1>{title}</h1>", "<hr>\n<ul>"]
+        for name in names:
+            full = path / name
+            display = link = name + "/" if full.is_dir() else name
+            if full.is_symlink():
+                display = name + "@"
+            lines.append(f'<li><a href="{urllib.parse.quote(link, errors="surrogatepass")}">'
+                         f'{html.escape(display, quote=False)}</a></li>')
+        lines.append("</ul>\n<hr>\n</body>\n</html>\n")
+        body = "\n".join(lines).encode(enc, "surrogateescape")
+        writer.write(self._head(HTTPStatus.OK, {
+            "Content-Type": f"text/html; charset={enc}", "Content-Length": str(len(body)),
+            "Connection": "keep-alive" if keep_alive else "close",
+        }))
+        if method != "HEAD":
+            writer.write(body)
+            _sent(len(body))
+        await writer.drain()
+        return keep_alive
+
+    async def _respond(self, writer, method: str, target: str, version: str, headers: _Headers,
+                       body_discarded: bool = True) -> bool:
+        keep_alive = body_discarded and self._wants_keep_alive(version, headers)
+        if method not in ("GET", "HEAD"):
+            return await self._send_simple(writer, HTTPStatus.NOT_IMPLEMENTED, keep_alive)
+
+        url_path = urllib.parse.urlsplit(target).path
+        if target == metrics.METRICS_PATH:
+            return await self._send_metrics(writer, method, keep_alive)
+        if self.short_links is not None:
+            code = short_code_from_path(url_path)
+            location = self.short_links.resolve(code) if code else None
+            if location is not None:
+                return await self._send_simple(writer, HTTPStatus.FOUND, keep_alive, {"Location": location})
+        if self.variants is not None and url_path.startswith(RENDER_PREFIX):
+            return await self._send_variant(writer, method, headers, url_path, keep_alive)
+        path = self._translate_path(url_path)
+        if path is None:
+            return await self._send_simple(writer, HTTPStatus.NOT_FOUND, keep_alive)
+
+        if path.is_dir():
+            # Like SimpleHTTPRequestHandler: add the slash, then index.html, index.htm or a listing
+            if not url_path.endswith("/"):
+                parts = urllib.parse.urlsplit(target)
+                location = urllib.parse.urlunsplit(("", "", parts.path + "/", parts.query, parts.fragment))
+                return await self._send_simple(writer, HTTPStatus.MOVED_PERMANENTLY, keep_alive,
+                                               {"Location": location})
+            index = next((path / name for name in ("index.html", "index.htm") if (path / name).is_file()), None)
+            if index is None:
+                return await self._send_listing(writer, method, path, url_path, keep_alive)
+            path = index
+        elif url_path.endswith("/"):
+            return await self._send_simple(writer, HTTPStatus.NOT_FOUND, keep_alive)
+
+        ctype = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        ranged = "Range" in headers
+        encodings = accepted_encodings(headers.get("Accept-Encoding")) if is_compressible(path) else []
+        if self.asset_cache is not None and not ranged:
+            # A miss stats, reads and may compress the file: off the event loop
+            asset = self.asset_cache.peek(str(path))
+            if asset is None:
+                asset = await asyncio.get_running_loop().run_in_executor(None, self.asset_cache.get, str(path))
+            if asset is not None:
+                return await self._send_cached(writer, method, headers, asset, path, url_path, ctype,
+                                               encodings, keep_alive)
+
+        try:
+            f = open(path, "rb")
+        except OSError:
+            return await self._send_simple(writer, HTTPStatus.NOT_FOUND, keep_alive)
+
+        encoding = None
+        fs = os.fstat(f.fileno())
+        etag = make_etag(fs)
+        mtime = fs.st_mtime
+        variant = open_precompressed(str(path), fs, encodings) if encodings and not ranged else None
+        if variant is not None:
+            encoding, variant_file, fs = variant
+            f.close()
+            f = variant_file
+            etag = variant_etag(etag, encoding)
+
+        with f:
+            size = fs.st_size
+            validators = self._validators(mtime, etag, url_path, path)
+
+            if is_not_modified(headers, etag, mtime):
+                return await self._send_simple(writer, HTTPStatus.NOT_MODIFIED, keep_alive, validators)
+
+            ranges = None
+            if ranged and if_range_allows(headers, etag, mtime):
+                ranges = parse_range(headers.get("Range"), size)
+            if ranges == []:
+                return await self._send_simple(writer, HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE, keep_alive,
+                                               {"Content-Range": f"bytes */{size}", **validators})
+
+            multipart = None
+            if ranges and len(ranges) == 1:
+                start, end = ranges[0]
+                status = HTTPStatus.PARTIAL_CONTENT
+                out_headers = {"Content-Type": ctype, "Content-Range": content_range(start, end, size),
+                               "Content-Length": str(end - start + 1)}
+            elif ranges:
+                boundary = new_boundary()
+                parts, closing, length = multipart_layout(ranges, size, ctype, boundary)
+                multipart = (parts, closing)
+                status = HTTPStatus.PARTIAL_CONTENT
+                out_headers = {"Content-Type": f"multipart/byteranges; boundary={boundary}",
+                               "Content-Length": str(length)}
+            else:
+                status = HTTPStatus.OK
+                out_headers = {"Content-Type": ctype, "Content-Length": str(size)}
+                if encoding:
+                    out_headers["Content-Encoding"] = encoding
+
+            out_headers.update(validators)
+            out_headers["Connection"] = "keep-alive" if keep_alive else "close"
+            writer.write(self._head(status, out_headers))
+            if self.catalog is not None:
+                self.catalog.touch(path)
+            if method == "HEAD":
+                await writer.drain()
+                return keep_alive
+
+            loop = asyncio.get_running_loop()
+            if multipart:
+                parts, closing = multipart
+                for part_header, start, end in parts:
+                    writer.write(part_header)
+                    await writer.drain()
+                    _sent(len(part_header) + await loop.sendfile(writer.transport, f, start, end - start + 1))
+                writer.write(closing)
+                _sent(len(closing))
+            elif ranges:
+                start, end = ranges[0]
+                await writer.drain()
+                _sent(await loop.sendfile(writer.transport, f, start, end - start + 1))
+            else:
+                await writer.drain()
+                _sent(await loop.sendfile(writer.transport, f, 0, size))
+            await writer.drain()
+        return keep_alive
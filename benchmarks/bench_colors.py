@@ -0,0 +1,114 @@
+"""
+Compares the NumPy color engine (utils.color_utils) with the original per-patch
+PIL quantize + colorsys implementation, on random corner patches of the example images.
+
+    python -m benchmarks.bench_colors [--patches 400]
+"""
+import argparse
+import colorsys
+import random
+import time
+from pathlib import Path
+
+from PIL import Image
+
+from utils.color_utils import pick_qr_colors
+
+EXAMPLE_DIR = Path(__file__).resolve().parent.parent / "example"
+
+
+# --- Original scalar implementation, kept here as the reference ---
+
+def _legacy_find_dominant_colors(img, k):
+    sm_img = img.convert("RGB").resize((128, 128), Image.Resampling.BOX)
+    palette = sm_img.quantize(colors=k, method=Image.Quantize.MEDIANCUT).getpalette()
+    return [tuple(palette[i * 3:i * 3 + 3]) for i in range(k)]
+
+def _legacy_luminance(rgb):
+    r, g, b = [v / 255.0 for v in rgb]
+    return 0.2126 * r + 0.7152 * g + 0.0722 * b
+
+def _legacy_contrast(rgb1, rgb2):
+    l1, l2 = _legacy_luminance(rgb1), _legacy_luminance(rgb2)
+    if l1 < l2:
+        l1, l2 = l2, l1
+    return (l1 + 0.05) / (l2 + 0.05)
+
+def _legacy_tune(rgb, new_v):
+    h, s, v = colorsys.rgb_to_hsv(*(c / 255.0 for c in rgb))
+    v = max(0.0, min(1.0, new_v))
+    return tuple(int(round(x * 255)) for x in colorsys.hsv_to_rgb(h, s, v))
+
+def _legacy_ensure_min_contrast(fg, bg, min_ratio, max_steps=12):
+    if _legacy_contrast(fg, bg) >= min_ratio:
+        return bg
+    darker = _legacy_luminance(bg) < _legacy_luminance(fg)
+    h, s, v = colorsys.rgb_to_hsv(*(c / 255.0 for c in bg))
+    for i in range(1, max_steps + 1):
+        step = 0.06 + 0.02 * i
+        new_v = v * (1.0 - step) if darker else v + (1.0 - v) * step
+        candidate = _legacy_tune(bg, new_v)
+        if _legacy_contrast(fg, candidate) >= min_ratio:
+            return candidate
+        v = new_v
+    return _legacy_tune(bg, v)
+
+def legacy_pick_qr_colors(patches, min_contrast):
+    out = []
+    for patch in patches:
+        c1, c2 = _legacy_find_dominant_colors(patch, 2)
+        module, bg = (c1, c2) if _legacy_luminance(c1) < _legacy_luminance(c2) else (c2, c1)
+        out.append((module, _legacy_ensure_min_contrast(module, bg, min_contrast)))
+    return out
+
+
+def make_patches(count: int, seed: int = 0) -> list[Image.Image]:
+    rng = random.Random(seed)
+    images = [Image.open(p).convert("RGB") for p in sorted(EXAMPLE_DIR.glob("*.jpg")) + sorted(EXAMPLE_DIR.glob("*.png"))]
+    patches = []
+    for i in range(count):
+        img = images[i % len(images)]
+        side = rng.randint(64, min(img.size) // 2)
+        x, y = rng.randint(0, img.width - side), rng.randint(0, img.height - side)
+        patches.append(img.crop((x, y, x + side, y + side)))
+    return patches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--patches", type=int, default=400)
+    parser.add_argument("--min-contrast", type=float, default=2.3)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    patches = make_patches(args.patches)
+
+    def best_of(fn):
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = fn()
+            best = min(best, time.perf_counter() - start)
+        return best, result
+
+    legacy_t, legacy = best_of(lambda: legacy_pick_qr_colors(patches, args.min_contrast))
+    single_t, _ = best_of(lambda: [pick_qr_colors([p], args.min_contrast)[0] for p in patches])
+    batch_t, batch = best_of(lambda: pick_qr_colors(patches, args.min_contrast))
+
+    max_diff = max(
+        abs(a - b)
+        for old, new in zip(legacy, batch)
+        for old_c, new_c in zip(old, new)
+        for a, b in zip(old_c, new_c)
+    )
+    mismatches = sum(old != new for old, new in zip(legacy, batch))
+
+    print(f"patches: {len(patches)}")
+    print(f"legacy (PIL quantize + colorsys): {legacy_t * 1000:8.1f} ms")
+    print(f"numpy, one patch per call:        {single_t * 1000:8.1f} ms  ({legacy_t / single_t:.1f}x)")
+    print(f"numpy, whole batch in one call:   {batch_t * 1000:8.1f} ms  ({legacy_t / batch_t:.1f}x)")
+    print(f"color mismatches: {mismatches}, max channel difference: {max_diff}")
+
+
+if __name__ == "__main__":
+    main()
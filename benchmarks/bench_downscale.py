@@ -0,0 +1,105 @@
+"""
+Time and peak memory of the AR target downscale (_create_img_light_version_if_needed)
+against the previous full-decode + copy implementation, on a synthetic large JPEG.
+Each variant runs in a fresh process so its peak RSS is measured in isolation.
+
+    python -m benchmarks.bench_downscale [--megapixels 48] [--runs 3]
+"""
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parent.parent
+
+_CHILD = r"""
+import json, resource, sys, time
+from pathlib import Path
+sys.path.insert(0, sys.argv[3])
+from PIL import Image
+
+def legacy(image_path):
+    with Image.open(image_path) as img:
+        if img.width * img.height > 1920 * 1080:
+            img_copy = img.copy()
+            img_copy.thumbnail((1920, 1080), Image.Resampling.LANCZOS)
+            temp_path = image_path.with_name(f"{image_path.stem}_fhd_temp.jpg")
+            img_copy.convert("RGB").save(temp_path, "JPEG", quality=90)
+            return temp_path
+    return image_path
+
+variant, source = sys.argv[1], Path(sys.argv[2])
+if variant == "legacy":
+    fn = legacy
+else:
+    from utils.ar_utils import _create_img_light_version_if_needed as fn
+
+start = time.perf_counter()
+out = fn(source)
+elapsed = time.perf_counter() - start
+with Image.open(out) as img:
+    size = img.size
+out.unlink()
+
+def peak_rss_mb():
+    # VmHWM belongs to this process image; ru_maxrss may include the parent's peak before exec
+    try:
+        for line in open("/proc/self/status"):
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+print(json.dumps({
+    "seconds": elapsed,
+    "peak_rss_mb": peak_rss_mb(),
+    "size": size,
+}))
+"""
+
+
+def make_jpeg(path: Path, megapixels: float):
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    # Smooth gradients plus noise: compresses like a photo, unlike pure noise
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([x / width * 255, y / height * 255, (x + y) / (width + height) * 255], axis=-1)
+    noise = np.random.default_rng(0).normal(0, 12, base.shape).astype(np.float32)
+    Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8)).save(path, "JPEG", quality=92)
+    return width, height
+
+
+def run(variant: str, source: Path) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", _CHILD, variant, str(source), str(ROOT)],
+        capture_output=True, text=True, check=True, cwd=str(ROOT)
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--megapixels", type=float, default=48)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp) / "large.jpg"
+        width, height = make_jpeg(source, args.megapixels)
+        print(f"source: {width}x{height} JPEG ({source.stat().st_size / 1e6:.1f} MB)")
+
+        for variant in ("legacy", "current"):
+            runs = [run(variant, source) for _ in range(args.runs)]
+            best = min(r["seconds"] for r in runs)
+            rss = max(r["peak_rss_mb"] for r in runs)
+            print(f"{variant:8s} best {best * 1000:8.1f} ms   peak RSS {rss:7.1f} MB   output {runs[0]['size']}")
+
+
+if __name__ == "__main__":
+    main()
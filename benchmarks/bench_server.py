@@ -0,0 +1,106 @@
+"""
+Local server throughput: many clients downloading one large file at the same time,
+with the sendfile() path and with the userspace copy. The server runs in its own
+process so its CPU time can be reported separately from the clients.
+
+    python -m benchmarks.bench_server [--size-mb 500] [--clients 50]
+"""
+import argparse
+import json
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+_SERVER = r"""
+import json, resource, sys
+sys.path.insert(0, sys.argv[1])
+import local_server
+local_server.QuietHTTPRequestHandler.use_sendfile = sys.argv[2] == "1"
+port = local_server.start_local_server()
+print(port, flush=True)
+sys.stdin.read()
+local_server.stop_local_server()
+usage = resource.getrusage(resource.RUSAGE_SELF)
+print(json.dumps({"user": usage.ru_utime, "system": usage.ru_stime}), flush=True)
+"""
+
+
+def make_file(path: Path, size_mb: int):
+    block = bytes(range(256)) * 4096  # 1 MiB
+    with open(path, "wb") as f:
+        for _ in range(size_mb):
+            f.write(block)
+
+
+def download(port: int, path: str, results: list, index: int):
+    buf = bytearray(1 << 20)
+    received = 0
+    start = time.perf_counter()
+    with socket.create_connection(("127.0.0.1", port)) as s:
+        s.sendall(f"GET {path} HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n".encode())
+        while True:
+            n = s.recv_into(buf)
+            if not n:
+                break
+            received += n
+    results[index] = (received, time.perf_counter() - start)
+
+
+def run_variant(public_dir: Path, use_sendfile: bool, clients: int) -> dict:
+    args = [sys.executable, "-c", _SERVER, str(ROOT), "1" if use_sendfile else "0"]
+    server = subprocess.Popen(args, cwd=str(public_dir.parent), stdin=subprocess.PIPE,
+                              stdout=subprocess.PIPE, text=True)
+    port = int(server.stdout.readline())
+
+    results = [None] * clients
+    threads = [threading.Thread(target=download, args=(port, "/media/big.bin", results, i)) for i in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+
+    server.stdin.close()
+    cpu = json.loads(server.stdout.readline())
+    server.wait()
+
+    total = sum(r[0] for r in results)
+    latencies = sorted(r[1] for r in results)
+    return {
+        "sendfile": use_sendfile,
+        "wall_s": wall,
+        "throughput_mb_s": total / wall / 1e6,
+        "server_cpu_s": cpu["user"] + cpu["system"],
+        "p50_s": latencies[len(latencies) // 2],
+        "max_s": latencies[-1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=500)
+    parser.add_argument("--clients", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        public_dir = Path(tmp) / "public"
+        (public_dir / "media").mkdir(parents=True)
+        make_file(public_dir / "media" / "big.bin", args.size_mb)
+        print(f"{args.clients} clients x {args.size_mb} MB")
+
+        for use_sendfile in (False, True):
+            r = run_variant(public_dir, use_sendfile, args.clients)
+            label = "sendfile" if use_sendfile else "copyfileobj"
+            print(f"{label:12s} {r['throughput_mb_s']:9.0f} MB/s   wall {r['wall_s']:6.2f}s   "
+                  f"server CPU {r['server_cpu_s']:6.2f}s   p50 {r['p50_s']:.2f}s   max {r['max_s']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
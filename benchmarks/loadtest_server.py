@@ -0,0 +1,211 @@
+"""
+Local server load test: many slow clients (think phones on venue Wi-Fi) downloading
+a video at once, against the threaded and the asyncio server modes. For each level
+of concurrency it reports throughput, latency, errors, and the server's peak
+threads, peak memory and CPU time (the server runs in its own process).
+
+    python -m benchmarks.loadtest_server [--clients 100 500 1000] [--size-mb 8]
+                                         [--rate-kb 2048] [--modes threaded asyncio]
+"""
+import argparse
+import asyncio
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+_SERVER = r"""
+import json, resource, sys
+sys.path.insert(0, sys.argv[1])
+import local_server
+port = local_server.start_local_server(mode=sys.argv[2], max_connections=int(sys.argv[3]))
+print(port, flush=True)
+sys.stdin.read()
+local_server.stop_local_server()
+usage = resource.getrusage(resource.RUSAGE_SELF)
+print(json.dumps({"user": usage.ru_utime, "system": usage.ru_stime}), flush=True)
+"""
+
+
+def make_file(path: Path, size_mb: int):
+    block = bytes(range(256)) * 4096  # 1 MiB
+    with open(path, "wb") as f:
+        for _ in range(size_mb):
+            f.write(block)
+
+
+def _proc_status(pid: int) -> dict[str, int]:
+    values = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in ("Threads", "VmHWM", "VmRSS"):
+                    values[key] = int(rest.split()[0])
+    except OSError:
+        pass
+    return values
+
+
+class _Sampler(threading.Thread):
+    """Polls the server's thread count while the load runs."""
+
+    def __init__(self, pid: int, interval: float = 0.05):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_threads = 0
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.is_set():
+            self.peak_threads = max(self.peak_threads, _proc_status(self.pid).get("Threads", 0))
+            time.sleep(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+async def _client(port: int, path: str, rate: int, requests: int) -> tuple[int, float, bool]:
+    """
+    Downloads 'path' 'requests' times, reading at most 'rate' bytes/s. The connection
+    is reused while the server keeps it alive (the threaded mode speaks HTTP/1.0).
+    """
+    start = time.perf_counter()
+    received = 0
+    chunk = max(4096, rate // 20)
+    reader = writer = None
+    try:
+        for i in range(requests):
+            if writer is None:
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            last = i == requests - 1
+            writer.write(
+                f"GET {path} HTTP/1.1\r\nHost: load\r\nConnection: {'close' if last else 'keep-alive'}\r\n\r\n".encode()
+            )
+            status = await reader.readline()
+            if status[:8] not in (b"HTTP/1.1", b"HTTP/1.0") or status[9:12] != b"200":
+                return received, time.perf_counter() - start, False
+            length = 0
+            keep_alive = status.startswith(b"HTTP/1.1")
+            while (line := await reader.readline()) not in (b"\r\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                name, value = name.strip().lower(), value.strip().lower()
+                if name == "content-length":
+                    length = int(value)
+                elif name == "connection":
+                    keep_alive = value == "keep-alive"
+
+            remaining = length
+            window = time.perf_counter()
+            while remaining:
+                data = await reader.read(min(chunk, remaining))
+                if not data:
+                    return received, time.perf_counter() - start, False
+                remaining -= len(data)
+                received += len(data)
+                # Throttle: sleep until this client's budget allows the bytes just read
+                delay = len(data) / rate - (time.perf_counter() - window)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                window = time.perf_counter()
+
+            if not keep_alive:
+                writer.close()
+                writer = None
+    except (OSError, asyncio.IncompleteReadError):
+        return received, time.perf_counter() - start, False
+    finally:
+        if writer is not None:
+            writer.close()
+    return received, time.perf_counter() - start, True
+
+
+async def _load(port: int, clients: int, rate: int, requests: int):
+    return await asyncio.gather(*(_client(port, "/media/video.bin", rate, requests) for _ in range(clients)))
+
+
+def run_level(public_dir: Path, mode: str, clients: int, rate: int, requests: int, max_connections: int) -> dict:
+    args = [sys.executable, "-c", _SERVER, str(ROOT), mode, str(max_connections)]
+    server = subprocess.Popen(args, cwd=str(public_dir.parent), stdin=subprocess.PIPE,
+                              stdout=subprocess.PIPE, text=True)
+    port = int(server.stdout.readline())
+    sampler = _Sampler(server.pid)
+    sampler.start()
+
+    start = time.perf_counter()
+    results = asyncio.run(_load(port, clients, rate, requests))
+    wall = time.perf_counter() - start
+
+    sampler.stop()
+    status = _proc_status(server.pid)
+    server.stdin.close()
+    cpu = json.loads(server.stdout.readline())
+    server.wait()
+
+    done = [r for r in results if r[2]]
+    latencies = sorted(r[1] for r in done) or [0.0]
+    return {
+        "mode": mode,
+        "clients": clients,
+        "ok": len(done),
+        "errors": clients - len(done),
+        "wall_s": wall,
+        "throughput_mb_s": sum(r[0] for r in results) / wall / 1e6,
+        "p50_s": latencies[len(latencies) // 2],
+        "p99_s": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "server_peak_threads": sampler.peak_threads,
+        "server_peak_rss_mb": status.get("VmHWM", 0) / 1024,
+        "server_cpu_s": cpu["user"] + cpu["system"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, nargs="+", default=[100, 500, 1000])
+    parser.add_argument("--size-mb", type=int, default=8)
+    parser.add_argument("--rate-kb", type=int, default=2048, help="per-client read rate, KiB/s")
+    parser.add_argument("--requests", type=int, default=2, help="downloads per keep-alive connection")
+    parser.add_argument("--max-connections", type=int, default=4096)
+    parser.add_argument("--modes", nargs="+", default=["threaded", "asyncio"])
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    # Both the clients and the threaded server need one descriptor per connection
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = max(args.clients) * 2 + 256
+    if soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(wanted, hard), hard))
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        public_dir = Path(tmp) / "public"
+        (public_dir / "media").mkdir(parents=True)
+        make_file(public_dir / "media" / "video.bin", args.size_mb)
+        if not args.json:
+            print(f"{args.size_mb} MB file, {args.requests} downloads per connection, "
+                  f"{args.rate_kb} KiB/s per client")
+
+        for clients in args.clients:
+            for mode in args.modes:
+                r = run_level(public_dir, mode, clients, args.rate_kb * 1024, args.requests, args.max_connections)
+                rows.append(r)
+                if not args.json:
+                    print(f"{mode:9s} {clients:5d} clients  {r['throughput_mb_s']:8.0f} MB/s  "
+                          f"p50 {r['p50_s']:6.2f}s  p99 {r['p99_s']:6.2f}s  errors {r['errors']:4d}  "
+                          f"threads {r['server_peak_threads']:5d}  RSS {r['server_peak_rss_mb']:6.1f} MB  "
+                          f"CPU {r['server_cpu_s']:6.2f}s")
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,489 @@
+"""
+Benchmark suite: watermarking, output encoding, QR generation, hashing, AR target
+downscale, .mind compilation, local server throughput and the startup cost of a
+'python main.py' call, on synthetic images (1 to 50 MP), media files and QR payloads. Every case runs in a fresh process, so its peak RSS is its own.
+
+Results (latency percentiles, throughput, peak RSS and, for the encode cases, the
+output size) are written as JSON, and can be
+compared against a saved baseline: the exit code is 1 if any case got slower than
+the baseline p50 by more than --tolerance.
+
+    python -m benchmarks.suite [--megapixels 1 12 50] [--media-mb 64 512] [--repeat 5]
+                               [--only watermark encode qr hash downscale mind server render startup]
+                               [--output results.json] [--baseline baseline.json]
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+GROUPS = ("watermark", "encode", "qr", "hash", "downscale", "mind", "server", "render", "startup")
+ENCODE_FORMATS = ("png", "jpeg", "webp")
+QR_PAYLOAD_LENGTHS = (32, 256, 1024)
+
+
+# --- Synthetic inputs (created by the parent, shared by the cases) ---
+
+def make_image(path: Path, megapixels: float) -> tuple[int, int]:
+    """A photo-like JPEG (gradients plus noise), generated in strips to keep memory flat."""
+    import numpy as np
+    from PIL import Image
+
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    image = Image.new("RGB", (width, height))
+    rng = np.random.default_rng(0)
+    x = np.arange(width, dtype=np.float32)
+    for top in range(0, height, 256):
+        rows = min(256, height - top)
+        y = np.arange(top, top + rows, dtype=np.float32)[:, None]
+        strip = np.stack([
+            np.broadcast_to(x / width * 255, (rows, width)),
+            np.broadcast_to(y / height * 255, (rows, width)),
+            (x + y) / (width + height) * 255,
+        ], axis=-1)
+        strip += rng.normal(0, 12, strip.shape).astype(np.float32)
+        image.paste(Image.fromarray(np.clip(strip, 0, 255).astype(np.uint8)), (0, top))
+    image.save(path, "JPEG", quality=92)
+    return width, height
+
+
+def make_media(path: Path, size_mb: int):
+    block = os.urandom(1 << 20)
+    with open(path, "wb") as f:
+        for _ in range(size_mb):
+            f.write(block)
+
+
+def qr_payload(length: int, salt: int = 0) -> str:
+    base = f"https://example.com/m/{salt:08d}/"
+    return (base + "x" * length)[:max(length, len(base))]
+
+
+# --- Cases (run in the child process) ---
+
+def _case_watermark(params: dict, tmp: Path):
+    from utils.image_utils import add_qr_watermark
+    source = Path(params["image"])
+    out = tmp / "out.png"
+
+    def run(i):
+        add_qr_watermark(source, qr_payload(64), output_path=out)
+        out.unlink()
+    return run, params["megapixels"], "MP/s"
+
+
+def _case_encode(params: dict, tmp: Path):
+    from PIL import Image
+    from utils.encoders import EncodeOptions, encode_image, source_metadata
+    from utils.image_utils import _load_as_rgb
+
+    # Decoded once: only the encoder is timed
+    source = Image.open(params["image"])
+    source.load()
+    metadata = source_metadata(source)
+    image = _load_as_rgb(source)
+    options = EncodeOptions(params["format"], params["preset"])
+    source_size = Path(params["image"]).stat().st_size
+
+    def run(i):
+        out = tmp / f"out-{i}"
+        encode_image(image, out, options, metadata)
+        size = out.stat().st_size
+        out.unlink()
+        return {"output_mb": size / 1e6, "size_vs_source": size / source_size}
+    return run, params["megapixels"], "MP/s"
+
+
+def _case_qr(params: dict, tmp: Path):
+    from utils import qr_utils
+    cached = params["cached"]
+    length = params["length"]
+
+    def run(i):
+        # Unique payloads miss the matrix cache; a fixed one measures the cached path
+        qr_utils.generate_qr_image(qr_payload(length, 0 if cached else i + 1))
+    return run, 1, "codes/s"
+
+
+def _case_hash(params: dict, tmp: Path):
+    from utils.shortid import hash_code_from_file
+    source = Path(params["media"])
+
+    def run(i):
+        hash_code_from_file(source)
+    return run, params["size_mb"], "MB/s"
+
+
+def _case_downscale(params: dict, tmp: Path):
+    from utils.ar_utils import _create_img_light_version_if_needed
+    source = tmp / "source.jpg"
+    shutil.copy(params["image"], source)
+
+    def run(i):
+        out = _create_img_light_version_if_needed(source)
+        if out != source:
+            out.unlink()
+    return run, params["megapixels"], "MP/s"
+
+
+def _case_mind(params: dict, tmp: Path):
+    from utils import ar_utils
+    from utils.mind_cache import MindCache
+    source = Path(params["image"])
+
+    def run(i):
+        # A fresh, empty cache every time: this measures compilation, not cache hits
+        ar_utils.mind_cache = MindCache(tmp / f"cache-{i}")
+        out = tmp / f"target-{i}.mind"
+        if not ar_utils.generate_mind_file(source, out):
+            raise RuntimeError("The .mind compilation failed.")
+        out.unlink()
+    return run, 1, "targets/s"
+
+
+def _case_server(params: dict, tmp: Path):
+    import socket
+    import local_server
+
+    public_dir = Path(params["public_dir"])
+    local_server.PUBLIC_DIR = public_dir
+    port = local_server.start_local_server(mode=params["mode"])
+    clients = params["clients"]
+    url_path = "/media/" + Path(params["media"]).name
+    size = Path(params["media"]).stat().st_size
+
+    def download():
+        buf = bytearray(1 << 20)
+        with socket.create_connection(("127.0.0.1", port)) as s:
+            s.sendall(f"GET {url_path} HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n".encode())
+            while s.recv_into(buf):
+                pass
+
+    def run(i):
+        threads = [threading.Thread(target=download) for _ in range(clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    return run, size * clients / 1e6, "MB/s"
+
+
+def _case_render(params: dict, tmp: Path):
+    import socket
+    import local_server
+    from utils.media_store import MediaStore
+    from utils.short_links import ShortLinkTable
+    from utils.variant_cache import VariantCache
+    from utils.watermark_variants import WatermarkVariants, render_path
+
+    local_server.PUBLIC_DIR = tmp / "public"
+    local_server._short_links = ShortLinkTable(tmp / "short_links.json")
+    cache = VariantCache(tmp / "render_cache")
+    local_server._variants = WatermarkVariants(
+        MediaStore(tmp / "sources", tmp / "sources.json"), local_server._short_links, cache,
+        lambda: "http://bench"
+    )
+    image_id = local_server._variants.add_source(Path(params["image"]))
+    port = local_server.start_local_server(mode=params["mode"])
+    clients = params["clients"]
+
+    def fetch(url_path: str):
+        buf = bytearray(1 << 16)
+        with socket.create_connection(("127.0.0.1", port)) as s:
+            s.sendall(f"GET {url_path} HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n".encode())
+            while s.recv_into(buf):
+                pass
+
+    def run(i):
+        # Cold: a new variant per run, requested by every client at once; warm: always the same one
+        code = local_server._short_links.shorten(f"/bench-{i if params['cold'] else 0}")
+        url_path = render_path(image_id, code, width=1080, fmt="webp")
+        renders = cache.renders
+        threads = [threading.Thread(target=fetch, args=(url_path,)) for _ in range(clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return {"renders_per_burst": cache.renders - renders}
+    return run, clients, "requests/s"
+
+
+def _case_startup(params: dict, tmp: Path):
+    # Whole 'python main.py ...' calls, as a script would make them: interpreter start, imports, work
+    env = dict(os.environ, SMARTQR_SERVICE_SOCKET=str(tmp / "service.sock"))
+    if not params["service"]:
+        env["SMARTQR_SERVICE"] = "0"
+    main = str(ROOT / "main.py")
+    if params["service"]:
+        import atexit
+        import service
+        proc = subprocess.Popen([sys.executable, main, "serve"], env=env, cwd=str(ROOT), stdout=subprocess.DEVNULL)
+        # SIGTERM stops it cleanly
+        atexit.register(proc.wait)
+        atexit.register(proc.terminate)
+        while (sock := service._connect(tmp / "service.sock")) is None:
+            if proc.poll() is not None:
+                raise RuntimeError("The service did not start.")
+            time.sleep(0.05)
+        sock.close()
+
+    def run(i):
+        if params["command"] == "help":
+            argv = ["--help"]
+        else:
+            argv = ["watermark", params["image"], "-c", qr_payload(32, i), "-o", str(tmp / f"out-{i}.png")]
+        subprocess.run([sys.executable, main, *argv], env=env, check=True, cwd=str(ROOT),
+                       stdout=subprocess.DEVNULL)
+    return run, 1, "calls/s"
+
+
+CASES = {
+    "watermark": _case_watermark,
+    "encode": _case_encode,
+    "qr": _case_qr,
+    "hash": _case_hash,
+    "downscale": _case_downscale,
+    "mind": _case_mind,
+    "server": _case_server,
+    "render": _case_render,
+    "startup": _case_startup,
+}
+
+
+def _peak_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _child(spec: dict) -> dict:
+    sys.path.insert(0, str(ROOT))
+    with tempfile.TemporaryDirectory() as tmp:
+        run, units, unit_name = CASES[spec["group"]](spec["params"], Path(tmp))
+        for i in range(spec["warmup"]):
+            run(-1 - i)
+        latencies = []
+        info = None
+        for i in range(spec["repeat"]):
+            start = time.perf_counter()
+            info = run(i)
+            latencies.append(time.perf_counter() - start)
+    return {"latencies": latencies, "units": units, "unit": unit_name, "peak_rss_mb": _peak_rss_mb(),
+            "info": info}
+
+
+# --- Parent: plan, run, report, compare ---
+
+def _percentile(sorted_values: list[float], q: float) -> float:
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    pos = (len(sorted_values) - 1) * q
+    low = int(pos)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (pos - low)
+
+
+def summarize(name: str, group: str, params: dict, raw: dict) -> dict:
+    latencies = sorted(raw["latencies"])
+    p50 = _percentile(latencies, 0.5)
+    return {
+        "name": name,
+        "group": group,
+        "params": {k: v for k, v in params.items() if k not in ("image", "media", "public_dir")},
+        "runs": len(latencies),
+        "min_ms": latencies[0] * 1000,
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "p50_ms": p50 * 1000,
+        "p90_ms": _percentile(latencies, 0.9) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "throughput": raw["units"] / p50 if p50 else 0.0,
+        "throughput_unit": raw["unit"],
+        "peak_rss_mb": raw["peak_rss_mb"],
+        # Case-specific figures of the last run (e.g. the encoded size)
+        **(raw.get("info") or {}),
+    }
+
+
+def run_case(group: str, params: dict, repeat: int, warmup: int) -> dict:
+    spec = json.dumps({"group": group, "params": params, "repeat": repeat, "warmup": warmup})
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.suite", "--child", spec],
+        capture_output=True, text=True, cwd=str(ROOT)
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "failed")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _node_available() -> bool:
+    return (shutil.which("node") is not None
+            and (ROOT / "tools" / "mindar_offline" / "node_modules").is_dir())
+
+
+def plan_cases(args: argparse.Namespace, tmp: Path) -> list[tuple[str, str, dict]]:
+    cases = []
+    images = {}
+    if {"watermark", "encode", "downscale", "mind", "render", "startup"} & set(args.only):
+        for mp in args.megapixels:
+            path = tmp / f"photo-{mp:g}mp.jpg"
+            make_image(path, mp)
+            images[mp] = str(path)
+
+    if "watermark" in args.only:
+        cases += [(f"watermark-{mp:g}mp", "watermark", {"image": images[mp], "megapixels": mp})
+                  for mp in args.megapixels]
+    if "encode" in args.only:
+        for mp in args.megapixels:
+            for fmt in ENCODE_FORMATS:
+                cases += [(f"encode-{mp:g}mp-{fmt}-{preset}", "encode",
+                           {"image": images[mp], "megapixels": mp, "format": fmt, "preset": preset})
+                          for preset in ("fast", "balanced", "small")]
+    if "qr" in args.only:
+        for length in QR_PAYLOAD_LENGTHS:
+            cases.append((f"qr-{length}-cold", "qr", {"length": length, "cached": False}))
+            cases.append((f"qr-{length}-cached", "qr", {"length": length, "cached": True}))
+
+    media = {}
+    if {"hash", "server"} & set(args.only):
+        (tmp / "public" / "media").mkdir(parents=True)
+        for size in args.media_mb:
+            path = tmp / "public" / "media" / f"video-{size}mb.bin"
+            make_media(path, size)
+            media[size] = str(path)
+
+    if "hash" in args.only:
+        cases += [(f"hash-{size}mb", "hash", {"media": media[size], "size_mb": size}) for size in args.media_mb]
+    if "downscale" in args.only:
+        cases += [(f"downscale-{mp:g}mp", "downscale", {"image": images[mp], "megapixels": mp})
+                  for mp in args.megapixels]
+    if "mind" in args.only:
+        if _node_available():
+            mp = min(args.megapixels)
+            cases.append((f"mind-{mp:g}mp", "mind", {"image": images[mp], "megapixels": mp}))
+        else:
+            print("mind: skipped (node or tools/mindar_offline/node_modules not found)", file=sys.stderr)
+    if "server" in args.only:
+        size = min(args.media_mb)
+        for mode in ("threaded", "asyncio"):
+            cases.append((f"server-{mode}-{args.clients}x{size}mb", "server", {
+                "public_dir": str(tmp / "public"), "media": media[size], "mode": mode, "clients": args.clients
+            }))
+    if "render" in args.only:
+        mp = max(args.megapixels)
+        for mode in ("threaded", "asyncio"):
+            for cold in (True, False):
+                cases.append((f"render-{mode}-{args.clients}x-{'cold' if cold else 'warm'}", "render", {
+                    "image": images[mp], "megapixels": mp, "mode": mode, "clients": args.clients, "cold": cold
+                }))
+    if "startup" in args.only:
+        mp = min(args.megapixels)
+        cases.append(("startup-help", "startup", {"command": "help", "service": False}))
+        for service in (False, True):
+            cases.append((f"startup-watermark-{mp:g}mp-{'service' if service else 'oneshot'}", "startup",
+                          {"command": "watermark", "image": images[mp], "megapixels": mp, "service": service}))
+    return cases
+
+
+def environment() -> dict:
+    env = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+    for module in ("PIL", "numpy", "qrcode"):
+        try:
+            env[module] = getattr(__import__(module), "__version__", "unknown")
+        except ImportError:
+            env[module] = None
+    try:
+        env["git_commit"] = subprocess.run(["git", "rev-parse", "HEAD"], cwd=str(ROOT), capture_output=True,
+                                           text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        env["git_commit"] = None
+    return env
+
+
+def compare(results: list[dict], baseline: dict, tolerance: float) -> list[dict]:
+    """Each case's p50 relative to the baseline's; 'regression' when slower than 1 + tolerance."""
+    previous = {r["name"]: r for r in baseline.get("results", [])}
+    rows = []
+    for r in results:
+        before = previous.get(r["name"])
+        if not before or not before["p50_ms"]:
+            continue
+        ratio = r["p50_ms"] / before["p50_ms"]
+        rows.append({"name": r["name"], "baseline_p50_ms": before["p50_ms"], "p50_ms": r["p50_ms"],
+                     "ratio": ratio, "regression": ratio > 1 + tolerance})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--only", nargs="+", choices=GROUPS, default=list(GROUPS))
+    parser.add_argument("--megapixels", type=float, nargs="+", default=[1, 12, 50])
+    parser.add_argument("--media-mb", type=int, nargs="+", default=[64, 512])
+    parser.add_argument("--clients", type=int, default=16, help="concurrent downloads in the server cases")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--output", help="write the results JSON here (default: stdout)")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed p50 slowdown (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(_child(json.loads(args.child))))
+        return 0
+
+    report = {"environment": environment(), "results": [], "skipped": []}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, group, params in plan_cases(args, Path(tmp)):
+            try:
+                raw = run_case(group, params, args.repeat, args.warmup)
+            except RuntimeError as e:
+                report["skipped"].append({"name": name, "reason": str(e)})
+                print(f"{name:28s} FAILED: {e}", file=sys.stderr)
+                continue
+            r = summarize(name, group, params, raw)
+            report["results"].append(r)
+            print(f"{name:28s} p50 {r['p50_ms']:9.1f} ms  p99 {r['p99_ms']:9.1f} ms  "
+                  f"{r['throughput']:9.1f} {r['throughput_unit']:9s}  peak RSS {r['peak_rss_mb']:7.1f} MB"
+                  + (f"  output {r['output_mb']:7.2f} MB ({r['size_vs_source']:.2f}x source)" if "output_mb" in r else ""),
+                  file=sys.stderr)
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["comparison"] = compare(report["results"], json.load(f), args.tolerance)
+        for row in report["comparison"]:
+            flag = "REGRESSION" if row["regression"] else "ok"
+            print(f"{row['name']:28s} {row['ratio']:6.2f}x baseline  {flag}", file=sys.stderr)
+        if any(row["regression"] for row in report["comparison"]):
+            status = 1
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
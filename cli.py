@@ -0,0 +1,430 @@
+import argparse
+import os
+import threading
+import time
+from pathlib import Path
+
+from utils.encoders import PRESETS, EncodeOptions, format_choices
+from utils.job_runner import StageLimits, read_jobs, run_jobs
+from utils.utils import APP_NAME, CORNERS, SAVED_DIR
+
+# Manifest job types for 'run', and the fields each one needs
+JOB_TYPES = {
+    "watermark": ("image", "content"),
+    "memory": ("image", "media"),
+    "live-photo": ("image", "video"),
+}
+
+# The working directory of the call being run: the caller's, when the resident service runs it
+_request = threading.local()
+
+
+def _path(value: str) -> Path:
+    path = Path(value).expanduser()
+    cwd = getattr(_request, "cwd", None)
+    return cwd / path if cwd and not path.is_absolute() else path
+
+
+def cmd_batch_watermark(args: argparse.Namespace) -> int:
+    from utils.batch_utils import jobs_from_directory, jobs_from_manifest, run_watermark_batch
+    source = _path(args.source)
+    try:
+        if source.is_dir():
+            if not args.content:
+                print("Error: --content is required when the source is a directory.")
+                return 2
+            jobs = jobs_from_directory(source, args.content, args.corner, recursive=args.recursive)
+        else:
+            jobs = jobs_from_manifest(source)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        return 2
+
+    if not jobs:
+        print("No images to process.")
+        return 0
+
+    print(f"Watermarking {len(jobs)} image(s)...")
+    start = time.perf_counter()
+    failed = 0
+    results = run_watermark_batch(jobs, _path(args.output), workers=args.workers, encode=_encode_options(args))
+    for i, result in enumerate(results, start=1):
+        if result.ok:
+            print(f"[{i}/{len(jobs)}] OK    {result.job.image.name} -> {result.output_path} ({result.elapsed:.2f}s)")
+        else:
+            failed += 1
+            print(f"[{i}/{len(jobs)}] ERROR {result.job.image.name}: {result.error}")
+
+    elapsed = time.perf_counter() - start
+    print(f"\nDone: {len(jobs) - failed} succeeded, {failed} failed in {elapsed:.1f}s "
+          f"({len(jobs) / elapsed:.1f} images/s).")
+    return 1 if failed else 0
+
+
+def _existing_file(value: str) -> Path:
+    path = _path(value).resolve()
+    if not path.is_file():
+        raise argparse.ArgumentTypeError(f"File not found: {path}")
+    return path
+
+
+def _output_path(args: argparse.Namespace) -> Path | None:
+    return _path(args.output) if args.output else None
+
+
+def _quality(value: str) -> int:
+    quality = int(value)
+    if not 1 <= quality <= 100:
+        raise argparse.ArgumentTypeError("quality must be between 1 and 100")
+    return quality
+
+
+def _encode_options(args: argparse.Namespace, params: dict | None = None) -> EncodeOptions:
+    # Manifest entries may set their own format/preset/quality; the flags are the defaults
+    params = params or {}
+    quality = params.get("quality") or args.quality
+    return EncodeOptions(params.get("format") or args.format, params.get("preset") or args.preset,
+                         int(quality) if quality else None)
+
+
+def cmd_watermark(args: argparse.Namespace) -> int:
+    from actions import watermark_image
+    from utils.qr_utils import qr_version
+    out_path = watermark_image(args.image, args.content, args.corner, _output_path(args),
+                               encode=_encode_options(args))
+    print(f"QR Code applied (version {qr_version(args.content)}). Image saved to: {out_path}")
+    return 0
+
+
+def cmd_memory(args: argparse.Namespace) -> int:
+    from actions import create_memory_qr
+    from utils.qr_utils import qr_version
+    out_path, url = create_memory_qr(args.image, args.media, args.corner, _output_path(args),
+                                     encode=_encode_options(args))
+    print(f"Image saved to: {out_path}")
+    print(f"Media URL: {url} (QR version {qr_version(url)}, served while 'python main.py' is running)")
+    return 0
+
+
+def cmd_live_photo(args: argparse.Namespace) -> int:
+    from actions import AR_PUBLIC_BASE_URL, create_ar_live_photo
+    from utils.qr_utils import qr_version
+    try:
+        result = create_ar_live_photo(args.image, args.video, args.corner, _output_path(args),
+                                      public_base_url=args.base_url or AR_PUBLIC_BASE_URL,
+                                      encode=_encode_options(args))
+    except (FileNotFoundError, RuntimeError) as e:
+        print(f"Error: {e}")
+        return 1
+    print(f"Image with QR Code saved to: {result.image_path}")
+    print(f"Experience URL: {result.page_url}")
+    print(f"QR code URL: {result.qr_url} (version {qr_version(result.qr_url)})")
+    print("Stage timings: " + ", ".join(f"{name} {t:.2f}s" for name, t in result.timings.items()))
+    return 0
+
+
+def _job_handlers(args: argparse.Namespace, base_url: str) -> dict:
+    import actions
+
+    def corner(params: dict) -> str:
+        return params.get("corner") or "bottom-right"
+
+    return {
+        "watermark": lambda p, stages: actions.watermark_image(
+            p["image"], p["content"], corner(p), p.get("output"), stages, _encode_options(args, p)),
+        "memory": lambda p, stages: actions.create_memory_qr(
+            p["image"], p["media"], corner(p), p.get("output"), stages, _encode_options(args, p))[0],
+        "live-photo": lambda p, stages: actions.create_ar_live_photo(
+            p["image"], p["video"], corner(p), p.get("output"), p.get("base_url") or base_url, stages,
+            _encode_options(args, p)).image_path,
+    }
+
+
+def _invalid_encode_field(params: dict) -> str | None:
+    if params.get("format") and params["format"] not in format_choices():
+        return f"format '{params['format']}'"
+    if params.get("preset") and params["preset"] not in PRESETS:
+        return f"preset '{params['preset']}'"
+    if params.get("quality") and not (str(params["quality"]).isdigit() and 1 <= int(params["quality"]) <= 100):
+        return f"quality '{params['quality']}'"
+    return None
+
+
+def cmd_run(args: argparse.Namespace) -> int:
+    try:
+        jobs = read_jobs(_path(args.manifest), JOB_TYPES)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        return 2
+    for job in jobs:
+        if job.params.get("corner", "bottom-right") not in CORNERS:
+            print(f"Error: {args.manifest}: entry {job.line_no} has an invalid corner '{job.params['corner']}'.")
+            return 2
+        invalid = _invalid_encode_field(job.params)
+        if invalid:
+            print(f"Error: {args.manifest}: entry {job.line_no} has an invalid {invalid}.")
+            return 2
+
+    if not jobs:
+        print("No jobs to run.")
+        return 0
+
+    from actions import AR_PUBLIC_BASE_URL
+    limits = StageLimits({"cpu": args.cpu, "node": args.node, "io": args.io})
+    print(f"Running {len(jobs)} job(s) on {args.workers} worker(s)...")
+    start = time.perf_counter()
+    failed = 0
+    handlers = _job_handlers(args, args.base_url or AR_PUBLIC_BASE_URL)
+    results = run_jobs(jobs, handlers, workers=args.workers, limits=limits)
+    for i, result in enumerate(results, start=1):
+        rate = i / (time.perf_counter() - start)
+        if result.ok:
+            print(f"[{i}/{len(jobs)}] OK    {result.job.describe()} -> {result.output} "
+                  f"({result.elapsed:.2f}s, {rate:.2f} jobs/s)")
+        else:
+            failed += 1
+            print(f"[{i}/{len(jobs)}] ERROR {result.job.describe()} (entry {result.job.line_no}): {result.error}")
+
+    elapsed = time.perf_counter() - start
+    print(f"\nDone: {len(jobs) - failed} succeeded, {failed} failed in {elapsed:.1f}s "
+          f"({len(jobs) / elapsed:.2f} jobs/s).")
+    for stage in sorted(limits.busy):
+        print(f"  {stage:5s} busy {limits.busy[stage]:7.1f}s   waiting {limits.waited[stage]:7.1f}s")
+    return 1 if failed else 0
+
+
+def cmd_watch(args: argparse.Namespace) -> int:
+    from utils.job_runner import Job, JobJournal
+    from utils.watch_folder import JOURNAL_NAME, FolderWatcher, watch
+
+    folder = _path(args.folder).resolve()
+    if not folder.is_dir():
+        print(f"Error: Folder not found: {folder}")
+        return 2
+
+    def job_for_group(group: dict) -> Job | None:
+        image, video = group.get("image"), group.get("video")
+        if image and video:
+            return Job(args.pairs, {"image": image, ("video" if args.pairs == "live-photo" else "media"): video}, 0)
+        if image and args.content:
+            return Job("watermark", {"image": image, "content": args.content}, 0)
+        return None
+
+    lock = threading.Lock()
+    counts = {"done": 0, "failed": 0, "skipped": 0}
+
+    def report(result, key: str):
+        with lock:
+            if result is None:
+                counts["skipped"] += 1
+                return
+            if result.ok:
+                counts["done"] += 1
+                print(f"[{counts['done']} done] OK    {result.job.describe()} -> {result.output} "
+                      f"({result.elapsed:.2f}s)")
+            else:
+                counts["failed"] += 1
+                print(f"[{counts['failed']} failed] ERROR {result.job.describe()}: {result.error}")
+
+    from actions import AR_PUBLIC_BASE_URL
+    from local_server import start_local_server, stop_local_server
+    journal = JobJournal(_path(args.journal) if args.journal else folder / JOURNAL_NAME)
+    watcher = FolderWatcher(folder, settle=args.settle, poll_interval=args.interval, use_inotify=not args.poll,
+                            pair_wait=args.pair_wait)
+    limits = StageLimits({"cpu": args.cpu, "node": args.node, "io": args.io})
+    port = start_local_server()
+    print(f"Watching {folder} ({watcher.mode}, {args.workers} worker(s), local server on port {port}). "
+          f"Press Ctrl+C to stop.")
+    try:
+        watch(watcher, job_for_group, _job_handlers(args, args.base_url or AR_PUBLIC_BASE_URL), journal, report,
+              workers=args.workers, limits=limits)
+    except KeyboardInterrupt:
+        print("\nStopping: waiting for the running jobs (queued ones resume on the next start)...")
+    finally:
+        journal.close()
+        stop_local_server()
+    print(f"Done: {counts['done']} succeeded, {counts['failed']} failed, "
+          f"{counts['skipped']} already done in an earlier run.")
+    return 1 if counts["failed"] else 0
+
+
+def cmd_preview(args: argparse.Namespace) -> int:
+    from local_server import get_short_links, preview_url
+    code = args.qr_url.rstrip("/").rpartition("/")[2].upper()
+    if get_short_links().resolve(code) is None:
+        print(f"Error: '{args.qr_url}' is not a short link of this server (see the memory and live-photo commands).")
+        return 2
+    url = preview_url(args.qr_url, args.image, args.corner, args.width, args.format)
+    print(f"Preview URL: {url} (rendered on demand while 'python main.py' is running)")
+    return 0
+
+
+def cmd_catalog(args: argparse.Namespace) -> int:
+    from local_server import get_asset_catalog
+    catalog = get_asset_catalog()
+    if args.sync:
+        added, dropped = catalog.sync()
+        print(f"Catalog synced: {added} file(s) added, {dropped} missing file(s) dropped.")
+    if args.evict:
+        quota = int(args.quota_mb * 1024 * 1024) if args.quota_mb is not None else None
+        ttl = args.ttl_days * 86400 if args.ttl_days is not None else None
+        if quota is None and ttl is None and catalog.quota_bytes is None and catalog.ttl_seconds is None:
+            print("Error: --evict needs --quota-mb or --ttl-days "
+                  "(or SMARTQR_DISK_QUOTA_MB / SMARTQR_ASSET_TTL_DAYS).")
+            return 2
+        report = catalog.enforce(quota, ttl)
+        for path in report.removed:
+            print(f"Removed {path}")
+        print(f"Evicted {len(report.removed)} file(s), freed {report.freed_bytes / 1e6:.1f} MB.")
+
+    for kind, (count, size) in sorted(catalog.usage().items()):
+        print(f"{kind:>6}: {count} file(s), {size / 1e6:.1f} MB")
+    print(f" total: {catalog.total_bytes() / 1e6:.1f} MB, "
+          f"{len(catalog.live_paths())} file(s) linked from live QR codes")
+    # Flushed, not closed: in the resident service the catalog stays in use
+    catalog.flush()
+    return 0
+
+
+def cmd_serve(args: argparse.Namespace) -> int:
+    import service
+    if args.stop:
+        return service.stop()
+    if args.status:
+        return service.status()
+    if args.detach:
+        return service.spawn(args.workers)
+    return service.serve(args.workers)
+
+
+def _add_encode_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--format", choices=format_choices(), default="source",
+                        help="Output format (default: the source's, or the output file's extension).")
+    parser.add_argument("--preset", choices=PRESETS, default="balanced",
+                        help="Encoder speed/size tradeoff (default: balanced).")
+    parser.add_argument("--quality", type=_quality, help="JPEG/WebP quality, 1-100 (default: from the preset).")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="main.py", description=APP_NAME)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    batch = subparsers.add_parser(
+        "batch-watermark",
+        help="Add a QR code to every image in a directory or manifest (.csv/.jsonl)."
+    )
+    batch.add_argument("source", help="Directory of images, or a manifest with image,content,corner entries.")
+    batch.add_argument("-c", "--content", help="QR content for every image (directory mode).")
+    batch.add_argument("--corner", choices=sorted(CORNERS), default="bottom-right")
+    batch.add_argument("-r", "--recursive", action="store_true", help="Also look into subdirectories.")
+    batch.add_argument("-o", "--output", default=str(SAVED_DIR), help="Output directory.")
+    batch.add_argument("-w", "--workers", type=int, default=None, help="Worker processes (default: CPU count).")
+    _add_encode_arguments(batch)
+    batch.set_defaults(func=cmd_batch_watermark)
+
+    watermark = subparsers.add_parser("watermark", help="Add a QR code with any content to one image.")
+    watermark.add_argument("image", type=_existing_file)
+    watermark.add_argument("-c", "--content", required=True, help="QR content.")
+    watermark.add_argument("--corner", choices=sorted(CORNERS), default="bottom-right")
+    watermark.add_argument("-o", "--output", help="Output image (default: saved/<name>_watermarked.<ext>).")
+    _add_encode_arguments(watermark)
+    watermark.set_defaults(func=cmd_watermark)
+
+    memory = subparsers.add_parser("memory", help="Link a media file to an image through a local URL QR code.")
+    memory.add_argument("image", type=_existing_file)
+    memory.add_argument("media", type=_existing_file)
+    memory.add_argument("--corner", choices=sorted(CORNERS), default="bottom-right")
+    memory.add_argument("-o", "--output", help="Output image (default: saved/<name>_watermarked.<ext>).")
+    _add_encode_arguments(memory)
+    memory.set_defaults(func=cmd_memory)
+
+    live = subparsers.add_parser("live-photo", help="Create an AR 'Live Photo' page and its QR code.")
+    live.add_argument("image", type=_existing_file)
+    live.add_argument("video", type=_existing_file)
+    live.add_argument("--corner", choices=sorted(CORNERS), default="bottom-right")
+    live.add_argument("-o", "--output", help="Output image (default: saved/<name>_watermarked.<ext>).")
+    live.add_argument("--base-url", help="Public HTTPS base URL of the pages (default: AR_PUBLIC_BASE_URL).")
+    _add_encode_arguments(live)
+    live.set_defaults(func=cmd_live_photo)
+
+    run = subparsers.add_parser(
+        "run",
+        help="Run the jobs of a manifest (.csv/.jsonl with a 'type' column: watermark, memory, live-photo)."
+    )
+    run.add_argument("manifest")
+    run.add_argument("-w", "--workers", type=int, default=4, help="Jobs in progress at once.")
+    run.add_argument("--cpu", type=int, default=os.cpu_count() or 1, help="Jobs doing image work at once.")
+    run.add_argument("--node", type=int, default=1, help="Jobs compiling .mind files at once.")
+    run.add_argument("--io", type=int, default=2, help="Jobs copying media at once.")
+    run.add_argument("--base-url", help="Public HTTPS base URL of the AR pages (default: AR_PUBLIC_BASE_URL).")
+    _add_encode_arguments(run)
+    run.set_defaults(func=cmd_run)
+
+    watch = subparsers.add_parser(
+        "watch",
+        help="Process images (and image/video pairs with the same name) as they are dropped into a folder."
+    )
+    watch.add_argument("folder")
+    watch.add_argument("-c", "--content", help="Watermark images without a video with this QR content.")
+    watch.add_argument("--pairs", choices=("live-photo", "memory"), default="live-photo",
+                       help="What to make of an image and a video with the same name (default: live-photo).")
+    watch.add_argument("-w", "--workers", type=int, default=4, help="Jobs in progress at once.")
+    watch.add_argument("--cpu", type=int, default=os.cpu_count() or 1, help="Jobs doing image work at once.")
+    watch.add_argument("--node", type=int, default=1, help="Jobs compiling .mind files at once.")
+    watch.add_argument("--io", type=int, default=2, help="Jobs copying media at once.")
+    watch.add_argument("--base-url", help="Public HTTPS base URL of the AR pages (default: AR_PUBLIC_BASE_URL).")
+    watch.add_argument("--settle", type=float, default=2.0,
+                       help="Seconds a file must stay unchanged before it is processed (default: 2).")
+    watch.add_argument("--pair-wait", type=float, default=5.0,
+                       help="Extra seconds an image waits for a video with the same name (default: 5).")
+    watch.add_argument("--poll", action="store_true", help="Poll instead of using inotify (e.g. network shares).")
+    watch.add_argument("--interval", type=float, default=2.0, help="Seconds between polls (default: 2).")
+    watch.add_argument("--journal", help="Progress journal (default: <folder>/.smartqr-journal.jsonl).")
+    _add_encode_arguments(watch)
+    watch.set_defaults(func=cmd_watch)
+
+    preview = subparsers.add_parser(
+        "preview",
+        help="Print a URL serving an image watermarked with a short-link QR code, rendered on demand."
+    )
+    preview.add_argument("image", type=_existing_file)
+    preview.add_argument("qr_url", help="Short link printed by memory/live-photo, e.g. HTTP://192.168.0.10:8000/5JJ.")
+    preview.add_argument("--corner", choices=sorted(CORNERS), default="bottom-right")
+    preview.add_argument("--width", type=int, default=1080, help="Width in pixels (rounded up to a preset size).")
+    preview.add_argument("--format", choices=[f for f in format_choices() if f != "source"], default="webp")
+    preview.set_defaults(func=cmd_preview)
+
+    catalog = subparsers.add_parser(
+        "catalog",
+        help="Show the disk used by generated files (saved/, public/), and evict old ones."
+    )
+    catalog.add_argument("--sync", action="store_true", help="Record files made outside the catalog first.")
+    catalog.add_argument("--evict", action="store_true",
+                         help="Delete expired and least recently used files (never those behind a live QR code).")
+    catalog.add_argument("--quota-mb", type=float, help="Disk quota for --evict (default: SMARTQR_DISK_QUOTA_MB).")
+    catalog.add_argument("--ttl-days", type=float,
+                         help="Evict files not accessed for this long (default: SMARTQR_ASSET_TTL_DAYS).")
+    catalog.set_defaults(func=cmd_catalog)
+
+    serve = subparsers.add_parser(
+        "serve",
+        help="Run as a resident service (local server, warm worker pools) that later calls hand their work to."
+    )
+    serve.add_argument("-d", "--detach", action="store_true", help="Start it in the background (log: data/service.log).")
+    serve.add_argument("--stop", action="store_true", help="Stop the running service.")
+    serve.add_argument("--status", action="store_true", help="Show whether a service is running, and its state.")
+    serve.add_argument("-w", "--workers", type=int, default=None,
+                       help="Processes of the warm batch-watermark pool (default: CPU count).")
+    serve.set_defaults(func=cmd_serve)
+
+    return parser
+
+
+def run_cli(argv: list[str], cwd: str | None = None) -> int:
+    """Runs one command; relative paths in 'argv' are taken from 'cwd' (default: the current directory)."""
+    _request.cwd = Path(cwd) if cwd else None
+    try:
+        args = build_parser().parse_args(argv)
+        return args.func(args)
+    finally:
+        _request.cwd = None
@@ -1,59 +1,452 @@
+import io
+import os
 import threading
+import urllib.parse
+from http import HTTPStatus
 from pathlib import Path
 from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
 import shutil
+import time
+
+from utils import metrics
+from utils.asset_cache import (
+    HotAssetCache, accepted_encodings, is_compressible, open_precompressed, precompress, variant_etag
+)
+from utils.http_utils import (
+    IMMUTABLE_CACHE_CONTROL, cache_control_for, content_range, copy_range, if_range_allows, is_not_modified,
+    make_etag, multipart_layout, new_boundary, parse_range
+)
+from utils.asset_catalog import AssetCatalog, get_catalog
+from utils.media_store import MediaStore
+from utils.short_links import ShortLinkTable, qr_friendly_url, short_code_from_path
+from utils.utils import DATA_DIR, get_local_ip
+from utils.variant_cache import VariantCache
+from utils.watermark_variants import (
+    RENDER_PREFIX, WatermarkVariants, parse_render_path, render_path
+)
 
 PUBLIC_DIR = Path("public").resolve()
 MEDIA_SUBDIR = PUBLIC_DIR / "media"
 DEFAULT_PORT = 8000
+# The port last bound: tried first on the next start, and used for URLs made while no server runs
+PORT_FILE = DATA_DIR / "server_port"
+SERVER_MODES = ("threaded", "asyncio")
+# Base URL of the QR codes in previews (default: this server on the LAN, like memory links)
+PREVIEW_BASE_URL_ENV = "SMARTQR_PREVIEW_BASE_URL"
 
 _httpd = None
 _http_thread = None
+_short_links = None
+_short_links_lock = threading.Lock()
+_variants = None
+_variants_lock = threading.Lock()
+_media_store = None
+_media_store_lock = threading.Lock()
+
+def get_short_links() -> ShortLinkTable:
+    global _short_links
+    with _short_links_lock:
+        if _short_links is None:
+            reserved = {MEDIA_SUBDIR.name}
+            if PUBLIC_DIR.is_dir():
+                reserved |= {p.name for p in PUBLIC_DIR.iterdir()}
+            _short_links = ShortLinkTable(DATA_DIR / "short_links.json", reserved=reserved)
+    return _short_links
+
+def get_media_store() -> MediaStore:
+    """The store behind public/media; its objects are the only files sent as immutable."""
+    global _media_store
+    with _media_store_lock:
+        if _media_store is None:
+            _media_store = MediaStore(MEDIA_SUBDIR, DATA_DIR / "media_index.json", catalog=get_asset_catalog())
+    return _media_store
+
+def get_watermark_variants() -> WatermarkVariants:
+    global _variants
+    with _variants_lock:
+        if _variants is None:
+            # Sources are kept out of public/: only their watermarked variants are served
+            _variants = WatermarkVariants(
+                MediaStore(DATA_DIR / "render_sources", DATA_DIR / "render_sources.json", faststart=False),
+                get_short_links(),
+                VariantCache(DATA_DIR / "render_cache"),
+                preview_base_url
+            )
+    return _variants
+
+def local_base_url() -> str:
+    """'http://<LAN address>:<port>': where phones on the same network reach this server."""
+    return f"http://{get_local_ip()}:{get_port()}"
+
+def preview_base_url() -> str:
+    return os.environ.get(PREVIEW_BASE_URL_ENV) or local_base_url()
+
+def _live_public_paths() -> list[Path]:
+    # Anything a short link points to may be behind a printed QR code
+    return [PUBLIC_DIR / target.lstrip("/") for target in get_short_links().targets()]
+
+def get_asset_catalog() -> AssetCatalog:
+    """The asset catalog, managing public/ too, where short-link targets (and what they load) are live."""
+    catalog = get_catalog()
+    catalog.manage(PUBLIC_DIR, live_paths=_live_public_paths)
+    return catalog
 
 class QuietHTTPRequestHandler(SimpleHTTPRequestHandler):
+    """
+    Static file handler with byte ranges (single and multipart), strong ETags,
+    conditional requests (304) and long-lived caching for the content-named
+    objects of 'media_store' in public/media.
+
+    File bodies go out with socket.sendfile() (os.sendfile: the kernel copies
+    straight from the page cache to the socket, without the GIL); set
+    use_sendfile = False to force the userspace copy.
+
+    Small files are answered from asset_cache (set it to None to disable), and
+    compressible ones in the best coding the client accepts: from memory, or
+    from a precompressed '.br'/'.gz' sidecar for larger files.
+
+    Every request is timed and its body bytes counted (utils.metrics); GET
+    /metrics returns them in the Prometheus text format. Short links ('/7QX',
+    see short_url()) are answered with a redirect to their target, and
+    '/render/...' with a watermarked variant (see preview_url()).
+
+    Files sent are marked as accessed in 'catalog' (for LRU eviction) when set.
+    """
+
+    use_sendfile = True
+    asset_cache: HotAssetCache | None = HotAssetCache()
+    catalog: AssetCatalog | None = None
+    media_store: MediaStore | None = None
+
     def log_message(self, format, *args):
         pass
 
     def log_error(self, format, *args):
         pass
 
+    # --- Instrumentation ---
+
+    def parse_request(self):
+        # Called once the request line is in: keep-alive idle time is not counted
+        self._start = time.perf_counter()
+        self._status = None
+        self._bytes_sent = 0
+        return super().parse_request()
+
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+
+    def handle_one_request(self):
+        self._start = time.perf_counter()
+        self._status = None
+        self._bytes_sent = 0
+        super().handle_one_request()
+        if self._status is not None:
+            metrics.record_request(self.command, self._status, time.perf_counter() - self._start, self._bytes_sent)
+
+    def do_GET(self):
+        if self.path == metrics.METRICS_PATH:
+            self._send_metrics(head_only=False)
+        elif not self._redirect_short_link():
+            super().do_GET()
+
+    def do_HEAD(self):
+        if self.path == metrics.METRICS_PATH:
+            self._send_metrics(head_only=True)
+        elif not self._redirect_short_link():
+            super().do_HEAD()
+
+    def _redirect_short_link(self) -> bool:
+        code = short_code_from_path(urllib.parse.urlsplit(self.path).path)
+        target = get_short_links().resolve(code) if code else None
+        if target is None:
+            return False
+        self.send_response(HTTPStatus.FOUND)
+        self.send_header("Location", target)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        return True
+
+    def _send_metrics(self, head_only: bool):
+        body = metrics.render_prometheus().encode("utf-8")
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", metrics.PROMETHEUS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        if not head_only:
+            self.wfile.write(body)
+            self._bytes_sent += len(body)
+
+    # --- Files ---
+
+    def send_head(self):
+        # Per-request state: what copyfile() has to send from the returned file
+        self._ranges = None
+        self._multipart = None
+        self._body = None
+
+        if self.path.startswith(RENDER_PREFIX):
+            return self._send_variant(urllib.parse.urlsplit(self.path).path)
+
+        path = self.translate_path(self.path)
+        if os.path.isdir(path) or path.endswith("/"):
+            return super().send_head()
+
+        url_path = urllib.parse.urlsplit(self.path).path
+        ranged = "Range" in self.headers
+        encodings = accepted_encodings(self.headers.get("Accept-Encoding")) if is_compressible(path) else []
+        # Ranges are only served from disk, on the identity body
+        if self.asset_cache is not None and not ranged:
+            asset = self.asset_cache.get(path)
+            if asset is not None:
+                return self._send_cached(asset, path, url_path, encodings)
+
+        try:
+            f = open(path, "rb")
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return None
+
+        try:
+            fs = os.fstat(f.fileno())
+            etag = make_etag(fs)
+            mtime = fs.st_mtime
+            ctype = self.guess_type(path)
+
+            encoding = None
+            variant = open_precompressed(path, fs, encodings) if encodings and not ranged else None
+            if variant is not None:
+                encoding, variant_file, fs = variant
+                f.close()
+                f = variant_file
+                etag = variant_etag(etag, encoding)
+            size = fs.st_size
+
+            if is_not_modified(self.headers, etag, mtime):
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                self._send_validators(mtime, etag, url_path, path)
+                self.end_headers()
+                f.close()
+                return None
+
+            ranges = None
+            if ranged and if_range_allows(self.headers, etag, mtime):
+                ranges = parse_range(self.headers["Range"], size)
+
+            if ranges == []:
+                self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self._send_validators(mtime, etag, url_path, path)
+                self.end_headers()
+                f.close()
+                return None
+
+            if ranges and len(ranges) == 1:
+                start, end = ranges[0]
+                self.send_response(HTTPStatus.PARTIAL_CONTENT)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Range", content_range(start, end, size))
+                self.send_header("Content-Length", str(end - start + 1))
+            elif ranges:
+                boundary = new_boundary()
+                parts, closing, length = multipart_layout(ranges, size, ctype, boundary)
+                self._multipart = (parts, closing)
+                self.send_response(HTTPStatus.PARTIAL_CONTENT)
+                self.send_header("Content-Type", f"multipart/byteranges; boundary={boundary}")
+                self.send_header("Content-Length", str(length))
+            else:
+                self.send_response(HTTPStatus.OK)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(size))
+                if encoding:
+                    self.send_header("Content-Encoding", encoding)
+
+            self._ranges = ranges
+            self._send_validators(mtime, etag, url_path, path)
+            self.end_headers()
+            if self.catalog is not None:
+                self.catalog.touch(path)
+            return f
+        except:
+            f.close()
+            raise
+
+    def _send_cached(self, asset, path: str, url_path: str, encodings: list[str]):
+        encoding = asset.pick(encodings)
+        etag = variant_etag(asset.etag, encoding)
+        if is_not_modified(self.headers, etag, asset.mtime):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self._send_validators(asset.mtime, etag, url_path, path)
+            self.end_headers()
+            return None
+
+        self._body = asset.bodies[encoding]
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Length", str(len(self._body)))
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self._send_validators(asset.mtime, etag, url_path, path)
+        self.end_headers()
+        if self.catalog is not None:
+            self.catalog.touch(path)
+        # copyfile() writes self._body; the returned object only has to be closable
+        return io.BytesIO()
+
+    def _send_variant(self, url_path: str):
+        request = parse_render_path(url_path)
+        variant = None
+        if request is not None:
+            try:
+                variant = get_watermark_variants().get(request)
+            except Exception as e:
+                self.send_error(HTTPStatus.INTERNAL_SERVER_ERROR, f"Could not render the image ({type(e).__name__})")
+                return None
+        if variant is None:
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return None
+
+        # The URL names the exact variant: it never changes
+        if is_not_modified(self.headers, variant.etag, time.time()):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", variant.etag)
+            self.send_header("Cache-Control", IMMUTABLE_CACHE_CONTROL)
+            self.end_headers()
+            return None
+        self._body = variant.body
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", variant.content_type)
+        self.send_header("Content-Length", str(len(variant.body)))
+        self.send_header("ETag", variant.etag)
+        self.send_header("Cache-Control", IMMUTABLE_CACHE_CONTROL)
+        self.end_headers()
+        return io.BytesIO()
+
+    def _send_validators(self, mtime: float, etag: str, url_path: str, path: str):
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", self.date_time_string(mtime))
+        store = self.media_store
+        self.send_header("Cache-Control", cache_control_for(url_path, store.is_object if store else None))
+        if is_compressible(path):
+            self.send_header("Vary", "Accept-Encoding")
+
     def copyfile(self, source, outputfile):
         try:
-            shutil.copyfileobj(source, outputfile)
+            if getattr(self, "_body", None) is not None:
+                outputfile.write(self._body)
+                self._count_sent(len(self._body))
+            elif getattr(self, "_multipart", None):
+                parts, closing = self._multipart
+                for header, start, end in parts:
+                    outputfile.write(header)
+                    self._count_sent(len(header))
+                    self._send_file_range(source, outputfile, start, end - start + 1)
+                outputfile.write(closing)
+                self._count_sent(len(closing))
+            elif getattr(self, "_ranges", None):
+                start, end = self._ranges[0]
+                self._send_file_range(source, outputfile, start, end - start + 1)
+            else:
+                self._send_file_range(source, outputfile, 0, None)
         except (BrokenPipeError, ConnectionResetError):
             try:
                 outputfile.flush()
             except Exception:
                 pass
 
+    def _send_file_range(self, source, outputfile, offset: int, count: int | None):
+        # Zero-copy only applies when writing straight to this handler's own socket
+        if self.use_sendfile and outputfile is self.wfile:
+            try:
+                outputfile.flush()
+                self._count_sent(self.connection.sendfile(source, offset, count))
+                return
+            except (AttributeError, ValueError):
+                # Raised before anything is sent (e.g. non-blocking socket or a file
+                # without a descriptor): fall back to the plain copy below
+                pass
+        if count is None:
+            source.seek(offset)
+            shutil.copyfileobj(source, outputfile)
+            self._count_sent(source.tell() - offset)
+        else:
+            copy_range(source, outputfile.write, offset, offset + count - 1)
+            self._count_sent(count)
+
+    def _count_sent(self, n: int):
+        self._bytes_sent = getattr(self, "_bytes_sent", 0) + n
+
 class QuietHTTPServer(ThreadingHTTPServer):
+    # socketserver's default backlog of 5 drops connections when a crowd scans at once
+    request_queue_size = 1024
+
     def handle_error(self, request, client_address):
         import sys
         exc = sys.exc_info()[1]
         if isinstance(exc, (BrokenPipeError, ConnectionResetError)):
             return
 
+def _last_port() -> int:
+    try:
+        port = int(PORT_FILE.read_text())
+    except (OSError, ValueError):
+        return DEFAULT_PORT
+    return port if DEFAULT_PORT <= port <= DEFAULT_PORT + 50 else DEFAULT_PORT
+
 def get_port():
-    return _httpd.server_port
+    """The port being served, or the one the server got last time when it is not running (yet)."""
+    return _httpd.server_port if _httpd else _last_port()
 
-def start_local_server() -> int:
+def _create_server(mode: str, port: int, max_connections: int | None):
+    if mode == "asyncio":
+        from async_server import AsyncHTTPServer
+        kwargs = {"max_connections": max_connections} if max_connections else {}
+        return AsyncHTTPServer(PUBLIC_DIR, "0.0.0.0", port, asset_cache=QuietHTTPRequestHandler.asset_cache,
+                               short_links=get_short_links(), catalog=QuietHTTPRequestHandler.catalog,
+                               media_store=QuietHTTPRequestHandler.media_store,
+                               variants=get_watermark_variants(), **kwargs)
+
+    handler_args = {'directory': str(PUBLIC_DIR)}
+    return QuietHTTPServer(("0.0.0.0", port),
+                           lambda *a, **kw: QuietHTTPRequestHandler(*a, **handler_args))
+
+def start_local_server(mode: str = "threaded", max_connections: int | None = None) -> int:
+    """
+    Starts the static server for public/ in a background thread.
+    mode="threaded" uses one thread per connection; mode="asyncio" serves every
+    connection from one event loop, for many concurrent downloads
+    (max_connections caps them there).
+    """
     global _httpd, _http_thread
     if _httpd:
         return _httpd.server_port
+    if mode not in SERVER_MODES:
+        raise ValueError(f"Unknown server mode '{mode}'. Use one of: {', '.join(SERVER_MODES)}.")
 
     PUBLIC_DIR.mkdir(parents=True, exist_ok=True)
+    QuietHTTPRequestHandler.catalog = get_asset_catalog()
+    QuietHTTPRequestHandler.media_store = get_media_store()
 
-    port = DEFAULT_PORT
-    while True:
+    # The last port first (usually free again), then the range from the default one
+    last = _last_port()
+    for port in dict.fromkeys([last, *range(DEFAULT_PORT, DEFAULT_PORT + 51)]):
         try:
-            handler_args = {'directory': str(PUBLIC_DIR)}
-            _httpd = QuietHTTPServer(("0.0.0.0", port),
-                                     lambda *a, **kw: QuietHTTPRequestHandler(*a, **handler_args))
+            _httpd = _create_server(mode, port, max_connections)
             break
         except OSError:
-            port += 1
-            if port > DEFAULT_PORT + 50:
-                raise RuntimeError("Could not find a free port.")
+            continue
+    else:
+        raise RuntimeError("Could not find a free port.")
+    if port != last:
+        try:
+            PORT_FILE.parent.mkdir(parents=True, exist_ok=True)
+            PORT_FILE.write_text(str(port))
+        except OSError:
+            pass
 
     _http_thread = threading.Thread(target=_httpd.serve_forever, daemon=True)
     _http_thread.start()
@@ -65,3 +458,42 @@ def stop_local_server():
         _httpd.shutdown()
         _httpd.server_close()
         _httpd = None
+
+def publish_asset(path: Path):
+    """
+    To be called after writing a page or target under public/: precompresses it
+    and drops any stale copy from the hot-asset cache.
+    """
+    path = Path(path)
+    try:
+        precompress(path)
+    except OSError as e:
+        print(f"Warning: Could not precompress '{path.name}'. Error: {e}")
+    cache = QuietHTTPRequestHandler.asset_cache
+    if cache is not None:
+        cache.invalidate(str(path.resolve()))
+
+def short_url(base_url: str, path: Path | str) -> str:
+    """
+    The shortest URL for a file under public/ (or a path on the server, like
+    '/page.html'): '<BASE_URL>/<CODE>', redirected by the local server. Short
+    payloads keep QR codes at low versions: fewer, bigger modules that render
+    faster and scan better when printed small.
+    """
+    if isinstance(path, Path):
+        path = "/" + Path(path).resolve().relative_to(PUBLIC_DIR).as_posix()
+    return qr_friendly_url(base_url, get_short_links().shorten(path))
+
+def preview_url(qr_url: str, image_path: Path, corner: str = "bottom-right", width: int = 1080,
+                fmt: str = "webp") -> str:
+    """
+    URL of 'image_path' watermarked with the short link 'qr_url' (from short_url()),
+    rendered on demand by the local server at 'width' pixels in 'fmt'. The QR
+    code in it is the short link on preview_base_url(), whatever host the
+    preview is opened through.
+    """
+    parts = urllib.parse.urlsplit(qr_url)
+    base_path, _, code = parts.path.rpartition("/")
+    image_id = get_watermark_variants().add_source(image_path)
+    return urllib.parse.urlunsplit((parts.scheme.lower(), parts.netloc.lower(),
+                                    base_path + render_path(image_id, code, corner, width, fmt), "", ""))
@@ -2,12 +2,6 @@ import sys
 import os
 import time
 from utils.utils import prompt, APP_NAME
-from actions import (
-    action_add_watermark_qr,
-    action_add_memory_qr,
-    action_create_ar_live_photo
-)
-from local_server import stop_local_server, start_local_server
 
 
 def clear_screen():
@@ -21,14 +15,25 @@ def print_menu():
     print("1) Add QR Code to an image")
     print("2) Add a memory to an image")
     print("3) Create 'Live Photo'")
+    print("4) Create an AR album (many photos, one marker file)")
     print("0) Exit")
     print("-" * 50)
 
 def main():
+    # Imported here: a command-line call (see cli.py) may never need Pillow and qrcode
+    from actions import (
+        action_add_watermark_qr,
+        action_add_memory_qr,
+        action_create_ar_live_photo,
+        action_create_ar_album
+    )
+    from local_server import stop_local_server, start_local_server
+
     actions = {
         "1": action_add_watermark_qr,
         "2": action_add_memory_qr,
-        "3": action_create_ar_live_photo
+        "3": action_create_ar_live_photo,
+        "4": action_create_ar_album
     }
     try:
         start_local_server()
@@ -52,6 +57,14 @@ def main():
         print("Program finished.")
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        # Handed to the resident service ('main.py serve') when one is running
+        from service import forward
+        code = forward(sys.argv[1:])
+        if code is None:
+            from cli import run_cli
+            code = run_cli(sys.argv[1:])
+        sys.exit(code)
     try:
         main()
     except KeyboardInterrupt:
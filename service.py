@@ -0,0 +1,341 @@
+"""
+Resident mode: 'python main.py serve' keeps one process running with the local
+server, Pillow/numpy/qrcode imported, a warm batch-watermark pool and the Node
+.mind compiler, and later 'python main.py <command>' calls hand their arguments
+to it over a Unix socket instead of starting all of that again.
+
+The protocol is one JSON object per line. A client sends {"argv": [...],
+"cwd": "..."} (or {"control": "status" | "stop"}), and gets back the command's
+output as {"out": text} / {"err": text} lines, then {"exit": code}.
+
+This module is imported by every call of main.py with arguments: keep its
+imports light.
+"""
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from pathlib import Path
+
+from utils.utils import DATA_DIR
+
+# SMARTQR_SERVICE_SOCKET moves the socket; SMARTQR_SERVICE=0 runs every call in its own process
+SOCKET_ENV = "SMARTQR_SERVICE_SOCKET"
+ENABLE_ENV = "SMARTQR_SERVICE"
+LOG_FILE = DATA_DIR / "service.log"
+# Commands a running service runs for thin clients ('watch' and 'serve' always run on their own)
+FORWARDED_COMMANDS = {"watermark", "memory", "live-photo", "batch-watermark", "run", "preview", "catalog"}
+START_TIMEOUT = 60.0
+
+# The client whose command the current thread is running (see _ClientStream)
+_client = threading.local()
+
+
+def socket_path() -> Path:
+    return Path(os.environ.get(SOCKET_ENV) or DATA_DIR / "service.sock")
+
+
+def _supported() -> bool:
+    return hasattr(socket, "AF_UNIX")
+
+
+def _connect(path: Path, timeout: float | None = None) -> socket.socket | None:
+    if not _supported() or not path.exists():
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(str(path))
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def _send(sock: socket.socket, message: dict):
+    sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+
+
+def _messages(sock: socket.socket):
+    with sock.makefile("rb") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+# --- Client ---
+
+def _request(message: dict, timeout: float | None = None) -> int | None:
+    """Sends 'message' to the running service and relays its output; None if none is running."""
+    sock = _connect(socket_path(), timeout)
+    if sock is None:
+        return None
+    with sock:
+        try:
+            _send(sock, message)
+            for reply in _messages(sock):
+                if "out" in reply:
+                    sys.stdout.write(reply["out"])
+                    sys.stdout.flush()
+                elif "err" in reply:
+                    sys.stderr.write(reply["err"])
+                    sys.stderr.flush()
+                elif "exit" in reply:
+                    return reply["exit"]
+        except (OSError, ValueError):
+            pass
+    # The job may have been half done: it is not run a second time here
+    print("Error: the service closed the connection before the command finished (see data/service.log).",
+          file=sys.stderr)
+    return 1
+
+
+def forward(argv: list[str]) -> int | None:
+    """
+    Runs 'argv' on the running service, with this process's working directory,
+    and returns its exit code; None if it must run here (no service, or a
+    command the service does not take).
+    """
+    if not argv or argv[0] not in FORWARDED_COMMANDS or os.environ.get(ENABLE_ENV) == "0":
+        return None
+    return _request({"argv": argv, "cwd": os.getcwd()})
+
+
+def status() -> int:
+    code = _request({"control": "status"}, timeout=10.0)
+    if code is None:
+        print(f"No service is running on {socket_path()}.")
+        return 1
+    return code
+
+
+def stop() -> int:
+    code = _request({"control": "stop"}, timeout=10.0)
+    if code is None:
+        print(f"No service is running on {socket_path()}.")
+        return 1
+    return code
+
+
+def spawn(workers: int | None = None) -> int:
+    """Starts 'main.py serve' in the background and waits until it takes calls."""
+    if not _supported():
+        print("Error: the resident service needs Unix domain sockets.")
+        return 2
+    command = [sys.executable, str(Path(__file__).with_name("main.py")), "serve"]
+    if workers:
+        command += ["--workers", str(workers)]
+    LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with open(LOG_FILE, "ab") as log:
+        proc = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+                                start_new_session=True)
+
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            print(f"Error: the service exited with code {proc.returncode} (see {LOG_FILE}).")
+            return 1
+        sock = _connect(socket_path())
+        if sock is not None:
+            sock.close()
+            print(f"Service started (pid {proc.pid}) on {socket_path()}. Log: {LOG_FILE}")
+            return 0
+        time.sleep(0.1)
+    print(f"Error: the service did not start within {START_TIMEOUT:.0f}s (see {LOG_FILE}).")
+    return 1
+
+
+# --- Service ---
+
+class _ClientStream:
+    """
+    Stands in for sys.stdout/sys.stderr in the service: what a thread running a
+    client's command prints goes to that client; everything else to the log.
+    """
+
+    def __init__(self, fallback, key: str):
+        self._fallback = fallback
+        self._key = key
+
+    def write(self, text: str) -> int:
+        send = getattr(_client, "send", None)
+        if send is None:
+            return self._fallback.write(text)
+        send({self._key: text})
+        return len(text)
+
+    def flush(self):
+        if getattr(_client, "send", None) is None:
+            self._fallback.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._fallback, name)
+
+
+class _Service:
+    def __init__(self, workers: int | None):
+        self.workers = workers
+        self.port = None
+        self.started = time.time()
+        self.served = 0
+        self.running: set[threading.Thread] = set()
+        self.stopping = threading.Event()
+        self._lock = threading.Lock()
+
+    def warm_up(self):
+        # Everything a call would load, loaded once. The pool comes first: its
+        # workers are forked with the image stack imported and before any thread runs.
+        import actions
+        from local_server import start_local_server
+        from utils.ar_utils import MINDAR_OFFLINE_DIR, get_mind_worker
+        from utils.batch_utils import start_shared_pool
+        from utils.utils import get_local_ip
+
+        self.workers = start_shared_pool(self.workers)
+        self.port = start_local_server()
+        get_local_ip()
+        actions.get_media_store()
+        for template in (actions.AR_TEMPLATE, actions.AR_ALBUM_TEMPLATE):
+            try:
+                actions.read_template(template)
+            except FileNotFoundError:
+                pass
+        if (MINDAR_OFFLINE_DIR / "node_modules").is_dir():
+            threading.Thread(target=self._start_mind_worker, args=(get_mind_worker(),), daemon=True).start()
+
+    @staticmethod
+    def _start_mind_worker(worker):
+        try:
+            if not worker.start():
+                print("The .mind compiler did not get ready in time; it is started again on first use.")
+        except Exception as e:
+            print(f"Could not start the .mind compiler ahead of time: {e}")
+
+    def handle(self, conn: socket.socket):
+        lock = threading.Lock()
+
+        def send(message: dict):
+            try:
+                with lock:
+                    _send(conn, message)
+            except OSError:
+                # The client went away: the command still runs to the end
+                pass
+
+        try:
+            with conn:
+                request = next(_messages(conn), None)
+                if request is None:
+                    return
+                if request.get("control") == "stop":
+                    send({"out": "Service stopping.\n"})
+                    send({"exit": 0})
+                    self.stopping.set()
+                elif request.get("control") == "status":
+                    send({"out": self._status()})
+                    send({"exit": 0})
+                else:
+                    send({"exit": self._run(request, send)})
+        except (OSError, ValueError) as e:
+            print(f"Bad request: {e}")
+        finally:
+            with self._lock:
+                self.running.discard(threading.current_thread())
+
+    def _run(self, request: dict, send) -> int:
+        from cli import run_cli
+        with self._lock:
+            self.served += 1
+        _client.send = send
+        try:
+            return run_cli(request["argv"], cwd=request.get("cwd"))
+        except SystemExit as e:
+            # argparse errors and --help
+            if isinstance(e.code, str):
+                print(e.code, file=sys.stderr)
+                return 1
+            return e.code or 0
+        except Exception:
+            traceback.print_exc()
+            return 1
+        finally:
+            _client.send = None
+
+    def _status(self) -> str:
+        with self._lock:
+            running = len(self.running) - 1
+        return (f"Service running (pid {os.getpid()}) for {time.time() - self.started:.0f}s on {socket_path()}\n"
+                f"  local server: port {self.port}\n"
+                f"  batch pool:   {self.workers} worker process(es)\n"
+                f"  commands:     {self.served} run, {running} in progress\n")
+
+
+def serve(workers: int | None = None) -> int:
+    """Runs the service in this process until 'serve --stop', SIGTERM or Ctrl+C."""
+    if not _supported():
+        print("Error: the resident service needs Unix domain sockets.")
+        return 2
+    path = socket_path()
+    probe = _connect(path)
+    if probe is not None:
+        probe.close()
+        print(f"Error: a service is already running on {path}.")
+        return 2
+
+    service = _Service(workers)
+    start = time.perf_counter()
+    service.warm_up()
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Left behind by a service that did not stop cleanly
+    path.unlink(missing_ok=True)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # Only this user may submit jobs
+    umask = os.umask(0o177)
+    try:
+        listener.bind(str(path))
+    finally:
+        os.umask(umask)
+    listener.listen(64)
+    listener.settimeout(0.5)
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: service.stopping.set())
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = _ClientStream(stdout, "out"), _ClientStream(stderr, "err")
+    print(f"Service ready in {time.perf_counter() - start:.1f}s (pid {os.getpid()}, socket {path}, "
+          f"local server on port {service.port}, {service.workers} batch worker(s)).", flush=True)
+    try:
+        while not service.stopping.is_set():
+            try:
+                conn, _ = listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                if service.stopping.is_set():
+                    break
+                raise
+            conn.settimeout(None)
+            thread = threading.Thread(target=service.handle, args=(conn,), daemon=True)
+            with service._lock:
+                service.running.add(thread)
+            thread.start()
+    finally:
+        listener.close()
+        path.unlink(missing_ok=True)
+        print("Stopping: waiting for the running commands...", flush=True)
+        with service._lock:
+            running = list(service.running)
+        for thread in running:
+            thread.join()
+        from local_server import stop_local_server
+        from utils.batch_utils import stop_shared_pool
+        stop_local_server()
+        stop_shared_pool()
+        sys.stdout, sys.stderr = stdout, stderr
+        print("Service stopped.", flush=True)
+    return 0
@@ -0,0 +1,50 @@
+import struct
+
+from utils.media_store import MediaStore
+from utils.mp4_faststart import needs_faststart
+from utils.shortid import sha256_file
+
+
+def _box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", len(payload) + 8, box_type) + payload
+
+
+def _moov_last_mp4(chunk_offset: int) -> bytes:
+    stco = _box(b"stco", struct.pack(">III", 0, 1, chunk_offset))
+    moov = _box(b"moov", _box(b"trak", _box(b"mdia", _box(b"minf", _box(b"stbl", stco)))))
+    return _box(b"ftyp", b"isom\0\0\0\0isom") + _box(b"mdat", b"\1" * 64) + moov
+
+
+def test_faststart_rewrites_moov_last_video(tmp_path):
+    source = tmp_path / "clip.mp4"
+    source.write_bytes(_moov_last_mp4(chunk_offset=32))
+    store = MediaStore(tmp_path / "media", tmp_path / "index.json")
+
+    stored = store.store(source)
+
+    assert not needs_faststart(stored)
+    assert stored.read_bytes() != source.read_bytes()
+
+
+def test_video_the_rewrite_rejects_is_stored_as_is(tmp_path):
+    # moov after mdat, but its chunk offset points past the end of the file
+    source = tmp_path / "odd.mp4"
+    source.write_bytes(_moov_last_mp4(chunk_offset=1 << 20))
+    assert needs_faststart(source)
+    store = MediaStore(tmp_path / "media", tmp_path / "index.json")
+
+    stored = store.store(source)
+
+    assert stored.read_bytes() == source.read_bytes()
+    assert sha256_file(stored) == sha256_file(source)
+    assert [p.name for p in (tmp_path / "media").iterdir()] == [stored.name]
+
+
+def test_truncated_video_is_stored_as_is(tmp_path):
+    source = tmp_path / "cut.mp4"
+    source.write_bytes(_moov_last_mp4(chunk_offset=32)[:-10])
+    store = MediaStore(tmp_path / "media", tmp_path / "index.json")
+
+    stored = store.store(source)
+
+    assert stored.read_bytes() == source.read_bytes()
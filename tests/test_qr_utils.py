@@ -0,0 +1,31 @@
+from utils import qr_utils
+from utils.qr_utils import get_qr_mask, qr_cache_info
+
+
+def test_mask_cache_is_bounded_by_bytes(monkeypatch):
+    monkeypatch.setattr(qr_utils, "_mask_cache", qr_utils._MaskCache(max_bytes=3 * 400 * 400))
+
+    for i in range(10):
+        get_qr_mask(f"https://example.com/{i}", 400)
+        assert qr_cache_info()["mask"]["bytes"] <= 3 * 400 * 400
+
+    info = qr_cache_info()["mask"]
+    assert info["size"] == 3
+    assert info["bytes"] == 3 * 400 * 400
+
+
+def test_mask_cache_keeps_recent_masks_and_skips_oversized_ones(monkeypatch):
+    monkeypatch.setattr(qr_utils, "_mask_cache", qr_utils._MaskCache(max_bytes=2 * 300 * 300))
+
+    first = get_qr_mask("a", 300)
+    get_qr_mask("b", 300)
+    assert get_qr_mask("a", 300) is first
+    get_qr_mask("c", 300)
+    # 'b' was the least recently used
+    assert get_qr_mask("a", 300) is first
+    assert qr_cache_info()["mask"]["size"] == 2
+
+    big = get_qr_mask("d", 1000)
+    assert big.size == (1000, 1000)
+    assert get_qr_mask("d", 1000) is not big
+    assert qr_cache_info()["mask"]["bytes"] == 2 * 300 * 300
@@ -0,0 +1,61 @@
+import threading
+import time
+from pathlib import Path
+
+from PIL import Image
+
+from utils import ar_utils
+from utils.job_runner import Job, JobJournal
+from utils.watch_folder import FolderWatcher, watch
+
+
+def _wait_until(condition, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return condition()
+
+
+def test_live_photo_job_does_not_feed_the_watcher(tmp_path, monkeypatch):
+    drop = tmp_path / "drop"
+    drop.mkdir()
+    monkeypatch.setattr(ar_utils, "TEMP_IMAGE_DIR", tmp_path / "tmp")
+    # Larger than Full HD, so the live-photo job writes a downscaled copy
+    Image.new("RGB", (2400, 1600), "white").save(drop / "beach.jpg")
+    (drop / "beach.mp4").write_bytes(b"\0" * 64)
+
+    temps: list[Path] = []
+    jobs: list[str] = []
+
+    def live_photo(params: dict, limits) -> Path:
+        # The downscale stage of a live-photo job; the .mind compile is not needed here
+        temp = ar_utils._create_img_light_version_if_needed(params["image"])
+        temps.append(temp)
+        return temp
+
+    def job_for_group(group: dict) -> Job:
+        if "video" in group:
+            jobs.append("live-photo")
+            return Job("live-photo", {"image": group["image"], "media": group["video"]}, 0)
+        jobs.append("watermark")
+        return Job("watermark", {"image": group["image"]}, 0)
+
+    results = []
+    watcher = FolderWatcher(drop, settle=0.1, poll_interval=0.1, pair_wait=0.1)
+    stop = threading.Event()
+    thread = threading.Thread(target=watch, args=(
+        watcher, job_for_group, {"live-photo": live_photo}, JobJournal(tmp_path / "journal.jsonl"),
+        lambda result, key: results.append(result)), kwargs={"workers": 1, "stop": stop})
+    thread.start()
+    try:
+        assert _wait_until(lambda: results)
+        # Long enough for a file written into the folder to settle and be handed out
+        time.sleep(1.0)
+    finally:
+        stop.set()
+        thread.join()
+
+    assert jobs == ["live-photo"]
+    assert results[0].ok
+    assert temps[0].parent == tmp_path / "tmp"
+    assert sorted(p.name for p in drop.iterdir()) == ["beach.jpg", "beach.mp4"]
@@ -0,0 +1,56 @@
+import fs from 'fs';
+import { loadImage } from 'canvas';
+
+let OfflineCompilerClass = null;
+
+export async function importOfflineCompiler() {
+    if (OfflineCompilerClass) return OfflineCompilerClass;
+    try {
+        const { OfflineCompiler } = await import('mind-ar/src/image-target/offline-compiler.js');
+        OfflineCompilerClass = OfflineCompiler;
+        return OfflineCompiler;
+    } catch (e) {
+        console.error('Failed to import OfflineCompiler from your fork.', e);
+        throw new Error(
+            'Could not load OfflineCompiler. Check if the "mind-ar" package is installed correctly.'
+        );
+    }
+}
+
+export async function loadImages(paths) {
+    const imgs = [];
+    for (const p of paths) {
+        const img = await loadImage(p);
+        imgs.push(img);
+    }
+    return imgs;
+}
+
+/**
+ * Compiles the input images (or re-exports a single .mind input) into `output`.
+ * `onProgress` receives the compiler's progress percentage. Once `isCancelled()`
+ * returns true, nothing is written and the promise rejects.
+ */
+export async function compileToFile(inputs, output, onProgress = () => {}, isCancelled = () => false) {
+    const OfflineCompiler = await importOfflineCompiler();
+
+    const isSingleMind = inputs.length === 1 && inputs[0].toLowerCase().endsWith('.mind');
+
+    const compiler = new OfflineCompiler();
+
+    if (isSingleMind) {
+        const buf = fs.readFileSync(inputs[0]);
+        const arrBuf = buf.buffer.slice(buf.byteOffset, buf.byteOffset + buf.byteLength);
+        compiler.importData(arrBuf);
+    } else {
+        const images = await loadImages(inputs);
+        if (isCancelled()) throw new Error('Cancelled.');
+        await compiler.compileImageTargets(images, onProgress);
+    }
+
+    if (isCancelled()) throw new Error('Cancelled.');
+    const out = compiler.exportData();
+    const outBuf = Buffer.isBuffer(out) ? out : Buffer.from(new Uint8Array(out));
+    fs.writeFileSync(output, outBuf);
+    return output;
+}
@@ -0,0 +1,90 @@
+// Long-lived compiler: one JSON request per stdin line, JSON events on stdout.
+//
+//   request:  {"id": "1", "inputs": ["a.jpg", "b.png"], "output": "targets.mind"}
+//             {"cancel": "1"}   (drops job 1 if queued; if running, its output is not written)
+//   events:   {"type": "ready"}                          (once, after the compiler is loaded)
+//             {"id": "1", "type": "progress", "progress": 42.5}
+//             {"id": "1", "type": "done", "output": "/abs/targets.mind"}
+//             {"id": "1", "type": "error", "error": "..."}
+//
+// Jobs run one at a time, in the order they arrive. Anything the libraries print
+// goes to stderr so stdout only carries the protocol.
+import path from 'path';
+import readline from 'readline';
+import { compileToFile, importOfflineCompiler } from './compile-lib.mjs';
+
+const send = (msg) => process.stdout.write(JSON.stringify(msg) + '\n');
+
+console.log = (...args) => console.error(...args);
+console.info = console.log;
+
+const queue = [];
+let running = false;
+let current = null;
+
+function cancel(id) {
+    const index = queue.findIndex((job) => job.id === id);
+    if (index >= 0) {
+        queue.splice(index, 1);
+        send({ id, type: 'error', error: 'Cancelled.' });
+    } else if (current && current.id === id) {
+        current.cancelled = true;
+    }
+}
+
+async function runQueue() {
+    if (running) return;
+    running = true;
+    while (queue.length) {
+        const job = queue.shift();
+        current = job;
+        try {
+            if (!Array.isArray(job.inputs) || !job.inputs.length || !job.output) {
+                throw new Error('A job needs "inputs" (non-empty list) and "output".');
+            }
+            let lastSent = -1;
+            await compileToFile(job.inputs, job.output, (p) => {
+                // Throttle to whole percent steps
+                if (Math.floor(p) !== lastSent) {
+                    lastSent = Math.floor(p);
+                    send({ id: job.id, type: 'progress', progress: p });
+                }
+            }, () => job.cancelled === true);
+            send({ id: job.id, type: 'done', output: path.resolve(job.output) });
+        } catch (err) {
+            send({ id: job.id, type: 'error', error: String(err?.stack || err) });
+        }
+    }
+    current = null;
+    running = false;
+}
+
+(async () => {
+    await importOfflineCompiler();
+    send({ type: 'ready' });
+
+    const rl = readline.createInterface({ input: process.stdin, crlfDelay: Infinity });
+    rl.on('line', (line) => {
+        if (!line.trim()) return;
+        let job;
+        try {
+            job = JSON.parse(line);
+        } catch (err) {
+            send({ id: null, type: 'error', error: `Invalid JSON request: ${err.message}` });
+            return;
+        }
+        if (job && job.cancel !== undefined) {
+            cancel(job.cancel);
+            return;
+        }
+        queue.push(job);
+        runQueue();
+    });
+    rl.on('close', () => {
+        const waitForQueue = () => (running || queue.length) ? setTimeout(waitForQueue, 50) : process.exit(0);
+        waitForQueue();
+    });
+})().catch((err) => {
+    console.error('Failed to start the compiler worker:', err?.stack || err);
+    process.exit(1);
+});
@@ -1,71 +1,244 @@
+import atexit
+import hashlib
+import html
+import json
 import os
+from concurrent.futures import Future
+from functools import lru_cache
 from pathlib import Path
-import subprocess
+from typing import NamedTuple
 from PIL import Image
 
+from . import metrics
+from .mind_cache import MindCache
+from .mind_worker import MindCompilerError, MindCompilerWorker, wait_for
+from .shortid import random_code
+from .utils import DATA_DIR, ensure_unique_filename
+
 MINDAR_OFFLINE_DIR = Path("tools/mindar_offline").resolve()
 
-def generate_mind_file(image_path: Path, output_path: Path) -> Path | None:
-    print("\n Generating .mind marker with MindAR OfflineCompiler...")
+mind_cache = MindCache(DATA_DIR / "mind_cache")
+# Downscaled copies for the compiler; never next to the source, which may be a watched folder
+TEMP_IMAGE_DIR = DATA_DIR / "tmp"
 
-    compiler_script = MINDAR_OFFLINE_DIR / "compile-offline.mjs"
-    node_modules_dir = MINDAR_OFFLINE_DIR / "node_modules"
+_mind_worker = None
 
-    if not node_modules_dir.is_dir():
-        print("❌ Node.js dependencies not found in the tool directory!")
-        print("   Please run the installation command to download the required packages.")
-        print(f"\n   --> cd \"{MINDAR_OFFLINE_DIR}\" && npm install\n")
-        return None
+def get_mind_worker() -> MindCompilerWorker:
+    """Shared, lazily started compiler worker; stopped when the program exits."""
+    global _mind_worker
+    if _mind_worker is None:
+        _mind_worker = MindCompilerWorker(MINDAR_OFFLINE_DIR)
+        atexit.register(_mind_worker.close)
+    return _mind_worker
 
-    processed_image_path = _create_img_light_version_if_needed(image_path)
-    is_temp_image = processed_image_path != image_path
+@lru_cache(maxsize=1)
+def mind_compiler_version() -> str:
+    """
+    Identifies the compiler build: the resolved mind-ar package and the compile
+    routine itself. Any change invalidates previously cached .mind files.
+    """
+    sha = hashlib.sha256()
+    try:
+        lock = json.loads((MINDAR_OFFLINE_DIR / "package-lock.json").read_text(encoding="utf-8"))
+        mind_ar = lock.get("packages", {}).get("node_modules/mind-ar", {})
+        sha.update(f"{mind_ar.get('version')}|{mind_ar.get('resolved')}".encode("utf-8"))
+    except (OSError, ValueError):
+        sha.update(b"unknown")
+    try:
+        sha.update((MINDAR_OFFLINE_DIR / "compile-lib.mjs").read_bytes())
+    except OSError:
+        pass
+    return sha.hexdigest()[:16]
+
+class MindShard(NamedTuple):
+    mind_path: Path
+    images: list[Path]  # images[i] is tracked as target index i
 
+def _node_dependencies_installed() -> bool:
+    if (MINDAR_OFFLINE_DIR / "node_modules").is_dir():
+        return True
+    print("❌ Node.js dependencies not found in the tool directory!")
+    print("   Please run the installation command to download the required packages.")
+    print(f"\n   --> cd \"{MINDAR_OFFLINE_DIR}\" && npm install\n")
+    return False
+
+def _submit_targets(
+        processed_paths: list[Path],
+        output_path: Path,
+        on_progress=None
+) -> tuple[Future | None, str | None]:
+    """
+    Starts compiling 'processed_paths' into 'output_path', or serves it from the cache.
+    Returns the future and, when the result should be cached afterwards, its cache key.
+    """
+    cache_key = None
     try:
-        output_path.parent.mkdir(parents=True, exist_ok=True)
-        command = [
-            "node", str(compiler_script),
-            "-i", str(processed_image_path.resolve()),
-            "-o", str(output_path.resolve())
-        ]
-
-        result = subprocess.run(
-            command,
-            cwd=str(MINDAR_OFFLINE_DIR),
-            capture_output=True,
-            text=True,
-            check=False
-        )
+        cache_key = mind_cache.key(processed_paths, mind_compiler_version())
+        if mind_cache.get(cache_key, output_path):
+            print(f"✅ .mind file served from cache: {output_path}")
+            done = Future()
+            done.set_result(output_path)
+            return done, None
+    except OSError as e:
+        print(f"Warning: Could not use the .mind cache. Error: {e}")
 
-        if result.stdout:
-            print(result.stdout.strip())
-        if result.stderr:
-            print("--- Errors ---")
-            print(result.stderr.strip())
+    if not _node_dependencies_installed():
+        return None, None
 
-        if result.returncode == 0 and output_path.exists():
-            print(f"\n✅ .mind file generated successfully: {output_path}")
-            return output_path
-        else:
-            print(f"❌ The process failed with exit code {result.returncode}.")
-            print("   Review the output above for errors from the Node.js script.")
-            return None
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    return get_mind_worker().submit(processed_paths, output_path, on_progress), cache_key
 
-    except FileNotFoundError:
+def _print_compiler_error(e: Exception):
+    if isinstance(e, MindCompilerError):
+        print("\n--- Errors ---")
+        print(str(e).strip())
+        print("❌ The process failed.")
+        print("   Review the output above for errors from the Node.js script.")
+    elif isinstance(e, FileNotFoundError):
         print("❌ 'node' command not found in your PATH.")
         print("   Please install Node.js (version 18.20.4 is recommended) and ensure it's accessible.")
+    else:
+        print(f"❌ An unexpected error occurred: {e}")
+
+def generate_mind_file(image_path: Path, output_path: Path, preprocessed: bool = False) -> Path | None:
+    """
+    Compiles one image into 'output_path'. Pass preprocessed=True when 'image_path'
+    already comes from _create_img_light_version_if_needed (the caller then owns it).
+    """
+    print("\n Generating .mind marker with MindAR OfflineCompiler...")
+
+    if preprocessed:
+        processed_image_path = image_path
+    else:
+        processed_image_path = _create_img_light_version_if_needed(image_path)
+    is_temp_image = processed_image_path != image_path
+
+    def show_progress(progress: float):
+        print(f"\rProgress: {progress:.2f}%   ", end="", flush=True)
+
+    try:
+        with metrics.timer("mind_compile"):
+            future, cache_key = _submit_targets([processed_image_path], output_path, show_progress)
+            if future is None:
+                return None
+            wait_for(future)
+
+        if output_path.exists():
+            if cache_key:
+                print(f"\n\n✅ .mind file generated successfully: {output_path}")
+                mind_cache.put(cache_key, output_path)
+            return output_path
+        print("❌ The compiler finished but the .mind file was not written.")
         return None
+
     except Exception as e:
-        print(f"❌ An unexpected error occurred: {e}")
+        _print_compiler_error(e)
         return None
     finally:
-        if is_temp_image and processed_image_path.exists():
+        _remove_temp_image(processed_image_path, is_temp_image)
+
+def generate_mind_batch(
+        image_paths: list[Path],
+        output_dir: Path,
+        name: str = "targets",
+        shard_size: int | None = None
+) -> list[MindShard]:
+    """
+    Compiles many images into multi-target .mind files: one file for all of them, or
+    one per 'shard_size' images. Each returned shard lists its images in target index
+    order. Shards that fail are reported and left out of the result.
+    """
+    image_paths = [Path(p) for p in image_paths]
+    if not image_paths:
+        return []
+    shard_size = shard_size or len(image_paths)
+    chunks = [image_paths[i:i + shard_size] for i in range(0, len(image_paths), shard_size)]
+
+    print(f"\n Compiling {len(image_paths)} target(s) into {len(chunks)} .mind file(s)...")
+
+    temp_images = []
+    jobs = []
+    try:
+        for n, chunk in enumerate(chunks, start=1):
+            processed = []
+            for image_path in chunk:
+                processed_path = _create_img_light_version_if_needed(image_path)
+                processed.append(processed_path)
+                if processed_path != image_path:
+                    temp_images.append(processed_path)
+
+            file_name = f"{name}.mind" if len(chunks) == 1 else f"{name}-{n}.mind"
+            mind_path = ensure_unique_filename(Path(output_dir) / file_name)
+
+            def show_progress(progress: float, n=n):
+                print(f"\rShard {n}/{len(chunks)} - Progress: {progress:.2f}%   ", end="", flush=True)
+
             try:
-                os.remove(processed_image_path)
-                print(f"Temporary file cleaned up: {processed_image_path}")
-            except OSError as e:
-                print(f"Warning: Could not remove temporary file. Error: {e}")
+                future, cache_key = _submit_targets(processed, mind_path, show_progress)
+            except Exception as e:
+                _print_compiler_error(e)
+                break
+            if future is None:
+                break
+            jobs.append((MindShard(mind_path, chunk), future, cache_key))
+
+        shards = []
+        for shard, future, cache_key in jobs:
+            try:
+                with metrics.timer("mind_compile_batch"):
+                    wait_for(future)
+            except Exception as e:
+                print(f"\n❌ Shard {shard.mind_path.name} failed.")
+                _print_compiler_error(e)
+                continue
+            if cache_key:
+                mind_cache.put(cache_key, shard.mind_path)
+            shards.append(shard)
+        if jobs:
+            print()
+        return shards
+    finally:
+        for temp_path in temp_images:
+            _remove_temp_image(temp_path, True)
+
+def build_ar_album_html(template: str, mind_url: str, video_urls: list[str]) -> str:
+    """Fills template_ar_album.html: video_urls[i] plays on target index i of the .mind file."""
+    assets = []
+    targets = []
+    for i, video_url in enumerate(video_urls):
+        assets.append(
+            f'                <video id="video-{i}" src="{html.escape(video_url)}" loop="true"\n'
+            f'                       muted="true" playsinline webkit-playsinline crossorigin="anonymous"></video>'
+        )
+        targets.append(
+            f'            <a-entity mindar-image-target="targetIndex: {i}" data-index="{i}">\n'
+            f'                <a-video id="plane-{i}" shader="chromakey" color="0.1 0.9 0.2" src="#video-{i}"\n'
+            f'                         width="1" height="0.5625" position="0 0 0"></a-video>\n'
+            f'            </a-entity>'
+        )
+    return (
+        template
+        .replace("__MIND_FILE_URL__", mind_url)
+        .replace("__VIDEO_ASSETS__", "\n".join(assets))
+        .replace("__TARGET_ENTITIES__", "\n".join(targets))
+    )
+
+def _remove_temp_image(processed_image_path: Path, is_temp_image: bool):
+    if is_temp_image and processed_image_path.exists():
+        try:
+            os.remove(processed_image_path)
+            print(f"Temporary file cleaned up: {processed_image_path}")
+        except OSError as e:
+            print(f"Warning: Could not remove temporary file. Error: {e}")
 
+@metrics.timed("downscale")
 def _create_img_light_version_if_needed(image_path: Path) -> Path:
+    """
+    Returns a copy of the image shrunk to fit Full HD (saved in TEMP_IMAGE_DIR as
+    '<stem>_<code>_fhd_temp.jpg'), or the original path if it is already small enough.
+    JPEGs are decoded directly at a reduced scale (libjpeg DCT scaling), so a large
+    photo is never fully decoded.
+    """
     FHD_WIDTH = 1920
     FHD_HEIGHT = 1080
     FHD_TOTAL_PIXELS = FHD_WIDTH * FHD_HEIGHT
@@ -75,11 +248,14 @@ def _create_img_light_version_if_needed(image_path: Path) -> Path:
             image_total_pixels = img.width * img.height
 
             if image_total_pixels > FHD_TOTAL_PIXELS:
-                img_copy = img.copy()
-                img_copy.thumbnail((FHD_WIDTH, FHD_HEIGHT), Image.Resampling.LANCZOS)
+                # Only affects JPEGs: picks the smallest 1/2, 1/4 or 1/8 scale still >= FHD
+                img.draft("RGB", (FHD_WIDTH, FHD_HEIGHT))
+                # The opened image is ours to modify; no copy of the decoded frame is needed
+                img.thumbnail((FHD_WIDTH, FHD_HEIGHT), Image.Resampling.LANCZOS, reducing_gap=None)
 
-                temp_path = image_path.with_name(f"{image_path.stem}_fhd_temp.jpg")
-                img_copy.convert("RGB").save(temp_path, "JPEG", quality=90)
+                TEMP_IMAGE_DIR.mkdir(parents=True, exist_ok=True)
+                temp_path = TEMP_IMAGE_DIR / f"{image_path.stem}_{random_code(6)}_fhd_temp.jpg"
+                (img if img.mode == "RGB" else img.convert("RGB")).save(temp_path, "JPEG", quality=90)
                 return temp_path
 
     except Exception as e:
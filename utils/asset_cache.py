@@ -0,0 +1,246 @@
+import gzip
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from .http_utils import make_etag
+
+try:
+    import brotli
+except ImportError:  # Optional: only gzip variants without it
+    brotli = None
+
+# Served compressed when the client accepts it (.mind is MessagePack, mostly floats: it still shrinks)
+COMPRESSIBLE_SUFFIXES = {".html", ".htm", ".js", ".mjs", ".css", ".json", ".svg", ".txt", ".mind"}
+SIDECAR_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+# A variant is only kept if it saves at least this much
+MIN_RATIO = 0.9
+
+
+def supported_encodings() -> tuple[str, ...]:
+    """Content codings we can produce, in order of preference."""
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def is_compressible(path) -> bool:
+    return Path(path).suffix.lower() in COMPRESSIBLE_SUFFIXES
+
+
+def compress(data: bytes, encoding: str, best: bool = True) -> bytes:
+    """Best compression for sidecars written once; best=False for bodies made while a request waits."""
+    if encoding == "br":
+        return brotli.compress(data, quality=11 if best else 5)
+    return gzip.compress(data, compresslevel=9 if best else 6, mtime=0)
+
+
+def accepted_encodings(header: str | None) -> list[str]:
+    """
+    The codings from an Accept-Encoding header that we support, best first
+    (q=0 excludes a coding; '*' stands for any not listed).
+    """
+    if not header:
+        return []
+    weights = {}
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name:
+            weights[name] = q
+    wildcard = weights.get("*", 0.0)
+    ranked = [(weights.get(enc, wildcard), -i, enc) for i, enc in enumerate(supported_encodings())]
+    return [enc for q, _, enc in sorted(ranked, reverse=True) if q > 0]
+
+
+def variant_etag(etag: str, encoding: str | None) -> str:
+    """Each coding of a file is a different representation, so it gets its own strong ETag."""
+    return etag if encoding is None else f'{etag[:-1]}-{encoding}"'
+
+
+def precompress(path: Path) -> list[Path]:
+    """
+    Writes '<file>.br' / '<file>.gz' next to a compressible file, ahead of the first
+    request. The sidecars carry the source's mtime: a sidecar whose mtime no longer
+    matches is stale and ignored. Returns the sidecars written.
+    """
+    path = Path(path)
+    if not is_compressible(path):
+        return []
+    data = path.read_bytes()
+    st = path.stat()
+    written = []
+    for encoding in supported_encodings():
+        sidecar = path.with_name(path.name + SIDECAR_SUFFIXES[encoding])
+        body = compress(data, encoding)
+        if len(body) > len(data) * MIN_RATIO:
+            sidecar.unlink(missing_ok=True)
+            continue
+        temp = sidecar.with_name(f"{sidecar.name}.{os.getpid()}.tmp")
+        temp.write_bytes(body)
+        os.utime(temp, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(temp, sidecar)
+        written.append(sidecar)
+    return written
+
+
+def open_precompressed(path: str, st: os.stat_result, encodings: list[str]):
+    """
+    Opens the first up-to-date sidecar of 'path' among 'encodings'.
+    Returns (encoding, open file, its stat) or None.
+    """
+    for encoding in encodings:
+        try:
+            f = open(path + SIDECAR_SUFFIXES[encoding], "rb")
+        except OSError:
+            continue
+        fs = os.fstat(f.fileno())
+        if fs.st_mtime_ns == st.st_mtime_ns:
+            return encoding, f, fs
+        f.close()
+    return None
+
+
+@dataclass
+class CachedAsset:
+    etag: str
+    mtime: float
+    # Body per content coding; None is the identity body
+    bodies: dict[str | None, bytes] = field(default_factory=dict)
+    identity: tuple[int, int, int] = (0, 0, 0)
+    checked_at: float = 0.0
+
+    @property
+    def size(self) -> int:
+        return sum(len(body) for body in self.bodies.values())
+
+    def pick(self, encodings: list[str]) -> str | None:
+        return next((enc for enc in encodings if enc in self.bodies), None)
+
+
+class HotAssetCache:
+    """
+    Size-bounded LRU of small files (AR pages, .mind targets) held in memory with
+    their compressed variants, so a hit costs no open/stat/read.
+
+    Entries are revalidated with one stat() at most every 'revalidate_after'
+    seconds and reloaded when the file changed; invalidate() drops them at once.
+    get() may read and compress a file: an event loop calls peek(), and get()
+    in an executor when that misses.
+    """
+
+    def __init__(
+            self,
+            max_bytes: int = 64 * 1024 * 1024,
+            max_file_bytes: int = 4 * 1024 * 1024,
+            revalidate_after: float = 1.0
+    ):
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.revalidate_after = revalidate_after
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, CachedAsset] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def peek(self, path: str) -> CachedAsset | None:
+        """The cached asset for 'path' if it needs no revalidation yet (no I/O)."""
+        now = time.monotonic()
+        with self._lock:
+            asset = self._entries.get(path)
+            if asset is None or now - asset.checked_at >= self.revalidate_after:
+                return None
+            self._entries.move_to_end(path)
+            self.hits += 1
+            return asset
+
+    def get(self, path: str) -> CachedAsset | None:
+        """The cached asset for the file 'path', loading it if it is small enough."""
+        now = time.monotonic()
+        with self._lock:
+            asset = self._entries.get(path)
+            if asset is not None and now - asset.checked_at < self.revalidate_after:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return asset
+
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.invalidate(path)
+            return None
+        identity = (st.st_ino, st.st_size, st.st_mtime_ns)
+
+        if asset is not None and asset.identity == identity:
+            with self._lock:
+                asset.checked_at = now
+                if path in self._entries:
+                    self._entries.move_to_end(path)
+                self.hits += 1
+            return asset
+
+        self.invalidate(path)
+        if st.st_size > self.max_file_bytes or not os.path.isfile(path):
+            return None
+        asset = self._load(path, st)
+        if asset is None:
+            return None
+        asset.checked_at = now
+        with self._lock:
+            self.misses += 1
+            self._entries[path] = asset
+            self._bytes += asset.size
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+        return asset
+
+    def _load(self, path: str, st: os.stat_result) -> CachedAsset | None:
+        try:
+            with open(path, "rb") as f:
+                fs = os.fstat(f.fileno())
+                data = f.read()
+        except OSError:
+            return None
+        if (fs.st_ino, fs.st_size, fs.st_mtime_ns) != (st.st_ino, st.st_size, st.st_mtime_ns):
+            return None  # Changed while loading: serve from disk this time
+
+        asset = CachedAsset(make_etag(fs), fs.st_mtime, {None: data},
+                            (fs.st_ino, fs.st_size, fs.st_mtime_ns))
+        if is_compressible(path):
+            for encoding in supported_encodings():
+                body = self._read_sidecar(path, encoding, fs)
+                if body is None:
+                    body = compress(data, encoding, best=False)
+                if len(body) <= len(data) * MIN_RATIO:
+                    asset.bodies[encoding] = body
+        return asset
+
+    @staticmethod
+    def _read_sidecar(path: str, encoding: str, st: os.stat_result) -> bytes | None:
+        found = open_precompressed(path, st, [encoding])
+        if found is None:
+            return None
+        with found[1] as f:
+            return f.read()
+
+    def invalidate(self, path: str | None = None):
+        """Drops one file (or everything) from the cache."""
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+                self._bytes = 0
+                return
+            asset = self._entries.pop(path, None)
+            if asset is not None:
+                self._bytes -= asset.size
@@ -0,0 +1,334 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterable, NamedTuple
+
+from .shortid import sha256_file
+from .utils import DATA_DIR, SAVED_DIR
+
+# SMARTQR_DISK_QUOTA_MB / SMARTQR_ASSET_TTL_DAYS turn on eviction (both off by default)
+QUOTA_ENV = "SMARTQR_DISK_QUOTA_MB"
+TTL_ENV = "SMARTQR_ASSET_TTL_DAYS"
+# Assets this young are never evicted: the job that wrote them may not have linked them yet
+MIN_AGE_SECONDS = 600.0
+# Access times from the server are batched into one write per interval
+TOUCH_FLUSH_SECONDS = 30.0
+# Reservations whose file never appeared are dropped after this long
+STALE_RESERVATION_SECONDS = 24 * 3600.0
+SIDECAR_SUFFIXES = (".gz", ".br")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS assets (
+    path TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    size INTEGER,
+    sha256 TEXT,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS assets_accessed ON assets (accessed);
+CREATE TABLE IF NOT EXISTS names (
+    prefix TEXT PRIMARY KEY,
+    next INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS refs (
+    parent TEXT NOT NULL,
+    child TEXT NOT NULL,
+    PRIMARY KEY (parent, child)
+);
+"""
+
+
+class EvictionReport(NamedTuple):
+    removed: list[Path]
+    freed_bytes: int
+    total_bytes: int
+
+
+class AssetCatalog:
+    """
+    SQLite index of every generated file (watermarked images, stored media, .mind
+    targets, AR pages) under the managed directories, with its size, SHA-256,
+    creation and last access time, and which files a page loads.
+
+    allocate() hands out unique file names from a per-name counter inside one
+    transaction, so concurrent jobs (and processes) never get the same name and
+    a crowded folder is not probed name by name.
+
+    enforce() evicts the least recently used assets beyond 'quota_bytes', and
+    those not accessed for 'ttl_seconds', but never a file reachable from a live
+    QR code: whatever live_paths() returns (the short-link targets), plus the
+    files those pages load.
+    """
+
+    def __init__(
+            self,
+            db_path: Path,
+            roots: Iterable[Path] = (),
+            quota_bytes: int | None = None,
+            ttl_seconds: float | None = None
+    ):
+        self.db_path = Path(db_path)
+        self.roots = [Path(root).resolve() for root in roots]
+        self.quota_bytes = quota_bytes
+        self.ttl_seconds = ttl_seconds
+        self.live_sources: list[Callable[[], Iterable[Path]]] = []
+        self._lock = threading.Lock()
+        self._touched: dict[str, float] = {}
+        self._touched_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._flushing = False
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # Shared by threads (under _lock); other processes coordinate through SQLite's own locking
+        self._db = sqlite3.connect(str(self.db_path), timeout=30.0, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def manage(self, root: Path, live_paths: Callable[[], Iterable[Path]] | None = None):
+        """Adds a directory whose files may be recorded (and evicted), and a source of live paths."""
+        root = Path(root).resolve()
+        if root not in self.roots:
+            self.roots.append(root)
+        if live_paths is not None and live_paths not in self.live_sources:
+            self.live_sources.append(live_paths)
+
+    def _managed(self, path: Path) -> bool:
+        return any(path.is_relative_to(root) for root in self.roots)
+
+    @contextmanager
+    def _transaction(self):
+        # IMMEDIATE takes the write lock up front, so two processes cannot read the same counter
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    # --- Names ---
+
+    def allocate(self, path: Path, kind: str | None = None) -> Path:
+        """
+        Returns 'path', or 'stem(n).ext' if it is taken, and reserves it. O(1): the
+        counter for the name remembers where the last allocation stopped.
+        """
+        path = Path(path).resolve()
+        kind = kind or _kind_of(path)
+        prefix = str(path.with_suffix("")) + "\0" + path.suffix
+        now = time.time()
+        with self._transaction() as db:
+            row = db.execute("SELECT next FROM names WHERE prefix = ?", (prefix,)).fetchone()
+            n = row[0] if row else 0
+            while True:
+                candidate = path if n == 0 else path.with_name(f"{path.stem}({n}){path.suffix}")
+                n += 1
+                # Usually one check: only files made outside the catalog get skipped here
+                if not candidate.exists() and not db.execute(
+                        "SELECT 1 FROM assets WHERE path = ?", (str(candidate),)).fetchone():
+                    break
+            db.execute("INSERT OR REPLACE INTO names (prefix, next) VALUES (?, ?)", (prefix, n))
+            if self._managed(candidate):
+                db.execute("INSERT INTO assets (path, kind, created, accessed) VALUES (?, ?, ?, ?)",
+                           (str(candidate), kind, now, now))
+        return candidate
+
+    # --- Recording ---
+
+    def record(self, path: Path, kind: str, sha256: str | None = None, refs: Iterable[Path] = ()):
+        """
+        Records a file that was just written (ignored outside the managed directories),
+        and the files it loads (for pages), then enforces the quota if one is set.
+        """
+        path = Path(path).resolve()
+        if not self._managed(path):
+            return
+        st = os.stat(path)
+        digest = sha256 or sha256_file(path)
+        now = time.time()
+        with self._transaction() as db:
+            db.execute(
+                "INSERT INTO assets (path, kind, size, sha256, created, accessed) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (path) DO UPDATE SET kind = excluded.kind, size = excluded.size, "
+                "sha256 = excluded.sha256, accessed = excluded.accessed",
+                (str(path), kind, st.st_size, digest, now, now)
+            )
+            db.executemany("INSERT OR IGNORE INTO refs (parent, child) VALUES (?, ?)",
+                           [(str(path), str(Path(ref).resolve())) for ref in refs])
+        if self.quota_bytes is not None and self.total_bytes() > self.quota_bytes:
+            self.enforce()
+
+    def touch(self, path: str | Path):
+        """
+        Notes an access (e.g. a download). Never blocks, so an event loop may call
+        it: the batch is written out by a background thread, which may wait for
+        another process's write lock.
+        """
+        now = time.time()
+        with self._touched_lock:
+            self._touched[str(path)] = now
+            due = not self._flushing and time.monotonic() - self._last_flush >= TOUCH_FLUSH_SECONDS
+            if due:
+                self._flushing = True
+                self._last_flush = time.monotonic()
+        if due:
+            threading.Thread(target=self._background_flush, daemon=True).start()
+
+    def _background_flush(self):
+        try:
+            self.flush()
+        except sqlite3.Error as e:
+            print(f"Warning: Could not record access times in the asset catalog. Error: {e}")
+        finally:
+            self._flushing = False
+
+    def flush(self):
+        with self._touched_lock:
+            self._last_flush = time.monotonic()
+            touched, self._touched = self._touched, {}
+        if touched:
+            with self._transaction() as db:
+                db.executemany("UPDATE assets SET accessed = ? WHERE path = ? AND accessed < ?",
+                               [(t, p, t) for p, t in touched.items()])
+
+    def forget(self, path: Path):
+        key = str(Path(path).resolve())
+        with self._transaction() as db:
+            db.execute("DELETE FROM assets WHERE path = ?", (key,))
+            db.execute("DELETE FROM refs WHERE parent = ?", (key,))
+
+    # --- Usage and eviction ---
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM assets").fetchone()[0]
+
+    def usage(self) -> dict[str, tuple[int, int]]:
+        """(count, bytes) per kind."""
+        with self._lock:
+            rows = self._db.execute("SELECT kind, COUNT(*), COALESCE(SUM(size), 0) FROM assets GROUP BY kind")
+            return {kind: (count, size) for kind, count, size in rows}
+
+    def live_paths(self) -> set[str]:
+        """Files reachable from a live QR code: the live sources' paths and everything they load."""
+        live = {str(Path(p).resolve()) for source in self.live_sources for p in source()}
+        pending = list(live)
+        with self._lock:
+            while pending:
+                children = self._db.execute("SELECT child FROM refs WHERE parent = ?", (pending.pop(),))
+                for (child,) in children:
+                    if child not in live:
+                        live.add(child)
+                        pending.append(child)
+        return live
+
+    def sync(self) -> tuple[int, int]:
+        """
+        Records managed files the catalog does not know yet (e.g. made before it
+        existed) and drops entries whose file is gone. Returns (added, dropped).
+        """
+        self.flush()
+        with self._lock:
+            known = {path: (size, created) for path, size, created
+                     in self._db.execute("SELECT path, size, created FROM assets")}
+        added = dropped = 0
+        now = time.time()
+        for root in self.roots:
+            if not root.is_dir():
+                continue
+            for path in root.rglob("*"):
+                if (not path.is_file() or path.name.startswith(".") or path.suffix in SIDECAR_SUFFIXES
+                        or path.suffix == ".tmp"):
+                    continue
+                size, _ = known.get(str(path), (None, None))
+                if size is None:
+                    self.record(path, _kind_of(path))
+                    added += 1
+        with self._transaction() as db:
+            for path, (size, created) in known.items():
+                if not os.path.exists(path) and (size is not None or now - created > STALE_RESERVATION_SECONDS):
+                    db.execute("DELETE FROM assets WHERE path = ?", (path,))
+                    db.execute("DELETE FROM refs WHERE parent = ?", (path,))
+                    dropped += 1
+        return added, dropped
+
+    def enforce(self, quota_bytes: int | None = None, ttl_seconds: float | None = None) -> EvictionReport:
+        """
+        Deletes expired assets (last access older than the TTL), then the least
+        recently used ones until the total fits the quota. Live and recent assets
+        are always kept.
+        """
+        quota_bytes = self.quota_bytes if quota_bytes is None else quota_bytes
+        ttl_seconds = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        self.flush()
+        live = self.live_paths()
+        now = time.time()
+        with self._lock:
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM assets").fetchone()[0]
+            candidates = self._db.execute(
+                "SELECT path, size, accessed FROM assets WHERE size IS NOT NULL AND created < ? "
+                "ORDER BY accessed", (now - MIN_AGE_SECONDS,)
+            ).fetchall()
+
+        removed = []
+        freed = 0
+        for path, size, accessed in candidates:
+            expired = ttl_seconds is not None and accessed < now - ttl_seconds
+            over_quota = quota_bytes is not None and total - freed > quota_bytes
+            if not (expired or over_quota):
+                # Sorted by last access: the rest are not expired either
+                break
+            if path in live or not self._managed(Path(path)):
+                continue
+            for victim in (path, *(path + ext for ext in SIDECAR_SUFFIXES)):
+                try:
+                    os.unlink(victim)
+                except FileNotFoundError:
+                    pass
+            self.forget(Path(path))
+            removed.append(Path(path))
+            freed += size
+        return EvictionReport(removed, freed, total - freed)
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._db.close()
+
+
+def _kind_of(path: Path) -> str:
+    suffix = path.suffix.lower()
+    if suffix == ".mind":
+        return "mind"
+    if suffix in (".html", ".htm"):
+        return "page"
+    if path.is_relative_to(SAVED_DIR):
+        return "image"
+    return "media"
+
+
+_catalog = None
+_catalog_pid = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog() -> AssetCatalog:
+    """The process-wide catalog in data/assets.sqlite3, managing saved/ (and what local_server adds)."""
+    global _catalog, _catalog_pid
+    with _catalog_lock:
+        # A forked worker must not share its parent's SQLite connection
+        if _catalog is None or _catalog_pid != os.getpid():
+            _catalog_pid = os.getpid()
+            quota_mb = os.environ.get(QUOTA_ENV)
+            ttl_days = os.environ.get(TTL_ENV)
+            _catalog = AssetCatalog(
+                DATA_DIR / "assets.sqlite3", roots=[SAVED_DIR],
+                quota_bytes=int(float(quota_mb) * 1024 * 1024) if quota_mb else None,
+                ttl_seconds=float(ttl_days) * 86400 if ttl_days else None
+            )
+    return _catalog
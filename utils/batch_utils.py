@@ -0,0 +1,211 @@
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple
+
+from .encoders import DEFAULT_ENCODE, EncodeOptions, output_suffix
+from .image_utils import add_qr_watermark
+from .utils import CORNERS, SAVED_DIR, ensure_unique_filename
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff"}
+
+# Kept between batches by the resident service (see start_shared_pool())
+_shared_pool = None
+_shared_workers = 0
+
+
+class WatermarkJob(NamedTuple):
+    image: Path
+    content: str
+    corner: str = "bottom-right"
+
+
+class WatermarkResult(NamedTuple):
+    job: WatermarkJob
+    output_path: Path | None
+    error: str | None
+    elapsed: float
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def jobs_from_directory(
+        directory: Path,
+        content: str,
+        corner: str = "bottom-right",
+        recursive: bool = False
+) -> list[WatermarkJob]:
+    """
+    Builds one job per image found in 'directory', all sharing the same QR content.
+    """
+    directory = Path(directory)
+    if not directory.is_dir():
+        raise NotADirectoryError(f"Directory not found: {directory}")
+
+    pattern = "**/*" if recursive else "*"
+    images = sorted(
+        p for p in directory.glob(pattern)
+        if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS
+    )
+    return [WatermarkJob(p.resolve(), content, corner) for p in images]
+
+
+def jobs_from_manifest(manifest_path: Path) -> list[WatermarkJob]:
+    """
+    Reads (image, content, corner) jobs from a .csv (with a header row) or a .jsonl file.
+    Relative image paths are resolved against the manifest's directory.
+    """
+    manifest_path = Path(manifest_path)
+    base_dir = manifest_path.resolve().parent
+
+    if manifest_path.suffix.lower() == ".csv":
+        with open(manifest_path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+    else:
+        with open(manifest_path, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+
+    jobs = []
+    for line_no, row in enumerate(rows, start=1):
+        image = (row.get("image") or "").strip()
+        content = (row.get("content") or "").strip()
+        corner = (row.get("corner") or "bottom-right").strip()
+        if not image or not content:
+            raise ValueError(f"{manifest_path}: entry {line_no} needs 'image' and 'content'.")
+        if corner not in CORNERS:
+            raise ValueError(f"{manifest_path}: entry {line_no} has an invalid corner '{corner}'.")
+        image_path = Path(image).expanduser()
+        if not image_path.is_absolute():
+            image_path = base_dir / image_path
+        jobs.append(WatermarkJob(image_path.resolve(), content, corner))
+    return jobs
+
+
+def _reserve_output_paths(jobs: list[WatermarkJob], output_dir: Path, encode: EncodeOptions) -> list[Path]:
+    # Names are decided up front in the parent process, so workers never race
+    # for images that share the same stem
+    return [
+        ensure_unique_filename(output_dir / f"{job.image.stem}_watermarked{output_suffix(encode, job.image)}")
+        for job in jobs
+    ]
+
+
+def _watermark_worker(
+        job: WatermarkJob,
+        output_path: Path,
+        encode: EncodeOptions
+) -> tuple[Path | None, str | None, float]:
+    start = time.perf_counter()
+    try:
+        if not job.image.is_file():
+            raise FileNotFoundError(f"File not found: {job.image}")
+        out = add_qr_watermark(job.image, job.content, corner=job.corner, output_path=output_path, encode=encode)
+        return out, None, time.perf_counter() - start
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}", time.perf_counter() - start
+
+
+def start_shared_pool(workers: int | None = None) -> int:
+    """
+    Starts a process pool that every later batch not asking for its own worker
+    count runs on, instead of forking a new one each time. The workers are
+    forked right away, with everything imported so far, so call it early (before
+    other threads start). Returns the number of workers.
+    """
+    global _shared_pool, _shared_workers
+    if _shared_pool is None:
+        _shared_workers = workers or os.cpu_count() or 1
+        _shared_pool = ProcessPoolExecutor(max_workers=_shared_workers)
+        _shared_pool.submit(int).result()
+    return _shared_workers
+
+
+def stop_shared_pool():
+    global _shared_pool
+    if _shared_pool is not None:
+        _shared_pool.shutdown(cancel_futures=True)
+        _shared_pool = None
+
+
+def run_watermark_batch(
+        jobs: Iterable[WatermarkJob],
+        output_dir: Path = SAVED_DIR,
+        workers: int | None = None,
+        max_pending: int | None = None,
+        encode: EncodeOptions = DEFAULT_ENCODE
+) -> Iterator[WatermarkResult]:
+    """
+    Watermarks every job on a process pool and yields results as they finish
+    (not in submission order). Failures are yielded as results, never raised:
+    if a worker process dies, the pool is broken and every job not done yet is
+    yielded as failed.
+    """
+    jobs = list(jobs)
+    if not jobs:
+        return
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    outputs = _reserve_output_paths(jobs, output_dir, encode)
+
+    if workers is None and _shared_pool is not None:
+        workers, executor = _shared_workers, nullcontext(_shared_pool)
+    else:
+        workers = workers or os.cpu_count() or 1
+        executor = ProcessPoolExecutor(max_workers=workers)
+    # Keep only a few jobs queued per worker, so huge batches don't pile up in memory
+    max_pending = max_pending or workers * 4
+
+    with executor as pool:
+        pending = {}
+        queue = iter(zip(jobs, outputs))
+        # Set once a worker process died (e.g. killed by the OOM killer): the pool takes no more work
+        broken = None
+        not_submitted = []
+
+        def submit_next() -> bool:
+            nonlocal broken
+            if broken is not None:
+                return False
+            try:
+                job, out = next(queue)
+            except StopIteration:
+                return False
+            try:
+                pending[pool.submit(_watermark_worker, job, out, encode)] = job
+            except BrokenProcessPool as e:
+                broken = f"{type(e).__name__}: {e}"
+                not_submitted.append((job, out))
+                return False
+            return True
+
+        while len(pending) < max_pending and submit_next():
+            pass
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = pending.pop(future)
+                try:
+                    out, error, elapsed = future.result()
+                except Exception as e:
+                    out, error, elapsed = None, f"{type(e).__name__}: {e}", 0.0
+                    if isinstance(e, BrokenProcessPool):
+                        broken = error
+                yield WatermarkResult(job, out, error, elapsed)
+                submit_next()
+
+        if broken is not None:
+            for job, _ in (*not_submitted, *queue):
+                yield WatermarkResult(job, None, broken, 0.0)
+            if pool is _shared_pool:
+                # Unusable from now on: the next batch gets a new one
+                stop_shared_pool()
+                start_shared_pool(workers)
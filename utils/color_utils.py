@@ -0,0 +1,173 @@
+import numpy as np
+from PIL import Image
+
+ANALYSIS_SIZE = (128, 128)
+
+# Pillow's median cut weights each channel's range by these factors to pick the split axis
+_SPLIT_AXIS_WEIGHTS = np.array([77, 150, 29], dtype=np.int64)
+
+
+def patches_to_pixels(patches: list[Image.Image]) -> np.ndarray:
+    """
+    Shrinks every patch to ANALYSIS_SIZE and stacks them into an (N, pixels, 3) uint8 array.
+    """
+    arrays = [
+        np.asarray(p.convert("RGB").resize(ANALYSIS_SIZE, Image.Resampling.BOX)).reshape(-1, 3)
+        for p in patches
+    ]
+    return np.stack(arrays)
+
+
+def dominant_color_pairs(pixels: np.ndarray) -> np.ndarray:
+    """
+    Two dominant colors per patch, for an (N, pixels, 3) array. Returns (N, 2, 3) uint8.
+
+    This is the single median cut split that Image.quantize(colors=2, method=MEDIANCUT)
+    performs, done for all patches at once: pick the widest weighted axis, split the
+    pixels at the count median (ties stay together), and average each half.
+    """
+    px = pixels.astype(np.int64)
+    n, m, _ = px.shape
+
+    spread = (px.max(axis=1) - px.min(axis=1)) * _SPLIT_AXIS_WEIGHTS
+    axis = np.argmax(spread, axis=1)
+    values = np.take_along_axis(px, axis[:, None, None], axis=2)[..., 0]
+
+    # Pillow walks the axis from the highest value down until it passes half the pixels,
+    # then keeps every pixel sharing the last value on the same side.
+    k = m - 1 - m // 2
+    threshold = np.partition(values, k, axis=1)[:, k]
+    upper = values >= threshold[:, None]
+
+    # Nothing left for the other box: move the lowest value group there instead
+    all_upper = upper.all(axis=1)
+    if all_upper.any():
+        lowest = values.min(axis=1)
+        upper[all_upper] = values[all_upper] > lowest[all_upper, None]
+
+    upper_count = upper.sum(axis=1)
+    lower_count = m - upper_count
+    total = px.sum(axis=1)
+    upper_sum = np.einsum("nm,nmc->nc", upper.astype(np.int64), px)
+    lower_sum = total - upper_sum
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        upper_avg = np.floor(upper_sum / upper_count[:, None] + 0.5)
+        lower_avg = np.floor(lower_sum / lower_count[:, None] + 0.5)
+
+    # A flat patch has a single box; use its color twice
+    upper_avg = np.where(upper_count[:, None] > 0, upper_avg, lower_avg)
+    lower_avg = np.where(lower_count[:, None] > 0, lower_avg, upper_avg)
+    return np.stack([upper_avg, lower_avg], axis=1).astype(np.uint8)
+
+
+def relative_luminance(rgb: np.ndarray) -> np.ndarray:
+    rgb = np.asarray(rgb, dtype=np.float64) / 255.0
+    return 0.2126 * rgb[..., 0] + 0.7152 * rgb[..., 1] + 0.0722 * rgb[..., 2]
+
+
+def contrast_ratio(rgb1: np.ndarray, rgb2: np.ndarray) -> np.ndarray:
+    l1 = relative_luminance(rgb1)
+    l2 = relative_luminance(rgb2)
+    return (np.maximum(l1, l2) + 0.05) / (np.minimum(l1, l2) + 0.05)
+
+
+def _rgb_to_hsv(rgb: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Same arithmetic as colorsys.rgb_to_hsv, element-wise
+    rgb = np.asarray(rgb, dtype=np.float64) / 255.0
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    maxc = rgb.max(axis=-1)
+    minc = rgb.min(axis=-1)
+    rangec = maxc - minc
+    gray = rangec == 0
+
+    safe_range = np.where(gray, 1.0, rangec)
+    safe_max = np.where(maxc == 0, 1.0, maxc)
+    s = np.where(gray, 0.0, rangec / safe_max)
+    rc = (maxc - r) / safe_range
+    gc = (maxc - g) / safe_range
+    bc = (maxc - b) / safe_range
+
+    h = np.where(r == maxc, bc - gc, np.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+    h = np.where(gray, 0.0, np.mod(h / 6.0, 1.0))
+    return h, s, maxc
+
+
+def _hsv_to_rgb255(h: np.ndarray, s: np.ndarray, v: np.ndarray) -> np.ndarray:
+    # Same arithmetic as colorsys.hsv_to_rgb, then rounded to 0-255 like round() does
+    i = (h * 6.0).astype(np.int64)
+    f = h * 6.0 - i
+    p = v * (1.0 - s)
+    q = v * (1.0 - s * f)
+    t = v * (1.0 - s * (1.0 - f))
+    i = i % 6
+
+    r = np.choose(i, [v, q, p, p, t, v])
+    g = np.choose(i, [t, v, v, q, p, p])
+    b = np.choose(i, [p, p, t, v, v, q])
+    gray = s == 0.0
+    rgb = np.stack([np.where(gray, v, r), np.where(gray, v, g), np.where(gray, v, b)], axis=-1)
+    return np.rint(rgb * 255).astype(np.int64)
+
+
+def ensure_min_contrast(
+        fg_rgb: np.ndarray,
+        bg_rgb: np.ndarray,
+        min_ratio: float = 2.8,
+        max_steps: int = 12
+) -> np.ndarray:
+    """
+    For (N, 3) module/background pairs, darkens or lightens each background (in HSV
+    value, keeping hue and saturation) until it reaches 'min_ratio' against its module.
+    """
+    fg = np.asarray(fg_rgb, dtype=np.int64).reshape(-1, 3)
+    bg = np.asarray(bg_rgb, dtype=np.int64).reshape(-1, 3)
+    result = bg.copy()
+
+    pending = contrast_ratio(fg, bg) < min_ratio
+    if not pending.any():
+        return result
+
+    h, s, v = _rgb_to_hsv(bg)
+    # If the background is darker than the module, make it even darker. Otherwise, lighten it.
+    make_bg_darker = relative_luminance(bg) < relative_luminance(fg)
+
+    for i in range(1, max_steps + 1):
+        # Increase the step size with each iteration to converge faster
+        step_size = 0.06 + 0.02 * i
+        new_v = np.where(make_bg_darker, v * (1.0 - step_size), v + (1.0 - v) * step_size)
+        candidate = _hsv_to_rgb255(h, s, np.clip(new_v, 0.0, 1.0))
+
+        reached = pending & (contrast_ratio(fg, candidate) >= min_ratio)
+        result[reached] = candidate[reached]
+        pending &= ~reached
+        if not pending.any():
+            return result
+        v = np.where(pending, new_v, v)
+
+    # Keep the last calculated color if the ideal contrast isn't met
+    last = _hsv_to_rgb255(h, s, np.clip(v, 0.0, 1.0))
+    result[pending] = last[pending]
+    return result
+
+
+def pick_qr_colors(
+        patches: list[Image.Image],
+        min_contrast: float
+) -> list[tuple[tuple[int, int, int], tuple[int, int, int]]]:
+    """
+    Returns a (module_rgb, background_rgb) pair per patch: the darker dominant color
+    draws the modules, the lighter one is the background, pushed to 'min_contrast'.
+    """
+    pairs = dominant_color_pairs(patches_to_pixels(patches)).astype(np.int64)
+    first, second = pairs[:, 0], pairs[:, 1]
+
+    first_is_darker = (relative_luminance(first) < relative_luminance(second))[:, None]
+    module = np.where(first_is_darker, first, second)
+    background = np.where(first_is_darker, second, first)
+    background = ensure_min_contrast(module, background, min_ratio=min_contrast)
+
+    return [
+        (tuple(int(c) for c in m), tuple(int(c) for c in b))
+        for m, b in zip(module, background)
+    ]
@@ -0,0 +1,127 @@
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, NamedTuple
+
+if TYPE_CHECKING:  # Only for annotations: the CLI reads PRESETS and the formats without loading Pillow
+    from PIL import Image
+
+from . import metrics
+
+PRESETS = ("fast", "balanced", "small")
+EXIF_ORIENTATION = 0x0112
+
+
+class EncodeOptions(NamedTuple):
+    # "source" keeps the input's format (or follows the output file's extension)
+    format: str = "source"
+    preset: str = "balanced"
+    # JPEG/WebP quality (1-100), overriding the preset's
+    quality: int | None = None
+
+
+DEFAULT_ENCODE = EncodeOptions()
+
+
+def _save_png(image: "Image.Image", dest: Path, preset: str, quality: int | None, metadata: dict):
+    # zlib level dominates PNG time on large photos: level 1 is several times faster than 6
+    level = {"fast": 1, "balanced": 4, "small": 9}[preset]
+    image.save(dest, "PNG", compress_level=level, optimize=preset == "small", **metadata)
+
+
+def _save_jpeg(image: "Image.Image", dest: Path, preset: str, quality: int | None, metadata: dict):
+    default_quality, optimize, progressive = {
+        "fast": (90, False, False),
+        "balanced": (90, True, False),
+        "small": (82, True, True),
+    }[preset]
+    image.save(dest, "JPEG", quality=quality or default_quality, optimize=optimize,
+               progressive=progressive, **metadata)
+
+
+def _save_webp(image: "Image.Image", dest: Path, preset: str, quality: int | None, metadata: dict):
+    default_quality, method = {"fast": (85, 0), "balanced": (85, 4), "small": (80, 6)}[preset]
+    image.save(dest, "WEBP", quality=quality or default_quality, method=method, **metadata)
+
+
+# format -> (save function, file extension); see register_encoder()
+ENCODERS: dict[str, tuple[Callable, str]] = {
+    "png": (_save_png, ".png"),
+    "jpeg": (_save_jpeg, ".jpg"),
+    "webp": (_save_webp, ".webp"),
+}
+# Pillow format names and file extensions of the inputs we can write back as is
+_SOURCE_FORMATS = {"PNG": "png", "JPEG": "jpeg", "MPO": "jpeg", "WEBP": "webp"}
+_SUFFIX_FORMATS = {".png": "png", ".jpg": "jpeg", ".jpeg": "jpeg", ".webp": "webp"}
+
+
+def register_encoder(fmt: str, save: Callable, suffix: str):
+    """
+    Adds (or replaces) an output format. 'save(image, dest, preset, quality, metadata)'
+    writes the RGB image to 'dest'; metadata holds the source's 'exif'/'icc_profile' bytes.
+    """
+    ENCODERS[fmt] = (save, suffix)
+    _SUFFIX_FORMATS.setdefault(suffix.lower(), fmt)
+
+
+def format_choices() -> list[str]:
+    return ["source", *ENCODERS]
+
+
+def resolve_format(options: EncodeOptions, source: Path | str | None, output_path: Path | None = None) -> str:
+    """
+    The format to write: an explicit options.format, else the output file's extension,
+    else the source's format ('source' is a Pillow format name or a file path), else PNG.
+    """
+    if options.format != "source":
+        if options.format not in ENCODERS:
+            raise ValueError(f"Unknown output format '{options.format}' (use one of: {', '.join(format_choices())}).")
+        return options.format
+    if output_path is not None and Path(output_path).suffix.lower() in _SUFFIX_FORMATS:
+        return _SUFFIX_FORMATS[Path(output_path).suffix.lower()]
+    if isinstance(source, str) and source in _SOURCE_FORMATS:
+        return _SOURCE_FORMATS[source]
+    if source is not None:
+        return _SUFFIX_FORMATS.get(Path(source).suffix.lower(), "png")
+    return "png"
+
+
+def output_suffix(options: EncodeOptions, source_path: Path) -> str:
+    """Extension of the file add_qr_watermark() will write for 'source_path' (decided without opening it)."""
+    return ENCODERS[resolve_format(options, source_path)][1]
+
+
+def source_metadata(img: "Image.Image") -> dict:
+    """
+    EXIF and ICC profile of an opened image, as the raw bytes the encoders take,
+    so they carry through without decoding the pixels again. The EXIF orientation
+    is reset: the watermark is drawn on the stored pixels, so a viewer rotating the
+    output would move the QR code to another corner.
+    """
+    metadata = {}
+    if img.info.get("icc_profile"):
+        metadata["icc_profile"] = img.info["icc_profile"]
+    if img.info.get("exif"):
+        exif = img.getexif()
+        if exif.get(EXIF_ORIENTATION, 1) != 1:
+            exif[EXIF_ORIENTATION] = 1
+            metadata["exif"] = exif.tobytes()
+        else:
+            metadata["exif"] = img.info["exif"]
+    return metadata
+
+
+def encode_image(
+        image: "Image.Image",
+        dest: Path,
+        options: EncodeOptions = DEFAULT_ENCODE,
+        metadata: dict | None = None,
+        source_format: str | None = None
+) -> str:
+    """Writes the RGB 'image' to 'dest' and returns the format used."""
+    if options.preset not in PRESETS:
+        raise ValueError(f"Unknown encoder preset '{options.preset}' (use one of: {', '.join(PRESETS)}).")
+    fmt = resolve_format(options, source_format, dest)
+    save, _ = ENCODERS[fmt]
+    with metrics.timer("encode", format=fmt):
+        save(image, dest, options.preset, options.quality, metadata or {})
+    metrics.add_bytes("encode", Path(dest).stat().st_size)
+    return fmt
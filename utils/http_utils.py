@@ -0,0 +1,177 @@
+import email.utils
+import os
+import secrets
+from typing import Callable
+
+# Only for content-addressed files, whose name never points to other bytes
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+DEFAULT_CACHE_CONTROL = "no-cache"
+MEDIA_PREFIX = "media/"
+MAX_RANGES = 16
+COPY_CHUNK = 256 * 1024
+
+
+def make_etag(st: os.stat_result) -> str:
+    """Strong validator from the file identity: inode, size and mtime (ns)."""
+    return f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+
+def cache_control_for(url_path: str, content_addressed: Callable[[str], bool] | None = None) -> str:
+    """
+    Long-lived caching for 'media/<name>' when content_addressed(name) says the
+    name is a content hash (a MediaStore object); revalidation (ETag) for the
+    rest, such as .mind files and pages, whose names may be reused.
+    """
+    path = url_path.lstrip("/")
+    name = path[len(MEDIA_PREFIX):]
+    if content_addressed and path.startswith(MEDIA_PREFIX) and "/" not in name and content_addressed(name):
+        return IMMUTABLE_CACHE_CONTROL
+    return DEFAULT_CACHE_CONTROL
+
+
+def _etag_list(value: str) -> list[str]:
+    return [tag.strip() for tag in value.split(",") if tag.strip()]
+
+
+def _strip_weak(tag: str) -> str:
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def is_not_modified(headers, etag: str, mtime: float) -> bool:
+    """
+    True when a GET/HEAD can be answered with 304. If-None-Match (weak comparison)
+    takes precedence over If-Modified-Since, as RFC 9110 requires.
+    """
+    if_none_match = headers.get("If-None-Match")
+    if if_none_match is not None:
+        tags = _etag_list(if_none_match)
+        return "*" in tags or _strip_weak(etag) in (_strip_weak(t) for t in tags)
+
+    if_modified_since = headers.get("If-Modified-Since")
+    if if_modified_since:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError, IndexError, OverflowError):
+            return False
+        return int(mtime) <= since
+    return False
+
+
+def if_range_allows(headers, etag: str, mtime: float) -> bool:
+    """A Range is honored only if If-Range (when present) still matches the file."""
+    if_range = headers.get("If-Range")
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        # Strong comparison: weak tags never match
+        return if_range == etag
+    try:
+        return int(mtime) == int(email.utils.parsedate_to_datetime(if_range).timestamp())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return False
+
+
+def parse_range(header: str | None, size: int) -> list[tuple[int, int]] | None:
+    """
+    Parses a 'bytes=' Range header into inclusive (start, end) pairs.
+    Returns None when the header is absent or should be ignored (full response),
+    and an empty list when no range is satisfiable (416).
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+
+    ranges = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, dash, last = part.partition("-")
+        if not dash:
+            return None
+        try:
+            if first.strip() == "":
+                # Suffix range: the last N bytes
+                length = int(last)
+                if length <= 0:
+                    continue
+                start, end = max(0, size - length), size - 1
+            else:
+                start = int(first)
+                if last.strip():
+                    end = int(last)
+                    if start > end:
+                        return None
+                    end = min(end, size - 1)
+                else:
+                    end = size - 1
+        except ValueError:
+            return None
+        if start < 0:
+            return None
+        if start < size:
+            ranges.append((start, end))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+    return _coalesce(ranges)
+
+
+def _coalesce(ranges: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    # Overlapping or adjacent ranges are merged, so a client can't make us send the same bytes twice
+    if len(ranges) < 2:
+        return ranges
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def content_range(start: int, end: int, size: int) -> str:
+    return f"bytes {start}-{end}/{size}"
+
+
+def new_boundary() -> str:
+    return f"smartqr-{secrets.token_hex(12)}"
+
+
+def multipart_layout(
+        ranges: list[tuple[int, int]],
+        size: int,
+        content_type: str,
+        boundary: str
+) -> tuple[list[tuple[bytes, int, int]], bytes, int]:
+    """
+    For a multipart/byteranges body, returns the (part header, start, end) list,
+    the closing delimiter and the total body length.
+    """
+    parts = []
+    total = 0
+    for start, end in ranges:
+        header = (
+            f"\r\n--{boundary}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Range: {content_range(start, end, size)}\r\n\r\n"
+        ).encode("latin-1")
+        parts.append((header, start, end))
+        total += len(header) + end - start + 1
+    closing = f"\r\n--{boundary}--\r\n".encode("latin-1")
+    return parts, closing, total + len(closing)
+
+
+def copy_range(source, write, start: int, end: int, chunk: int = COPY_CHUNK):
+    """Writes bytes start..end (inclusive) of the open file 'source' through write()."""
+    source.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        buf = source.read(min(chunk, remaining))
+        if not buf:
+            break
+        write(buf)
+        remaining -= len(buf)
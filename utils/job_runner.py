@@ -0,0 +1,298 @@
+import csv
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, NamedTuple
+
+# Job fields holding file paths: relative ones are resolved against the manifest's folder
+PATH_FIELDS = ("image", "media", "video", "output")
+
+
+class StageLimits:
+    """
+    Caps how many jobs can be inside each stage at the same time (e.g. 'cpu' for
+    image work, 'node' for .mind compilation, 'io' for copying media) and records
+    the time spent waiting for and working in each one. Stages without a limit
+    are only timed.
+    """
+
+    def __init__(self, limits: dict[str, int] | None = None):
+        self._semaphores = {
+            name: threading.BoundedSemaphore(n) for name, n in (limits or {}).items() if n and n > 0
+        }
+        self.busy: dict[str, float] = defaultdict(float)
+        self.waited: dict[str, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        semaphore = self._semaphores.get(name)
+        start = time.perf_counter()
+        if semaphore:
+            semaphore.acquire()
+        entered = time.perf_counter()
+        try:
+            yield
+        finally:
+            if semaphore:
+                semaphore.release()
+            with self._lock:
+                self.waited[name] += entered - start
+                self.busy[name] += time.perf_counter() - entered
+
+
+# For callers outside the runner: no limits, timings nobody reads
+NO_LIMITS = StageLimits()
+
+
+class _Stage(NamedTuple):
+    name: str
+    fn: Callable[[dict], object]
+    deps: tuple[str, ...]
+    kind: str
+    undo: Callable[[object], None] | None
+
+
+class StageGraph:
+    """
+    Runs named stages as soon as the stages they depend on have finished, so
+    independent ones overlap. Each stage function gets the results so far (keyed
+    by stage name) and runs inside limits.stage(kind).
+
+    If a stage fails, stages not started yet are skipped, running ones are waited
+    for, the 'undo' of every finished stage is called (last finished first) and
+    the first error is raised. timings holds each stage's duration in seconds.
+    """
+
+    def __init__(self, limits: StageLimits = NO_LIMITS):
+        self.limits = limits
+        self.results: dict[str, object] = {}
+        self.timings: dict[str, float] = {}
+        self._stages: dict[str, _Stage] = {}
+
+    def add(
+            self,
+            name: str,
+            fn: Callable[[dict], object],
+            deps: Iterable[str] = (),
+            kind: str | None = None,
+            undo: Callable[[object], None] | None = None
+    ):
+        deps = tuple(deps)
+        # Dependencies must be added first, which also rules out cycles
+        unknown = [d for d in deps if d not in self._stages]
+        if unknown or name in self._stages:
+            raise ValueError(f"Stage '{name}': unknown dependencies {unknown} or duplicate name.")
+        self._stages[name] = _Stage(name, fn, deps, kind or name, undo)
+
+    def _run_stage(self, stage: _Stage):
+        start = time.perf_counter()
+        try:
+            with self.limits.stage(stage.kind):
+                return stage.fn(self.results)
+        finally:
+            self.timings[stage.name] = time.perf_counter() - start
+
+    def run(self) -> dict[str, object]:
+        remaining = dict(self._stages)
+        finished = []
+        error = None
+        with ThreadPoolExecutor(max_workers=max(1, len(remaining))) as pool:
+            running = {}
+            while True:
+                if error is None:
+                    for name, stage in list(remaining.items()):
+                        if all(d in self.results for d in stage.deps):
+                            running[pool.submit(self._run_stage, stage)] = name
+                            del remaining[name]
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        self.results[name] = future.result()
+                        finished.append(name)
+                    except Exception as e:
+                        error = error or e
+
+        if error is not None:
+            for name in reversed(finished):
+                undo = self._stages[name].undo
+                if undo is not None:
+                    try:
+                        undo(self.results[name])
+                    except Exception as e:
+                        print(f"Warning: Could not undo stage '{name}'. Error: {e}")
+            raise error
+        return self.results
+
+
+class Job(NamedTuple):
+    kind: str
+    params: dict
+    line_no: int
+
+    def describe(self) -> str:
+        source = self.params.get("image") or self.params.get("media") or ""
+        return f"{self.kind} {Path(source).name}" if source else self.kind
+
+
+class JobResult(NamedTuple):
+    job: Job
+    output: str | None
+    error: str | None
+    elapsed: float
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def read_jobs(manifest_path: Path, required: dict[str, tuple[str, ...]]) -> list[Job]:
+    """
+    Reads jobs from a .csv (with a header row) or a .jsonl file. Each entry has a
+    'type' (a key of 'required') and the fields that type needs; empty CSV cells
+    are dropped. Raises ValueError on the first invalid entry.
+    """
+    manifest_path = Path(manifest_path)
+    base_dir = manifest_path.resolve().parent
+
+    if manifest_path.suffix.lower() == ".csv":
+        with open(manifest_path, newline="", encoding="utf-8") as f:
+            rows = [{k: v.strip() for k, v in row.items() if k and v and v.strip()} for row in csv.DictReader(f)]
+    else:
+        with open(manifest_path, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+
+    jobs = []
+    for line_no, row in enumerate(rows, start=1):
+        params = dict(row)
+        kind = str(params.pop("type", "")).strip()
+        if kind not in required:
+            raise ValueError(f"{manifest_path}: entry {line_no} has an unknown type '{kind}' "
+                             f"(use one of: {', '.join(required)}).")
+        missing = [name for name in required[kind] if not params.get(name)]
+        if missing:
+            raise ValueError(f"{manifest_path}: entry {line_no} ({kind}) needs {', '.join(missing)}.")
+        for name in PATH_FIELDS:
+            if params.get(name):
+                path = Path(params[name]).expanduser()
+                params[name] = path if path.is_absolute() else (base_dir / path).resolve()
+        jobs.append(Job(kind, params, line_no))
+    return jobs
+
+
+def run_job(
+        job: Job,
+        handlers: dict[str, Callable[[dict, StageLimits], object]],
+        limits: StageLimits = NO_LIMITS
+) -> JobResult:
+    """Runs one job through handlers[job.kind](params, limits); failures are returned, never raised."""
+    start = time.perf_counter()
+    try:
+        output = handlers[job.kind](job.params, limits)
+        return JobResult(job, str(output) if output is not None else None, None, time.perf_counter() - start)
+    except Exception as e:
+        return JobResult(job, None, f"{type(e).__name__}: {e}", time.perf_counter() - start)
+
+
+def run_jobs(
+        jobs: Iterable[Job],
+        handlers: dict[str, Callable[[dict, StageLimits], object]],
+        workers: int = 4,
+        limits: StageLimits = NO_LIMITS,
+        max_pending: int | None = None
+) -> Iterator[JobResult]:
+    """
+    Runs every job through handlers[job.kind](params, limits) on a thread pool and
+    yields results as they finish. The threads share one process, so setup done
+    by the handlers (media store, compiler worker, templates) is shared too;
+    per-stage concurrency is bounded by 'limits'. Failures are yielded, never raised.
+    """
+    max_pending = max_pending or workers * 2
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        queue = iter(jobs)
+
+        def submit_next() -> bool:
+            job = next(queue, None)
+            if job is None:
+                return False
+            pending[pool.submit(run_job, job, handlers, limits)] = job
+            return True
+
+        while len(pending) < max_pending and submit_next():
+            pass
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                del pending[future]
+                yield future.result()
+                submit_next()
+
+
+class JobJournal:
+    """
+    Append-only JSON-lines record of job progress: one line per state change
+    ('started', 'done' or 'failed'). 'done' lines are synced to disk before
+    record() returns, so a crash loses at most the jobs that were running. On open, the
+    file is compacted to the 'done' entries; a line cut short by a crash is ignored.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._done: dict[str, dict] = {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry.get("state") == "done":
+                        self._done[entry["key"]] = entry
+                    else:
+                        self._done.pop(entry.get("key"), None)
+        except FileNotFoundError:
+            pass
+        self._compact()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _compact(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in self._done.values():
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def is_done(self, key: str) -> bool:
+        return key in self._done
+
+    def record(self, key: str, state: str, **fields):
+        entry = {"key": key, "state": state, "ts": round(time.time(), 3), **fields}
+        line = json.dumps(entry, default=str) + "\n"
+        with self._lock:
+            # After close() (e.g. a second Ctrl+C while jobs were finishing): they simply run again next time
+            if self._file.closed:
+                return
+            self._file.write(line)
+            self._file.flush()
+            if state == "done":
+                os.fsync(self._file.fileno())
+                self._done[key] = entry
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,175 @@
+import json
+import os
+import shutil
+import struct
+import threading
+from pathlib import Path
+
+from .asset_catalog import AssetCatalog
+from .mp4_faststart import needs_faststart, write_faststart
+from .shortid import code_from_digest, copy_and_hash, random_code, sha256_file
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+FICLONE = 0x40049409  # Linux ioctl: share the source extents (btrfs, xfs, ...)
+
+
+def _reflink(src: Path, dest: Path) -> bool:
+    if fcntl is None:
+        return False
+    try:
+        with open(src, "rb") as s, open(dest, "xb") as d:
+            try:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+                return True
+            except OSError:
+                pass
+        dest.unlink()
+    except OSError:
+        pass
+    return False
+
+
+def clone_or_copy(src: Path, dest: Path) -> bool:
+    """
+    Puts a copy of 'src' at the new path 'dest': a reflink when the filesystem
+    can (no data written), else a plain copy. Never a hardlink, so 'dest' is its
+    own inode. Returns True if cloned.
+    """
+    if _reflink(src, dest):
+        return True
+    shutil.copyfile(src, dest)
+    return False
+
+
+class MediaStore:
+    """
+    Content-addressed file store: every distinct content is kept once under 'root',
+    named after its SHA-256. A persistent index maps digests to stored names, and
+    source files to their last known (size, mtime, inode) and digest, so a file
+    that was already ingested is neither hashed nor copied again.
+
+    Entries are reflinked (copy-on-write) where the filesystem allows, else
+    copied, but never hardlinked: the user keeps their source file, and editing
+    it must not change bytes served under a name that is their hash.
+
+    With 'faststart', MP4/QuickTime videos whose moov box sits after the media data
+    are stored rewritten with moov first, so phones can start playing before the
+    whole file arrives. Those entries are always copies, never links. A video the
+    rewrite cannot handle (truncated, unusual layout) is stored as it is.
+
+    New entries are recorded in 'catalog' when one is given.
+    """
+
+    def __init__(
+            self,
+            root: Path,
+            index_path: Path,
+            code_len: int = 9,
+            faststart: bool = True,
+            catalog: AssetCatalog | None = None
+    ):
+        self.root = Path(root)
+        self.index_path = Path(index_path)
+        self.code_len = code_len
+        self.faststart = faststart
+        self.catalog = catalog
+        self._lock = threading.Lock()
+        self._objects: dict[str, str] = {}
+        self._names: set[str] = set()
+        self._sources: dict[str, list] = {}
+        self._load()
+
+    def _load(self):
+        try:
+            data = json.loads(self.index_path.read_text(encoding="utf-8"))
+            self._objects = data.get("objects", {})
+            self._names = set(self._objects.values())
+            self._sources = data.get("sources", {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"Warning: Could not read the media index, starting a new one. Error: {e}")
+
+    def _save(self):
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.index_path.with_name(self.index_path.name + ".tmp")
+        tmp_path.write_text(json.dumps({"objects": self._objects, "sources": self._sources}), encoding="utf-8")
+        os.replace(tmp_path, self.index_path)
+
+    def _stored_path(self, digest: str) -> Path | None:
+        name = self._objects.get(digest)
+        if name and (self.root / name).is_file():
+            return self.root / name
+        return None
+
+    def _new_name(self, digest: str, suffix: str) -> str:
+        length = self.code_len
+        taken = self._names
+        # Widen the code in the (unlikely) case of a prefix collision or a stray file
+        while True:
+            name = f"{code_from_digest(digest, length)}{suffix}"
+            if name not in taken and not (self.root / name).exists():
+                return name
+            length += 1
+
+    def is_object(self, name: str) -> bool:
+        """True if 'name' (a file name under 'root') is a stored, content-named object."""
+        return name in self._names
+
+    def lookup(self, source: Path) -> Path | None:
+        """Returns the stored copy of 'source' if it is known and unchanged, without reading it."""
+        src = Path(source).resolve()
+        st = os.stat(src)
+        with self._lock:
+            cached = self._sources.get(str(src))
+            if cached and cached[:3] == [st.st_size, st.st_mtime_ns, st.st_ino]:
+                return self._stored_path(cached[3])
+        return None
+
+    def store(self, source: Path) -> Path:
+        src = Path(source).resolve()
+        stored = self.lookup(src)
+        if stored:
+            return stored
+
+        st = os.stat(src)
+        self.root.mkdir(parents=True, exist_ok=True)
+        temp = self.root / f".ingest-{random_code(12)}.part"
+
+        # The data is read exactly once: either only to hash the clone (which shares
+        # the source's extents, and is what gets stored even if the source changes
+        # meanwhile), or to hash and copy (or fast-start rewrite) the source at the
+        # same time. Only a rewrite that fails part way reads it again.
+        try:
+            digest = None
+            if self.faststart and needs_faststart(src):
+                try:
+                    digest = write_faststart(src, temp)
+                except (ValueError, struct.error) as e:
+                    print(f"Warning: Could not move the index of {src.name} to the front, storing it as is. "
+                          f"Error: {e}")
+            if digest is None:
+                digest = sha256_file(temp) if _reflink(src, temp) else copy_and_hash(src, temp)
+        except BaseException:
+            temp.unlink(missing_ok=True)
+            raise
+
+        with self._lock:
+            stored = self._stored_path(digest)
+            new = stored is None
+            if stored:
+                temp.unlink()
+            else:
+                stored = self.root / self._new_name(digest, src.suffix.lower())
+                os.replace(temp, stored)
+                self._objects[digest] = stored.name
+                self._names.add(stored.name)
+            self._sources[str(src)] = [st.st_size, st.st_mtime_ns, st.st_ino, digest]
+            self._save()
+        if new and self.catalog is not None:
+            self.catalog.record(stored, "media", sha256=digest)
+        return stored
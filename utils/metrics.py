@@ -0,0 +1,212 @@
+import functools
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+
+# SMARTQR_METRICS=0 turns instrumentation off: decorated functions are left
+# unwrapped at import time, and timer() hands out a shared no-op context.
+ENABLED = os.environ.get("SMARTQR_METRICS", "1") != "0"
+# SMARTQR_TRACE=<file> appends one JSON line per timed operation
+TRACE_PATH = os.environ.get("SMARTQR_TRACE") or None
+
+# Seconds: from cached HTTP hits (well under 1 ms) to .mind compiles (minutes)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+_NOOP = nullcontext()
+
+# Served by both local server modes
+METRICS_PATH = "/metrics"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = [*key, *extra]
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in values]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (+Inf last), sum]
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = bound if bound == "+Inf" else f"{bound:g}"
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, Counter | Histogram] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name: str, help_text: str):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text)
+            return metric
+
+    def counter(self, name: str, help_text: str = "") -> Counter:
+        return self._get(Counter, name, help_text)
+
+    def histogram(self, name: str, help_text: str = "") -> Histogram:
+        return self._get(Histogram, name, help_text)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        lines = []
+        for _, metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.histogram("smartqr_stage_seconds", "Time spent in each processing stage.")
+stage_errors = registry.counter("smartqr_stage_errors_total", "Processing stages that raised an exception.")
+stage_bytes = registry.counter("smartqr_stage_bytes_total", "Bytes read or written by processing stages.")
+http_seconds = registry.histogram("smartqr_http_request_seconds", "Local server request latency.")
+http_bytes = registry.counter("smartqr_http_response_bytes_total", "Response body bytes sent by the local server.")
+render_lookups = registry.counter("smartqr_render_lookups_total",
+                                  "On-demand watermark variants served, by outcome (memory, disk, render, coalesced).")
+
+
+class _Tracer:
+    def __init__(self, path: str):
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+        self._lock = threading.Lock()
+
+    def write(self, record: dict):
+        line = json.dumps(record, separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+
+
+_tracer = _Tracer(TRACE_PATH) if ENABLED and TRACE_PATH else None
+
+
+def set_enabled(enabled: bool):
+    """Turns recording on or off at runtime (functions decorated while off stay unwrapped)."""
+    global ENABLED
+    ENABLED = enabled
+
+
+def _record(stage: str, seconds: float, failed: bool, labels: dict):
+    stage_seconds.observe(seconds, stage=stage, **labels)
+    if failed:
+        stage_errors.inc(stage=stage, **labels)
+    if _tracer is not None:
+        _tracer.write({"ts": time.time(), "stage": stage, "seconds": round(seconds, 6),
+                       "ok": not failed, **labels})
+
+
+@contextmanager
+def _timer(stage: str, labels: dict):
+    start = time.perf_counter()
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        _record(stage, time.perf_counter() - start, failed, labels)
+
+
+def timer(stage: str, **labels):
+    """Context manager timing one stage into smartqr_stage_seconds{stage=...}."""
+    return _timer(stage, labels) if ENABLED else _NOOP
+
+
+def timed(stage: str, **labels):
+    """Decorator form of timer()."""
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            with _timer(stage, labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def add_bytes(stage: str, n: int):
+    if ENABLED:
+        stage_bytes.inc(n, stage=stage)
+
+
+def record_request(method: str, status: int, seconds: float, body_bytes: int):
+    if not ENABLED:
+        return
+    http_seconds.observe(seconds, method=method, status=str(status))
+    http_bytes.inc(body_bytes, status=str(status))
+    if _tracer is not None:
+        _tracer.write({"ts": time.time(), "stage": "http", "method": method, "status": status,
+                       "seconds": round(seconds, 6), "bytes": body_bytes})
+
+
+def render_prometheus() -> str:
+    return registry.render()
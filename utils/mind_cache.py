@@ -0,0 +1,87 @@
+import hashlib
+import os
+import threading
+from pathlib import Path
+
+from .media_store import clone_or_copy
+
+
+class MindCache:
+    """
+    On-disk cache of compiled .mind files, keyed by the content of the (preprocessed)
+    target images and the compiler version. Hits are cloned into place (a reflink
+    where the filesystem supports it, else a copy), so serving one costs a hash of
+    the small preprocessed image and a clone of a file of a few MB.
+
+    Entries never share an inode with a published file: the mtime refreshed on
+    every hit (the cache is bounded by 'max_bytes', least recently used entries
+    evicted first) must not change the ETag of what the server sends.
+    """
+
+    SUFFIX = ".mind"
+
+    def __init__(self, root: Path, max_bytes: int = 512 * 1024 * 1024):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def key(self, image_paths: list[Path], compiler_version: str) -> str:
+        sha = hashlib.sha256(compiler_version.encode("utf-8"))
+        for path in image_paths:
+            sha.update(b"\0")
+            with open(path, "rb") as f:
+                while True:
+                    buf = f.read(1 << 20)
+                    if not buf: break
+                    sha.update(buf)
+        return sha.hexdigest()
+
+    def _entry(self, key: str) -> Path:
+        return self.root / f"{key}{self.SUFFIX}"
+
+    def get(self, key: str, dest: Path) -> Path | None:
+        """Places the cached output for 'key' at 'dest' (which must not exist yet)."""
+        entry = self._entry(key)
+        with self._lock:
+            try:
+                os.utime(entry)
+            except FileNotFoundError:
+                self.misses += 1
+                return None
+            self.hits += 1
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        clone_or_copy(entry, dest)
+        return dest
+
+    def put(self, key: str, compiled: Path):
+        self.root.mkdir(parents=True, exist_ok=True)
+        entry = self._entry(key)
+        temp = entry.with_name(f"{entry.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            clone_or_copy(compiled, temp)
+            os.replace(temp, entry)
+            os.utime(entry)
+        except OSError as e:
+            temp.unlink(missing_ok=True)
+            print(f"Warning: Could not cache the .mind file. Error: {e}")
+            return
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for path in self.root.glob(f"*{self.SUFFIX}"):
+                try:
+                    st = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime_ns, st.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
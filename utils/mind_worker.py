@@ -0,0 +1,258 @@
+import itertools
+import json
+import subprocess
+import threading
+from collections import deque
+from concurrent.futures import Future, InvalidStateError, TimeoutError as FutureTimeoutError
+from pathlib import Path
+from typing import Callable
+
+# No single compilation takes this long: a caller waiting longer would only hang
+COMPILE_TIMEOUT = 600.0
+
+
+class MindCompilerError(RuntimeError):
+    pass
+
+
+def wait_for(future: Future, timeout: float | None = COMPILE_TIMEOUT) -> Path:
+    """
+    The result of a future from MindCompilerWorker.submit(), or MindCompilerError
+    after 'timeout' seconds. A job that timed out is cancelled: the caller may
+    delete its inputs, and the worker must not compile them later.
+    """
+    try:
+        return future.result(timeout)
+    except FutureTimeoutError:
+        future.cancel()
+        raise MindCompilerError(f"The compilation did not finish within {timeout:.0f}s.") from None
+
+
+def _resolve(future: Future, result=None, error: BaseException | None = None):
+    # The job may have been cancelled in the meantime: its outcome is dropped
+    try:
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+    except InvalidStateError:
+        pass
+
+
+class _Job:
+    def __init__(self, job_id: str, inputs: list[str], output: str, on_progress: Callable[[float], None] | None):
+        self.id = job_id
+        self.inputs = inputs
+        self.output = output
+        self.on_progress = on_progress
+        self.future: Future = Future()
+        self.attempts = 0
+        self.proc = None
+
+    def request_line(self) -> str:
+        return json.dumps({"id": self.id, "inputs": self.inputs, "output": self.output}) + "\n"
+
+
+class MindCompilerWorker:
+    """
+    Keeps one `node compile-worker.mjs` process alive and feeds it compilation jobs
+    over stdin/stdout (one JSON object per line), so Node startup, the mind-ar and
+    canvas imports and the TensorFlow backend setup are paid once, not per target.
+
+    Jobs are queued by the worker and run one at a time. If the process dies, it is
+    started again and the jobs it had not finished are resent (up to MAX_ATTEMPTS).
+    Cancelling a job's future takes it out of the worker's queue, or keeps its
+    output from being written if it is already compiling.
+    """
+
+    MAX_ATTEMPTS = 2
+
+    def __init__(self, tool_dir: Path, script: str = "compile-worker.mjs", node: str = "node"):
+        self.tool_dir = Path(tool_dir)
+        self.command = [node, str(self.tool_dir / script)]
+        self._spawns = 0
+        self._lock = threading.Lock()
+        self._proc: subprocess.Popen | None = None
+        self._ready = threading.Event()
+        self._pending: dict[str, _Job] = {}
+        self._ids = itertools.count(1)
+        self._stderr_tail: deque[str] = deque(maxlen=40)
+        self._closed = False
+
+    # --- Process management (callers hold self._lock) ---
+
+    def _spawn(self):
+        proc = subprocess.Popen(
+            self.command,
+            cwd=str(self.tool_dir),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            bufsize=1,
+        )
+        ready = threading.Event()
+        threading.Thread(target=self._read_stdout, args=(proc, ready), daemon=True).start()
+        threading.Thread(target=self._read_stderr, args=(proc,), daemon=True).start()
+        self._proc, self._ready = proc, ready
+        self._spawns += 1
+
+    def _ensure_running(self):
+        if self._proc is None or self._proc.poll() is not None:
+            self._spawn()
+
+    def _send(self, job: _Job):
+        self._ensure_running()
+        job.attempts += 1
+        job.proc = self._proc
+        try:
+            self._proc.stdin.write(job.request_line())
+            self._proc.stdin.flush()
+        except (BrokenPipeError, OSError):
+            # The process is going away; its exit handler resends or fails the job
+            pass
+
+    # --- Reader threads ---
+
+    def _read_stderr(self, proc: subprocess.Popen):
+        for line in proc.stderr:
+            line = line.rstrip()
+            if line:
+                self._stderr_tail.append(line)
+
+    def _read_stdout(self, proc: subprocess.Popen, ready: threading.Event):
+        for line in proc.stdout:
+            try:
+                msg = json.loads(line)
+            except ValueError:
+                self._stderr_tail.append(line.rstrip())
+                continue
+
+            kind = msg.get("type")
+            if kind == "ready":
+                ready.set()
+                continue
+
+            with self._lock:
+                job = self._pending.get(msg.get("id"))
+                if job and kind in ("done", "error"):
+                    del self._pending[job.id]
+            if not job:
+                continue
+
+            if kind == "progress" and job.on_progress:
+                try:
+                    job.on_progress(float(msg.get("progress", 0.0)))
+                except Exception:
+                    pass
+            elif kind == "done":
+                _resolve(job.future, Path(msg["output"]))
+            elif kind == "error":
+                _resolve(job.future, error=MindCompilerError(msg.get("error") or "Unknown compiler error."))
+
+        proc.wait()
+        self._on_exit(proc)
+
+    def _on_exit(self, proc: subprocess.Popen):
+        details = "\n".join(self._stderr_tail)
+        error = f"The compiler worker exited with code {proc.returncode}.\n{details}".strip()
+        failed = []
+        with self._lock:
+            if self._proc is proc:
+                self._proc = None
+            retry = []
+            for job in [j for j in self._pending.values() if j.proc is proc]:
+                if self._closed or job.attempts >= self.MAX_ATTEMPTS:
+                    failed.append(job)
+                else:
+                    retry.append(job)
+            try:
+                for job in retry:
+                    self._send(job)
+            except Exception as e:
+                # Runs on the dead process's reader thread: nobody else would resolve these
+                error = f"{error}\nCould not restart it: {type(e).__name__}: {e}"
+                failed += [job for job in retry if job.proc is proc]
+            for job in failed:
+                del self._pending[job.id]
+
+        for job in failed:
+            _resolve(job.future, error=MindCompilerError(error))
+
+    def _on_done(self, job: _Job):
+        if not job.future.cancelled():
+            return
+        with self._lock:
+            if self._pending.pop(job.id, None) is None:
+                return
+            proc = job.proc
+            if proc is None or proc is not self._proc or proc.poll() is not None:
+                return
+            try:
+                proc.stdin.write(json.dumps({"cancel": job.id}) + "\n")
+                proc.stdin.flush()
+            except (BrokenPipeError, OSError):
+                pass
+
+    # --- Public API ---
+
+    @property
+    def restarts(self) -> int:
+        return max(0, self._spawns - 1)
+
+    def start(self, timeout: float | None = 120.0) -> bool:
+        """Starts the worker ahead of time and waits until the compiler is loaded."""
+        with self._lock:
+            self._ensure_running()
+            ready = self._ready
+        return ready.wait(timeout)
+
+    def submit(
+            self,
+            inputs: list[Path],
+            output: Path,
+            on_progress: Callable[[float], None] | None = None
+    ) -> Future:
+        """
+        Queues a compilation of 'inputs' into a single .mind file at 'output'.
+        The future resolves to the output path or raises MindCompilerError.
+        """
+        job = _Job(
+            str(next(self._ids)),
+            [str(Path(p).resolve()) for p in inputs],
+            str(Path(output).resolve()),
+            on_progress,
+        )
+        with self._lock:
+            if self._closed:
+                raise MindCompilerError("The compiler worker has been closed.")
+            self._pending[job.id] = job
+            try:
+                self._send(job)
+            except BaseException:
+                del self._pending[job.id]
+                raise
+        job.future.add_done_callback(lambda _: self._on_done(job))
+        return job.future
+
+    def compile(
+            self,
+            inputs: list[Path],
+            output: Path,
+            on_progress: Callable[[float], None] | None = None,
+            timeout: float | None = COMPILE_TIMEOUT
+    ) -> Path:
+        return wait_for(self.submit(inputs, output, on_progress), timeout)
+
+    def close(self, timeout: float = 10.0):
+        with self._lock:
+            self._closed = True
+            proc = self._proc
+        if proc is None:
+            return
+        try:
+            proc.stdin.close()
+            proc.wait(timeout)
+        except (OSError, subprocess.TimeoutExpired):
+            proc.kill()
@@ -0,0 +1,195 @@
+import hashlib
+import os
+import struct
+from pathlib import Path
+from typing import NamedTuple
+
+from . import metrics
+
+FASTSTART_SUFFIXES = {".mp4", ".m4v", ".mov"}
+# Boxes on the way from moov to the chunk offset tables
+CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+# moov holds the whole sample index; refuse anything absurd instead of loading it
+MAX_MOOV_BYTES = 256 * 1024 * 1024
+UINT32_MAX = 0xFFFFFFFF
+
+
+class Box(NamedTuple):
+    type: bytes
+    offset: int
+    size: int
+    header_size: int
+
+
+def iter_boxes(f, start: int, end: int):
+    """Yields the boxes between 'start' and 'end' of the open file 'f', reading only their headers."""
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(16)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack(">I4s", header[:8])
+        header_size = 8
+        if size == 1:
+            if len(header) < 16:
+                raise ValueError("Truncated MP4 box header")
+            size = struct.unpack(">Q", header[8:16])[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise ValueError(f"Invalid MP4 box '{box_type.decode('latin-1')}' at offset {offset}")
+        yield Box(box_type, offset, size, header_size)
+        offset += size
+
+
+def _top_level(path: Path) -> list[Box]:
+    with open(path, "rb") as f:
+        return list(iter_boxes(f, 0, os.fstat(f.fileno()).st_size))
+
+
+def needs_faststart(path: Path) -> bool:
+    """True for an MP4/QuickTime file whose moov box comes after its media data."""
+    if Path(path).suffix.lower() not in FASTSTART_SUFFIXES:
+        return False
+    try:
+        boxes = _top_level(path)
+    except (OSError, ValueError):
+        return False
+    types = [box.type for box in boxes]
+    if b"moov" not in types or b"mdat" not in types or b"moof" in types:
+        return False
+    return types.index(b"mdat") < types.index(b"moov")
+
+
+def _box_header(box_type: bytes, payload_size: int) -> bytes:
+    if payload_size + 8 <= UINT32_MAX:
+        return struct.pack(">I4s", payload_size + 8, box_type)
+    return struct.pack(">I4sQ", 1, box_type, payload_size + 16)
+
+
+def _rewrite_offsets(data: bytes, relocate, use_co64: bool) -> bytes:
+    """
+    Rebuilds the children of a container box, relocating every stco/co64 chunk
+    offset through relocate() (stco tables become co64 when use_co64 is set).
+    """
+    out = []
+    offset = 0
+    while offset + 8 <= len(data):
+        size, box_type = struct.unpack_from(">I4s", data, offset)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, offset + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = len(data) - offset
+        if size < header_size or offset + size > len(data):
+            raise ValueError(f"Invalid MP4 box '{box_type.decode('latin-1')}' inside moov")
+        payload = data[offset + header_size:offset + size]
+
+        if box_type in CONTAINERS:
+            payload = _rewrite_offsets(payload, relocate, use_co64)
+            out.append(_box_header(box_type, len(payload)) + payload)
+        elif box_type in (b"stco", b"co64"):
+            version_flags, count = struct.unpack_from(">II", payload, 0)
+            wide = box_type == b"co64"
+            offsets = struct.unpack_from(f">{count}{'Q' if wide else 'I'}", payload, 8)
+            offsets = [relocate(o) for o in offsets]
+            if wide or use_co64:
+                table, new_type = struct.pack(f">{count}Q", *offsets), b"co64"
+            else:
+                table, new_type = struct.pack(f">{count}I", *offsets), b"stco"
+            payload = struct.pack(">II", version_flags, count) + table
+            out.append(_box_header(new_type, len(payload)) + payload)
+        else:
+            out.append(data[offset:offset + size])
+        offset += size
+    return b"".join(out)
+
+
+def _relocated_moov(boxes: list[Box], moov_data: bytes):
+    """
+    Returns (new moov bytes, new box order). The moov goes right before the first
+    mdat; every other box keeps its relative order.
+    """
+    moov = next(box for box in boxes if box.type == b"moov")
+    rest = [box for box in boxes if box is not moov]
+    first_mdat = next(i for i, box in enumerate(rest) if box.type == b"mdat")
+    order = rest[:first_mdat] + [moov] + rest[first_mdat:]
+
+    use_co64 = False
+    while True:
+        # Layout with the moov at its new size; chunk offsets point into the
+        # moved boxes, so map each one through the box that contains it
+        payload_size = len(_rewrite_offsets(moov_data, lambda o: o, use_co64))
+        new_moov_size = len(_box_header(b"moov", payload_size)) + payload_size
+        new_starts = []
+        position = 0
+        for box in order:
+            new_starts.append((box.offset, box.offset + box.size, position))
+            position += new_moov_size if box is moov else box.size
+
+        def relocate(offset: int) -> int:
+            for start, end, new_start in new_starts:
+                if start <= offset < end:
+                    return offset - start + new_start
+            raise ValueError(f"Chunk offset {offset} is outside the file")
+
+        try:
+            payload = _rewrite_offsets(moov_data, relocate, use_co64)
+        except struct.error:
+            if use_co64:
+                raise
+            # Some offset no longer fits in 32 bits: switch to co64 (the moov grows) and lay out again
+            use_co64 = True
+            continue
+        return _box_header(b"moov", len(payload)) + payload, order
+
+
+@metrics.timed("faststart")
+def write_faststart(src: Path, dest: Path, chunk: int = 1 << 20) -> str:
+    """
+    Writes a copy of 'src' to the new file 'dest' with the moov box moved before the
+    media data and all chunk offsets fixed, in one streaming pass: only moov is held
+    in memory. Returns the SHA-256 hex digest of the written file.
+    """
+    boxes = _top_level(src)
+    moov = next(box for box in boxes if box.type == b"moov")
+    if moov.size > MAX_MOOV_BYTES:
+        raise ValueError(f"moov box too large ({moov.size} bytes)")
+
+    sha = hashlib.sha256()
+    buf = bytearray(chunk)
+    view = memoryview(buf)
+    with open(src, "rb", buffering=0) as fin, open(dest, "xb", buffering=0) as fout:
+        try:
+            fin.seek(moov.offset + moov.header_size)
+            moov_bytes, order = _relocated_moov(boxes, fin.read(moov.size - moov.header_size))
+
+            def write(data):
+                sha.update(data)
+                written = 0
+                while written < len(data):
+                    written += fout.write(data[written:])
+
+            for box in order:
+                if box is moov:
+                    write(moov_bytes)
+                    continue
+                fin.seek(box.offset)
+                remaining = box.size
+                while remaining:
+                    n = fin.readinto(view[:min(chunk, remaining)])
+                    if not n:
+                        raise ValueError("MP4 file ended early")
+                    write(view[:n])
+                    remaining -= n
+        except BaseException:
+            fout.close()
+            os.unlink(dest)
+            raise
+    st = os.stat(src)
+    os.utime(dest, ns=(st.st_atime_ns, st.st_mtime_ns))
+    metrics.add_bytes("faststart", st.st_size)
+    return sha.hexdigest()
@@ -1,27 +1,156 @@
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
 from PIL import Image
 import qrcode
 from qrcode.constants import ERROR_CORRECT_M
 
+from .asset_catalog import get_catalog
 from .utils import ensure_unique_filename, SAVED_DIR
 
-def generate_qr_image(
+QR_MATRIX_CACHE_SIZE = 512
+# Masks are full-size renders (side_px ** 2 bytes each), so their cache is bounded
+# by bytes: at most this much per process (each batch worker has its own)
+QR_MASK_CACHE_BYTES = 64 * 1024 * 1024
+
+
+class QRMatrix(NamedTuple):
+    version: int
+    modules: np.ndarray  # read-only 2D bool array, True for dark modules (border included)
+
+@lru_cache(maxsize=QR_MATRIX_CACHE_SIZE)
+def get_qr_matrix(
         content: str,
-        border: int = 2,
-        error_correction=ERROR_CORRECT_M
-) -> Image.Image:
+        error_correction=ERROR_CORRECT_M,
+        border: int = 2
+) -> QRMatrix:
+    """
+    Encodes 'content' once per (content, error correction, border) and keeps the module matrix.
+    """
     qr = qrcode.QRCode(
         version=None,
         error_correction=error_correction,
-        box_size=10,
+        box_size=1,
         border=border,
     )
     qr.add_data(content)
     qr.make(fit=True)
-    return qr.make_image(fill_color="black", back_color="white").convert("RGB")
+    modules = np.array(qr.get_matrix(), dtype=bool)
+    modules.flags.writeable = False
+    return QRMatrix(qr.version, modules)
+
+def qr_version(content: str, error_correction=ERROR_CORRECT_M) -> int:
+    """
+    The QR version (1-40) 'content' is encoded at; the symbol is 17 + 4 * version
+    modules wide. Shares the matrix cache with the watermark (which uses border=0).
+    """
+    return get_qr_matrix(content, error_correction, 0).version
+
+class _MaskCache:
+    """Least recently used masks, up to 'max_bytes' of pixels in total."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple, Image.Image] = OrderedDict()
+
+    def get(self, key: tuple) -> Image.Image | None:
+        with self._lock:
+            mask = self._entries.get(key)
+            if mask is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return mask
+
+    def put(self, key: tuple, mask: Image.Image):
+        size = mask.width * mask.height
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = mask
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted.width * evicted.height
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = self.hits = self.misses = 0
+
+
+_mask_cache = _MaskCache(QR_MASK_CACHE_BYTES)
+
+def get_qr_mask(
+        content: str,
+        side_px: int,
+        opacity: float = 1.0,
+        error_correction=ERROR_CORRECT_M,
+        border: int = 2
+) -> Image.Image:
+    """
+    Returns an 'L' mask of side_px x side_px where dark modules are 255 * opacity and light
+    modules are 0, sampled straight from the module matrix (same layout as a NEAREST
+    resize of the 10px-per-module render). The cached image is shared: do not modify it.
+    """
+    key = (content, side_px, opacity, error_correction, border)
+    mask = _mask_cache.get(key)
+    if mask is None:
+        mask = _render_qr_mask(content, side_px, opacity, error_correction, border)
+        _mask_cache.put(key, mask)
+    return mask
+
+def _render_qr_mask(content: str, side_px: int, opacity: float, error_correction, border: int) -> Image.Image:
+    modules = get_qr_matrix(content, error_correction, border).modules
+    n = modules.shape[0]
+    # Center of each target pixel, mapped back to the module grid
+    idx = ((np.arange(side_px) + 0.5) * n / side_px).astype(np.intp)
+    idx = np.minimum(idx, n - 1)
+
+    alpha = int(255 * max(0.0, min(1.0, opacity)))
+    mask = np.where(modules[np.ix_(idx, idx)], alpha, 0).astype(np.uint8)
+    return Image.fromarray(mask, "L")
+
+def qr_cache_info() -> dict[str, dict[str, int]]:
+    info = get_qr_matrix.cache_info()
+    return {
+        "matrix": {"hits": info.hits, "misses": info.misses, "size": info.currsize, "maxsize": info.maxsize},
+        "mask": {"hits": _mask_cache.hits, "misses": _mask_cache.misses, "size": len(_mask_cache),
+                 "bytes": _mask_cache.bytes, "max_bytes": _mask_cache.max_bytes},
+    }
+
+def clear_qr_cache():
+    get_qr_matrix.cache_clear()
+    _mask_cache.clear()
+
+def generate_qr_image(
+        content: str,
+        border: int = 2,
+        error_correction=ERROR_CORRECT_M,
+        box_size: int = 10
+) -> Image.Image:
+    modules = get_qr_matrix(content, error_correction, border).modules
+    pixels = np.where(modules, 0, 255).astype(np.uint8)
+    pixels = np.repeat(np.repeat(pixels, box_size, axis=0), box_size, axis=1)
+    return Image.fromarray(pixels, "L").convert("RGB")
 
 def save_qr_code(content: str, filename: str) -> Path:
     img = generate_qr_image(content)
     output_path = ensure_unique_filename(SAVED_DIR / filename)
     img.save(output_path)
-    return output_path
\ No newline at end of file
+    get_catalog().record(output_path, "image")
+    return output_path
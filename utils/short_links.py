@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import threading
+import urllib.parse
+from contextlib import contextmanager
+from pathlib import Path
+
+from .shortid import QR_ALPHABET, _int_to_base62, random_code
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+SHORT_CODE_LENGTH = 3
+MAX_DERIVED_LENGTH = 8
+
+
+class ShortLinkTable:
+    """
+    Persistent table of short codes ('7QX') redirecting to paths served by the
+    local server ('/media/aB3fK9qP2.mp4'), so a QR code can carry '<base>/7QX'
+    instead of the full URL. Codes only use digits and capitals, like the rest
+    of a URL passed through short_url(), so the whole payload fits the QR
+    alphanumeric mode.
+
+    A target always gets the same code: it is derived from the target's SHA-256
+    (widened on a collision), with random codes as the last resort.
+
+    Several processes may share the index (the menu's server, a 'memory' call,
+    'watch', the resident service): changes are made under a lock on
+    '<index>.lock' against a fresh read of the file, and a code that is not
+    known here is looked up again in the file if it changed.
+    """
+
+    def __init__(self, index_path: Path, code_len: int = SHORT_CODE_LENGTH, reserved: set[str] | None = None):
+        self.index_path = Path(index_path)
+        self.code_len = code_len
+        # Names that must keep resolving to files (e.g. the entries of public/)
+        self.reserved = {name.upper() for name in (reserved or ())}
+        self._lock = threading.Lock()
+        self._targets: dict[str, str] = {}
+        self._codes: dict[str, str] = {}
+        # (size, mtime) of the index when it was last read
+        self._loaded_stat: tuple[int, int] | None = None
+        self._load()
+
+    def _index_stat(self) -> tuple[int, int] | None:
+        try:
+            st = os.stat(self.index_path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def _load(self):
+        stat = self._index_stat()
+        if stat is None or stat == self._loaded_stat:
+            return
+        try:
+            targets = json.loads(self.index_path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Warning: Could not read the short link table, starting a new one. Error: {e}")
+            return
+        # Swapped whole, so resolve() never sees a half-built table
+        self._codes = {target: code for code, target in targets.items()}
+        self._targets = targets
+        self._loaded_stat = stat
+
+    @contextmanager
+    def _locked_index(self):
+        """Holds this table's lock and the index's file lock, with the index freshly read."""
+        with self._lock:
+            if fcntl is None:
+                self._load()
+                yield
+                return
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.index_path.with_name(self.index_path.name + ".lock"), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self._load()
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save(self):
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.index_path.with_name(self.index_path.name + ".tmp")
+        tmp_path.write_text(json.dumps(self._targets), encoding="utf-8")
+        os.replace(tmp_path, self.index_path)
+        self._loaded_stat = self._index_stat()
+
+    def _free(self, code: str) -> bool:
+        return code not in self._targets and code not in self.reserved
+
+    def _new_code(self, target: str) -> str:
+        digest = _int_to_base62(int(hashlib.sha256(target.encode("utf-8")).hexdigest(), 16), QR_ALPHABET)
+        for length in range(self.code_len, MAX_DERIVED_LENGTH + 1):
+            if self._free(digest[:length]):
+                return digest[:length]
+        while True:
+            code = random_code(MAX_DERIVED_LENGTH, QR_ALPHABET)
+            if self._free(code):
+                return code
+
+    def shorten(self, target: str) -> str:
+        """Returns the code redirecting to 'target' (an absolute path on the server), creating it if needed."""
+        if not target.startswith("/"):
+            raise ValueError(f"Short links point to server paths, got '{target}'.")
+        code = self._codes.get(target)
+        if code is not None:
+            return code
+        with self._locked_index():
+            code = self._codes.get(target)
+            if code is None:
+                code = self._new_code(target)
+                self._targets[code] = target
+                self._codes[target] = code
+                self._save()
+            return code
+
+    def resolve(self, code: str) -> str | None:
+        """
+        The target of 'code', or None. A hit is one dict lookup; a miss re-reads
+        the index if another process changed it. Safe to call from any thread.
+        """
+        target = self._targets.get(code)
+        if target is None and self._index_stat() != self._loaded_stat:
+            with self._lock:
+                self._load()
+            target = self._targets.get(code)
+        return target
+
+    def targets(self) -> list[str]:
+        """Every path a short code redirects to."""
+        return list(self._codes)
+
+    def remove_target(self, target: str) -> bool:
+        with self._locked_index():
+            code = self._codes.pop(target, None)
+            if code is None:
+                return False
+            del self._targets[code]
+            self._save()
+            return True
+
+
+def short_code_from_path(url_path: str) -> str | None:
+    """The code in a request path like '/7QX' (or '/7qx'), or None for any other path."""
+    code = url_path[1:].upper()
+    if not code or len(code) > MAX_DERIVED_LENGTH or url_path.count("/") != 1:
+        return None
+    return code if all(ch in QR_ALPHABET for ch in code) else None
+
+
+def qr_friendly_url(base_url: str, code: str) -> str:
+    """
+    '<base_url>/<code>' with the scheme and host in capitals (both are case-insensitive),
+    so a base URL without a path makes the whole QR payload alphanumeric.
+    """
+    parts = urllib.parse.urlsplit(base_url.rstrip("/"))
+    return urllib.parse.urlunsplit((parts.scheme.upper(), parts.netloc.upper(), f"{parts.path}/{code}", "", ""))
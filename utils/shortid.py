@@ -1,9 +1,13 @@
 from __future__ import annotations
-import re, secrets, hashlib, unicodedata
+import os, re, secrets, hashlib, unicodedata
 from pathlib import Path
 from typing import Union
 
+from . import metrics
+
 ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+# Digits and capitals only: QR codes store these in alphanumeric mode (5.5 bits per char instead of 8)
+QR_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
 
 def _slugify(text: str, max_len: int = 32) -> str:
     # remove accents, lowercase, replace spaces with '-', remove anything not [a-z0-9-]
@@ -19,24 +23,63 @@ def random_code(length: int = 9, alphabet: str = ALPHABET) -> str:
     # each char chosen with entropy ~log2(62)=5.95 bits. 9 chars ~53.6 bits
     return "".join(secrets.choice(alphabet) for _ in range(length))
 
-def _int_to_base62(n: int) -> str:
-    if n == 0: return ALPHABET[0]
+def _int_to_base62(n: int, alphabet: str = ALPHABET) -> str:
+    if n == 0: return alphabet[0]
     chars = []
-    base = len(ALPHABET)
+    base = len(alphabet)
     while n:
         n, r = divmod(n, base)
-        chars.append(ALPHABET[r])
+        chars.append(alphabet[r])
     return "".join(reversed(chars))
 
-def hash_code_from_file(path: Path, length: int = 9, chunk: int = 1 << 20) -> str:
+@metrics.timed("hash")
+def sha256_file(path: Path, chunk: int = 1 << 20) -> str:
     sha = hashlib.sha256()
+    total = 0
     with open(path, "rb") as f:
         while True:
             buf = f.read(chunk)
             if not buf: break
             sha.update(buf)
-    n = int.from_bytes(sha.digest(), "big")
-    return _int_to_base62(n)[:length]
+            total += len(buf)
+    metrics.add_bytes("hash", total)
+    return sha.hexdigest()
+
+def hash_code_from_file(path: Path, length: int = 9, chunk: int = 1 << 20) -> str:
+    return code_from_digest(sha256_file(path, chunk), length)
+
+def code_from_digest(hexdigest: str, length: int = 9) -> str:
+    return _int_to_base62(int(hexdigest, 16))[:length]
+
+@metrics.timed("copy")
+def copy_and_hash(src: Path, dest: Path, chunk: int = 1 << 20) -> str:
+    """
+    Copies 'src' to a new file 'dest' and returns the SHA-256 hex digest of the data,
+    reading the source only once. Each chunk lands in one reused buffer that is fed
+    both to the hash and to the write, without intermediate bytes objects.
+    """
+    sha = hashlib.sha256()
+    buf = bytearray(chunk)
+    view = memoryview(buf)
+    with open(src, "rb", buffering=0) as fin, open(dest, "xb", buffering=0) as fout:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fin.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        try:
+            while True:
+                n = fin.readinto(buf)
+                if not n: break
+                sha.update(view[:n])
+                written = 0
+                while written < n:
+                    written += fout.write(view[written:n])
+        except BaseException:
+            fout.close()
+            os.unlink(dest)
+            raise
+    st = os.stat(src)
+    os.utime(dest, ns=(st.st_atime_ns, st.st_mtime_ns))
+    metrics.add_bytes("copy", st.st_size)
+    return sha.hexdigest()
 
 def build_safe_name(
         source: Union[str, Path],
@@ -1,12 +1,17 @@
 import sys
-import socket
+from functools import lru_cache
 from pathlib import Path
 
+# Created when the first output is written there, not on import
 SAVED_DIR = Path(__file__).resolve().parent.parent / "saved"
-SAVED_DIR.mkdir(exist_ok=True)
+
+# Indexes and caches kept between runs (never served by the local server)
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
 
 APP_NAME = "Photo Smart QR Code"
 
+CORNERS = ("top-left", "top-right", "bottom-left", "bottom-right")
+
 def prompt(message: str) -> str:
     try:
         return input(message)
@@ -14,17 +19,14 @@ def prompt(message: str) -> str:
         print("\nExiting...")
         sys.exit(0)
 
-def ensure_unique_filename(path: Path) -> Path:
-    if not path.exists():
-        return path
-
-    stem, suffix = path.stem, path.suffix
-    i = 1
-    while True:
-        new_path = path.with_name(f"{stem}({i}){suffix}")
-        if not new_path.exists():
-            return new_path
-        i += 1
+def ensure_unique_filename(path: Path, kind: str | None = None) -> Path:
+    """
+    'path', or 'stem(n).ext' if it is taken. The name is reserved in the asset
+    catalog, so jobs running at once (in any process) never get the same one.
+    """
+    from .asset_catalog import get_catalog
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return get_catalog().allocate(path, kind)
 
 def validate_file_exists(path_str: str) -> Path:
     p = Path(path_str).expanduser().resolve()
@@ -32,7 +34,10 @@ def validate_file_exists(path_str: str) -> Path:
         raise FileNotFoundError(f"File not found: {p}")
     return p
 
+@lru_cache(maxsize=1)
 def get_local_ip() -> str:
+    """The LAN address other devices reach this machine at (looked up once per process)."""
+    import socket
     try:
         with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
             s.connect(("8.8.8.8", 80))
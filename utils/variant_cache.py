@@ -0,0 +1,152 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable
+
+from . import metrics
+
+
+class VariantCache:
+    """
+    Two-tier cache of rendered files (e.g. watermarked previews): a size-bounded
+    in-memory LRU of bodies in front of an on-disk cache under 'root', bounded by
+    'max_disk_bytes' and evicted by mtime (refreshed on every hit) like MindCache.
+
+    Concurrent get() calls for the same missing key are coalesced: the first one
+    renders, the others wait for its result, so a burst of requests for one
+    variant costs one render.
+    """
+
+    def __init__(self, root: Path, max_memory_bytes: int = 64 * 1024 * 1024,
+                 max_disk_bytes: int = 1024 * 1024 * 1024):
+        self.root = Path(root)
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.renders = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_bytes = 0
+        self._inflight: dict[str, Future] = {}
+        # Bytes on disk, counted on the first write
+        self._disk_bytes: int | None = None
+
+    def _count(self, outcome: str):
+        if metrics.ENABLED:
+            metrics.render_lookups.inc(outcome=outcome)
+
+    def peek(self, key: str) -> bytes | None:
+        """The body of 'key' if it is in memory (never blocks on a render)."""
+        with self._lock:
+            body = self._memory.get(key)
+            if body is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+        if body is not None:
+            self._count("memory")
+        return body
+
+    def get(self, key: str, suffix: str, render: Callable[[Path], object]) -> bytes:
+        """
+        The body of 'key' (a file-name-safe string), from memory, from disk, or by
+        calling render(path) to write it to 'path' (a file ending in 'suffix').
+        """
+        with self._lock:
+            body = self._memory.get(key)
+            if body is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+            else:
+                future = self._inflight.get(key)
+                leader = future is None
+                if leader:
+                    future = self._inflight[key] = Future()
+                else:
+                    self.coalesced += 1
+        if body is not None:
+            self._count("memory")
+            return body
+        if not leader:
+            self._count("coalesced")
+            return future.result()
+
+        try:
+            body = self._load(key, suffix, render)
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            # Into memory before leaving the in-flight table, so no request misses both
+            self._remember(key, body)
+            del self._inflight[key]
+        future.set_result(body)
+        return body
+
+    def _remember(self, key: str, body: bytes):
+        if len(body) > self.max_memory_bytes // 4:
+            return
+        self._memory[key] = body
+        self._memory_bytes += len(body)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, old = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old)
+
+    def _load(self, key: str, suffix: str, render: Callable[[Path], object]) -> bytes:
+        entry = self.root / f"{key}{suffix}"
+        try:
+            body = entry.read_bytes()
+            os.utime(entry)
+            with self._lock:
+                self.disk_hits += 1
+            self._count("disk")
+            return body
+        except FileNotFoundError:
+            pass
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        temp = entry.with_name(f"{key}.{os.getpid()}.{threading.get_ident()}.tmp{suffix}")
+        try:
+            with metrics.timer("render"):
+                render(temp)
+            body = temp.read_bytes()
+            os.replace(temp, entry)
+        finally:
+            temp.unlink(missing_ok=True)
+        with self._lock:
+            self.renders += 1
+        self._count("render")
+        self._account(len(body))
+        return body
+
+    def _account(self, size: int):
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += size
+                if self._disk_bytes <= self.max_disk_bytes:
+                    return
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        for path in self.root.iterdir():
+            if ".tmp" in path.name:
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+        self._disk_bytes = total
@@ -0,0 +1,273 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, NamedTuple
+
+from .job_runner import NO_LIMITS, Job, JobJournal, JobResult, StageLimits, run_job
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+VIDEO_EXTENSIONS = {".mp4", ".webm", ".mov", ".m4v"}
+# Names written while a copy is in progress, or by other tools
+IGNORED_SUFFIXES = {".part", ".tmp", ".crdownload"}
+JOURNAL_NAME = ".smartqr-journal.jsonl"
+
+# inotify(7)
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+_EVENT_HEADER = struct.Struct("iIII")
+# Even with inotify, rescan now and then: events can be missed (queue overflow, network shares)
+RESCAN_INTERVAL = 60.0
+
+
+class _Inotify:
+    """Events for the entries of one directory, through the Linux inotify API (via ctypes)."""
+
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self, directory: Path):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"Could not watch {directory}")
+
+    def read(self, timeout: float) -> list[str] | None:
+        """Names that changed within 'timeout' seconds ([] if none), or None when events were lost."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        names = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            _, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            if mask & IN_Q_OVERFLOW:
+                return None
+            names.append(os.fsdecode(data[offset:offset + length].rstrip(b"\0")))
+            offset += length
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FileState(NamedTuple):
+    size: int
+    mtime_ns: int
+    # When this size/mtime was first seen (time.monotonic())
+    seen_at: float
+
+
+class FolderWatcher:
+    """
+    Tracks the images and videos of one folder (not its subfolders), grouped by
+    file stem, so 'beach.jpg' and 'beach.mp4' form one group. A group is settled
+    once none of its files has changed for 'settle' seconds, which both waits for
+    copies to finish and merges bursts of changes into one job. An image without
+    a video waits 'pair_wait' seconds more, so a video copied right after it
+    still joins its group instead of making a job of its own.
+
+    Uses inotify where available and polls every 'poll_interval' seconds otherwise
+    (or when use_inotify is False, e.g. for network shares).
+    """
+
+    def __init__(self, folder: Path, settle: float = 2.0, poll_interval: float = 2.0, use_inotify: bool = True,
+                 pair_wait: float = 5.0):
+        self.folder = Path(folder)
+        self.settle = settle
+        self.pair_wait = pair_wait
+        self.poll_interval = poll_interval
+        self._files: dict[str, FileState] = {}
+        # Stems changed since their group was last handed out
+        self._dirty: set[str] = set()
+        self._inotify = None
+        if use_inotify:
+            try:
+                self._inotify = _Inotify(self.folder)
+            except (OSError, AttributeError):
+                self._inotify = None
+        self._last_scan = 0.0
+        self._scan(initial=True)
+
+    @property
+    def mode(self) -> str:
+        return "inotify" if self._inotify else "polling"
+
+    def _watched(self, name: str) -> bool:
+        suffix = os.path.splitext(name)[1].lower()
+        return (not name.startswith((".", "~")) and suffix not in IGNORED_SUFFIXES
+                and suffix in IMAGE_EXTENSIONS | VIDEO_EXTENSIONS)
+
+    def _update(self, name: str, now: float, initial: bool = False):
+        try:
+            st = os.stat(self.folder / name)
+        except OSError:
+            if self._files.pop(name, None) is not None:
+                self._dirty.add(Path(name).stem)
+            return
+        old = self._files.get(name)
+        if old is not None and (old.size, old.mtime_ns) == (st.st_size, st.st_mtime_ns):
+            return
+        # Files that were already there untouched for a while (a backlog) count as settled right away
+        if initial and time.time() - st.st_mtime > self.settle:
+            now -= self.settle
+        self._files[name] = FileState(st.st_size, st.st_mtime_ns, now)
+        self._dirty.add(Path(name).stem)
+
+    def _scan(self, initial: bool = False):
+        now = time.monotonic()
+        with os.scandir(self.folder) as entries:
+            names = {e.name for e in entries if e.is_file() and self._watched(e.name)}
+        for name in names | set(self._files):
+            self._update(name, now, initial)
+        self._last_scan = now
+
+    def poll(self, timeout: float):
+        """Waits up to 'timeout' seconds for changes and records them."""
+        if self._inotify is None:
+            time.sleep(max(0.0, min(timeout, self._last_scan + self.poll_interval - time.monotonic())))
+            if time.monotonic() - self._last_scan >= self.poll_interval:
+                self._scan()
+            return
+        names = self._inotify.read(timeout)
+        if names is None or time.monotonic() - self._last_scan >= RESCAN_INTERVAL:
+            self._scan()
+            return
+        now = time.monotonic()
+        for name in set(names):
+            if self._watched(name):
+                self._update(name, now)
+
+    def settled_groups(self) -> list[dict[str, Path]]:
+        """
+        Groups that changed and have since settled, as {'image': ..., 'video': ...}
+        (either may be missing). Each is returned once per change.
+        """
+        now = time.monotonic()
+        by_stem: dict[str, list[str]] = {}
+        for name in self._files:
+            stem = Path(name).stem
+            if stem in self._dirty:
+                by_stem.setdefault(stem, []).append(name)
+
+        groups = []
+        for stem in list(self._dirty):
+            names = by_stem.get(stem, [])
+            images_only = bool(names) and all(Path(n).suffix.lower() in IMAGE_EXTENSIONS for n in names)
+            settle = self.settle + self.pair_wait if images_only else self.settle
+            if any(now - self._files[name].seen_at < settle for name in names):
+                continue
+            self._dirty.discard(stem)
+            group = {}
+            for name in sorted(names):
+                kind = "image" if Path(name).suffix.lower() in IMAGE_EXTENSIONS else "video"
+                group.setdefault(kind, self.folder / name)
+            if group:
+                groups.append(group)
+        return groups
+
+    def state_of(self, path: Path) -> FileState | None:
+        return self._files.get(path.name)
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+
+def job_key(job: Job, watcher: FolderWatcher) -> str:
+    """Identifies a job by its type and the exact versions of its input files."""
+    parts = [job.kind]
+    for field in ("image", "media", "video"):
+        path = job.params.get(field)
+        if path is not None:
+            state = watcher.state_of(path)
+            parts.append(f"{path.name}:{state.size}:{state.mtime_ns}" if state else path.name)
+    return "|".join(parts)
+
+
+def watch(
+        watcher: FolderWatcher,
+        job_for_group: Callable[[dict[str, Path]], Job | None],
+        handlers: dict[str, Callable[[dict, StageLimits], object]],
+        journal: JobJournal,
+        report: Callable[[JobResult | None, str], None],
+        workers: int = 4,
+        limits: StageLimits = NO_LIMITS,
+        stop: threading.Event | None = None
+):
+    """
+    Turns settled file groups into jobs (job_for_group() returns None to skip a
+    group) and runs them on a thread pool until 'stop' is set. Jobs recorded as
+    done in the journal are skipped, so a restart only does what is left; jobs
+    still running when stopping are run again next time. report(result, key) is
+    called from the worker threads as jobs finish, and with None when a job is
+    skipped.
+
+    At most two jobs per worker are queued or running at once: a big drop waits
+    in the folder, not as queued jobs in memory.
+    """
+    stop = stop or threading.Event()
+    submitted: set[str] = set()
+    line_no = 0
+    slots = threading.BoundedSemaphore(workers * 2)
+
+    def finish(future, key: str):
+        slots.release()
+        if future.cancelled():
+            return
+        result = future.result()
+        if result.ok:
+            journal.record(key, "done", output=result.output, seconds=round(result.elapsed, 3))
+        else:
+            journal.record(key, "failed", error=result.error)
+        report(result, key)
+
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        while not stop.is_set():
+            for group in watcher.settled_groups():
+                job = job_for_group(group)
+                if job is None:
+                    continue
+                key = job_key(job, watcher)
+                if key in submitted:
+                    continue
+                submitted.add(key)
+                if journal.is_done(key):
+                    report(None, key)
+                    continue
+                while not slots.acquire(timeout=0.5):
+                    if stop.is_set():
+                        # Not recorded as started: the next run picks it up
+                        return
+                line_no += 1
+                job = job._replace(line_no=line_no)
+                journal.record(key, "started")
+                future = pool.submit(run_job, job, handlers, limits)
+                future.add_done_callback(lambda f, key=key: finish(f, key))
+            watcher.poll(min(0.5, watcher.settle / 2 or 0.5))
+    finally:
+        # Queued jobs are dropped: they were never recorded as done, so the next run picks them up
+        pool.shutdown(wait=True, cancel_futures=True)
+        watcher.close()
@@ -0,0 +1,129 @@
+import hashlib
+import mimetypes
+from pathlib import Path
+from typing import Callable, NamedTuple
+
+from .encoders import ENCODERS, EncodeOptions
+from .media_store import MediaStore
+from .short_links import ShortLinkTable, qr_friendly_url
+from .utils import CORNERS
+from .variant_cache import VariantCache
+
+RENDER_PREFIX = "/render/"
+# Requested widths are rounded up to one of these, so the variants per image stay few
+RENDER_WIDTHS = (320, 480, 640, 828, 1080, 1440, 2048)
+SOURCE_SUFFIXES = (".jpg", ".jpeg", ".png", ".webp")
+# Part of every cache key: bump it when the rendering changes
+RENDER_VERSION = "1"
+
+
+class RenderRequest(NamedTuple):
+    image_id: str
+    code: str
+    corner: str
+    width: int
+    fmt: str
+
+
+class Variant(NamedTuple):
+    body: bytes
+    content_type: str
+    etag: str
+
+
+def snap_width(width: int) -> int:
+    return next((w for w in RENDER_WIDTHS if w >= width), RENDER_WIDTHS[-1])
+
+
+def _formats_by_suffix() -> dict[str, str]:
+    return {suffix.lstrip("."): fmt for fmt, (_, suffix) in ENCODERS.items()}
+
+
+def render_path(image_id: str, code: str, corner: str = "bottom-right", width: int = 1080, fmt: str = "webp") -> str:
+    """'/render/<image id>/<short code>/<corner>/<width>.<ext>'"""
+    return f"{RENDER_PREFIX}{image_id}/{code}/{corner}/{snap_width(width)}{ENCODERS[fmt][1]}"
+
+
+def parse_render_path(url_path: str) -> RenderRequest | None:
+    """The request in a render_path(), or None if 'url_path' is not a valid one."""
+    parts = url_path[len(RENDER_PREFIX):].split("/")
+    if not url_path.startswith(RENDER_PREFIX) or len(parts) != 4:
+        return None
+    image_id, code, corner, last = parts
+    width, _, ext = last.partition(".")
+    fmt = _formats_by_suffix().get(ext.lower())
+    if not (image_id.isalnum() and code.isalnum() and corner in CORNERS and width.isdigit() and fmt):
+        return None
+    return RenderRequest(image_id, code.upper(), corner, snap_width(int(width)), fmt)
+
+
+class WatermarkVariants:
+    """
+    Watermarked images rendered on demand, at the size and in the format a URL
+    asks for (see render_path()), instead of one full-size file per image.
+
+    Source images are kept in their own content-addressed 'sources' store (not
+    served as they are), so an image id always means the same pixels. The QR
+    content is a short code from 'short_links' on base_url(), which comes from
+    the configuration, never from the request: headers cannot choose the domain
+    in the code or multiply the variants to render. Results are kept in 'cache',
+    which renders each variant once however many phones ask for it at the same time.
+    """
+
+    def __init__(self, sources: MediaStore, short_links: ShortLinkTable, cache: VariantCache,
+                 base_url: Callable[[], str]):
+        self.sources = sources
+        self.short_links = short_links
+        self.cache = cache
+        self.base_url = base_url
+
+    def add_source(self, image: Path) -> str:
+        """Stores 'image' (if new) and returns its image id."""
+        return self.sources.store(image).stem
+
+    def _source_path(self, image_id: str) -> Path | None:
+        for suffix in SOURCE_SUFFIXES:
+            path = self.sources.root / f"{image_id}{suffix}"
+            if path.is_file():
+                return path
+        return None
+
+    def _key(self, request: RenderRequest, base_url: str) -> str:
+        # The configured base is in the key so a new LAN address is not served stale
+        # codes; it is one value per configuration, not per request
+        raw = "\0".join((RENDER_VERSION, base_url.lower(), *map(str, request)))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+    def peek(self, request: RenderRequest) -> Variant | None:
+        """The variant if it is in memory: cheap enough for an event loop."""
+        key = self._key(request, self.base_url())
+        body = self.cache.peek(key)
+        return self._variant(request, key, body) if body is not None else None
+
+    def get(self, request: RenderRequest) -> Variant | None:
+        """
+        The variant for 'request', rendering it if needed (blocking), or None for
+        an unknown image or code.
+        """
+        base_url = self.base_url()
+        key = self._key(request, base_url)
+        body = self.cache.peek(key)
+        if body is None:
+            # Looked up only on a miss: a hit was validated when it was rendered
+            source = self._source_path(request.image_id)
+            if source is None or self.short_links.resolve(request.code) is None:
+                return None
+            content = qr_friendly_url(base_url, request.code)
+
+            def render(dest: Path):
+                # Imported on first use: the server starts without numpy and qrcode
+                from .image_utils import render_qr_watermark
+                render_qr_watermark(source, content, dest, corner=request.corner, width=request.width,
+                                    encode=EncodeOptions(format=request.fmt))
+
+            body = self.cache.get(key, ENCODERS[request.fmt][1], render)
+        return self._variant(request, key, body)
+
+    def _variant(self, request: RenderRequest, key: str, body: bytes) -> Variant:
+        content_type = mimetypes.guess_type(f"x{ENCODERS[request.fmt][1]}")[0] or "application/octet-stream"
+        return Variant(body, content_type, f'"{key}"')